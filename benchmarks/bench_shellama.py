@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for the SheLLama REST API.
+
+Measures the file, directory, shell and git endpoints of
+docker/shellama_app_fix.py through two transports:
+
+    client  Flask's test client (no network, measures the handler itself)
+    server  a real threaded werkzeug server on 127.0.0.1 driven by requests
+
+Fixtures are generated in a scratch directory: directories with 10, 10k and
+1M entries, files from 1 KB to 100 MB and a synthetic git repository built
+with git fast-import.
+
+Results are written as JSON (see benchmarks/common.py) and compared with a
+baseline; the run fails when a metric is slower than the baseline by more
+than the threshold.
+
+Usage:
+    python benchmarks/bench_shellama.py --quick
+    python benchmarks/bench_shellama.py --update-baseline
+    python benchmarks/bench_shellama.py --threshold 0.3 --transports server
+"""
+
+import os
+import sys
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+import importlib.util
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import common
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "docker", "shellama_app_fix.py")
+DEFAULT_OUTPUT = os.path.join("bench-results", "shellama.json")
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, "benchmarks", "baselines", "shellama.json")
+
+SIZE_UNITS = {"": 1, "K": 1000, "M": 1000 ** 2, "G": 1000 ** 3,
+              "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+FULL = {
+    "list_sizes": "10,10k,1M",
+    "io_sizes": "1KB,1MB,10MB,100MB",
+    "git_files": "10k",
+    "git_commits": "1k",
+    "repeat": 5
+}
+QUICK = {
+    "list_sizes": "10,1k",
+    "io_sizes": "1KB,1MB",
+    "git_files": "500",
+    "git_commits": "50",
+    "repeat": common.MIN_SAMPLES
+}
+
+
+def parse_size(text):
+    """Parse "10", "10k", "1M" or "100MB" into an integer"""
+    value = text.strip().upper()
+    number = value.rstrip("KMGB")
+    unit = value[len(number):]
+    if not number or unit not in SIZE_UNITS:
+        raise ValueError(f"Invalid size: {text!r}")
+    return int(float(number) * SIZE_UNITS[unit])
+
+
+def parse_sizes(text):
+    """Parse a comma-separated list of sizes, keeping the original labels"""
+    return [(label.strip(), parse_size(label)) for label in text.split(",") if label.strip()]
+
+
+def load_app():
+    """Import docker/shellama_app_fix.py and create the Flask application"""
+    spec = importlib.util.spec_from_file_location("shellama_app_fix", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.create_app({"TESTING": True, "DEBUG": False})
+
+
+class ClientTransport:
+    """Send requests through Flask's test client"""
+
+    name = "client"
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, params=None, json=None):
+        response = self.client.open(path, method=method, query_string=params, json=json)
+        return response.status_code, response.get_data()
+
+    def close(self):
+        pass
+
+
+class ServerTransport:
+    """Send requests to a real werkzeug server running in a background thread"""
+
+    name = "server"
+
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.session = requests.Session()
+
+    def request(self, method, path, params=None, json=None):
+        response = self.session.request(method, self.base_url + path, params=params,
+                                        json=json, timeout=600)
+        return response.status_code, response.content
+
+    def close(self):
+        self.session.close()
+        self.server.shutdown()
+        self.thread.join()
+
+
+TRANSPORTS = {"client": ClientTransport, "server": ServerTransport}
+
+
+def make_listing_dir(path, count):
+    """Create a directory with count empty files"""
+    os.makedirs(path, exist_ok=True)
+    existing = len(os.listdir(path))
+    for i in range(existing, count):
+        with open(os.path.join(path, f"file_{i:07d}.txt"), "w"):
+            pass
+
+
+def make_io_file(path, size):
+    """Create a text file of the given size"""
+    line = ("x" * 63 + "\n").encode()
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            chunk = line * min(16384, remaining // len(line) + 1)
+            f.write(chunk[:remaining])
+            remaining -= min(len(chunk), remaining)
+
+
+def make_git_repo(path, files, commits):
+    """
+    Build a git repository with a given number of files and commits
+
+    The history is generated as a git fast-import stream: the first commit
+    adds all files and every following commit modifies one of them. Some
+    tracked files are then modified and a few untracked files created so git
+    status has something to report.
+    """
+    subprocess.run(["git", "init", "-q", path], check=True)
+    stream = []
+    for n in range(commits):
+        stream.append("commit refs/heads/master\n")
+        stream.append(f"committer Bench <bench@example.com> {1700000000 + n * 60} +0000\n")
+        message = f"Commit {n}"
+        stream.append(f"data {len(message)}\n{message}\n")
+        if n == 0:
+            targets = range(files)
+        else:
+            targets = [n % files]
+        for i in targets:
+            content = f"file {i} revision {n}\n"
+            stream.append(f"M 644 inline src/{i // 1000:03d}/module_{i}.py\n")
+            stream.append(f"data {len(content)}\n{content}\n")
+    subprocess.run(["git", "fast-import", "--quiet"], input="".join(stream).encode(),
+                   cwd=path, check=True)
+    subprocess.run(["git", "checkout", "-q", "-f", "master"], cwd=path, check=True)
+    for i in range(0, files, max(1, files // 20)):
+        with open(os.path.join(path, "src", f"{i // 1000:03d}", f"module_{i}.py"), "a") as f:
+            f.write("# local change\n")
+    for i in range(5):
+        with open(os.path.join(path, f"untracked_{i}.txt"), "w") as f:
+            f.write("untracked\n")
+
+
+def bench_call(transport, method, path, repeat, warmup, params=None, json=None):
+    """Time an endpoint, raising RuntimeError if it does not answer with 200"""
+    def call():
+        status, body = transport.request(method, path, params=params, json=json)
+        if status != 200:
+            raise RuntimeError(f"{method} {path} returned {status}: {body[:200]!r}")
+    return common.measure(call, repeat=repeat, warmup=warmup)
+
+
+def run_benchmarks(args, transport, results):
+    """Run every benchmark through one transport and add the metrics to results"""
+    benchmarks = []
+
+    for label, count in parse_sizes(args.list_sizes):
+        params = {"directory": f"list_{count}", "pattern": "*"}
+        benchmarks.append((f"list_files/{label}", "GET", "/files", params, None))
+        benchmarks.append((f"list_directories/{label}", "GET", "/directories",
+                           {"parent": f"list_{count}"}, None))
+    benchmarks.append(("list_directories/repo_recursive", "GET", "/directories",
+                       {"parent": "repo", "recursive": "true"}, None))
+
+    # Write bodies are built only when their benchmark runs, so at most one
+    # of them (up to 100 MB) is held in memory at a time
+    for label, size in parse_sizes(args.io_sizes):
+        benchmarks.append((f"read_file/{label}", "GET", f"/files/io_{size}.txt", None, None))
+        benchmarks.append((f"write_file/{label}", "PUT", f"/files/out_{size}.txt", None,
+                           lambda size=size: {"content": "y" * size}))
+
+    benchmarks.append(("shell/roundtrip", "POST", "/shell", None,
+                       {"command": "true", "working_dir": "."}))
+
+    benchmarks.append(("git_status", "GET", "/git/status", {"repo_path": "repo"}, None))
+    benchmarks.append(("git_log/100", "GET", "/git/log", {"repo_path": "repo", "max_count": 100},
+                       None))
+
+    failures = []
+    for name, method, path, params, body in benchmarks:
+        metric = f"{name}/{transport.name}"
+        if callable(body):
+            body = body()
+        try:
+            samples = bench_call(transport, method, path, args.repeat, args.warmup,
+                                 params=params, json=body)
+        except (RuntimeError, requests.RequestException) as e:
+            print(f"  {metric:<40} FAILED: {e}")
+            failures.append(metric)
+            continue
+        common.add_metric(results, metric, samples)
+        print(f"  {metric:<40} median {sorted(samples)[len(samples) // 2] * 1000:10.3f} ms")
+    return failures
+
+
+def prepare_fixtures(args):
+    """Create all fixtures in the working directory"""
+    for label, count in parse_sizes(args.list_sizes):
+        print(f"Preparing directory with {label} entries...")
+        make_listing_dir(f"list_{count}", count)
+    for label, size in parse_sizes(args.io_sizes):
+        print(f"Preparing {label} file...")
+        make_io_file(f"io_{size}.txt", size)
+    if not os.path.isdir("repo"):
+        files = parse_size(args.git_files)
+        commits = parse_size(args.git_commits)
+        print(f"Preparing git repository with {files} files and {commits} commits...")
+        make_git_repo("repo", files, max(1, commits))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the SheLLama REST API")
+    parser.add_argument("--quick", action="store_true",
+                        help="Use small fixtures and fewer repeats (for CI smoke runs)")
+    parser.add_argument("--list-sizes", help=f"Directory sizes for list_files (default: {FULL['list_sizes']})")
+    parser.add_argument("--io-sizes", help=f"File sizes for reads and writes (default: {FULL['io_sizes']})")
+    parser.add_argument("--git-files", help=f"Files in the synthetic git repository (default: {FULL['git_files']})")
+    parser.add_argument("--git-commits", help=f"Commits in the synthetic git repository (default: {FULL['git_commits']})")
+    parser.add_argument("--repeat", type=int, help=f"Timed calls per metric (default: {FULL['repeat']})")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed calls per metric")
+    parser.add_argument("--transports", default="client,server",
+                        help="Comma-separated transports: client, server")
+    parser.add_argument("--workdir", help="Directory for fixtures (default: a temporary directory)")
+    parser.add_argument("--keep-workdir", action="store_true", help="Do not delete the fixtures afterwards")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Where to write the results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Allowed slowdown before a metric counts as regressed (0.2 = 20%%)")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Store the results as the new baseline")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Keep SheLLama's per-request logging enabled")
+    args = parser.parse_args(argv)
+
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    defaults = QUICK if args.quick else FULL
+    for key, value in defaults.items():
+        if getattr(args, key) is None:
+            setattr(args, key, value)
+
+    if args.repeat < common.MIN_SAMPLES:
+        print(f"WARNING: --repeat {args.repeat} is below {common.MIN_SAMPLES}; "
+              f"the baseline comparison cannot detect regressions.")
+
+    transports = [name.strip() for name in args.transports.split(",") if name.strip()]
+    unknown = [name for name in transports if name not in TRANSPORTS]
+    if unknown:
+        parser.error(f"Unknown transport(s): {', '.join(unknown)}")
+    try:
+        parse_sizes(args.list_sizes)
+        parse_sizes(args.io_sizes)
+        parse_size(args.git_files)
+        parse_size(args.git_commits)
+    except ValueError as e:
+        parser.error(str(e))
+
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline)
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="shellama-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    previous_dir = os.getcwd()
+    os.chdir(workdir)
+
+    results = common.new_results("shellama")
+    failures = []
+    try:
+        prepare_fixtures(args)
+        app = load_app()
+        for name in transports:
+            print(f"\nTransport: {name}")
+            transport = TRANSPORTS[name](app)
+            try:
+                failures.extend(run_benchmarks(args, transport, results))
+            finally:
+                transport.close()
+    finally:
+        os.chdir(previous_dir)
+        if not args.workdir and not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+        elif args.keep_workdir or args.workdir:
+            print(f"\nFixtures kept in {workdir}")
+
+    common.save_results(results, output)
+    print(f"\nResults written to {output}")
+
+    if args.update_baseline:
+        common.save_results(results, baseline_path)
+        print(f"Baseline updated: {baseline_path}")
+        return 1 if failures else 0
+
+    baseline = common.load_results(baseline_path)
+    if baseline is None:
+        print(f"No baseline at {baseline_path}; run with --update-baseline to create one.")
+        return 1 if failures else 0
+
+    print()
+    rows = common.compare_to_baseline(results, baseline, args.threshold)
+    common.print_comparison(rows, args.threshold)
+    if failures:
+        print(f"{len(failures)} benchmark(s) failed.")
+    regressed = any(row["regressed"] for row in rows) or common.underpowered_metrics(rows)
+    return 1 if failures or regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared helpers for PyLama ecosystem benchmarks.
+
+Benchmark results are stored as JSON documents of the form
+
+    {
+        "suite": "shellama",
+        "timestamp": "2026-01-01T12:00:00",
+        "environment": {...},
+        "metrics": {
+            "list_files/10k/server": {"unit": "s", "better": "lower", "samples": [...]}
+        }
+    }
+
+Every metric keeps all of its repeated samples so later comparisons can
+take run-to-run noise into account. A baseline is simply a results document
+that has been accepted as the reference.
+
+A metric only counts as regressed when its median is worse than the
+baseline by more than the threshold *and* the difference is statistically
+significant: the Mann-Whitney U test rejects "same distribution" and the
+bootstrap confidence interval of the relative change excludes zero.
+With fewer than MIN_SAMPLES samples on either side the test can never reach
+significance, so such comparisons are flagged as underpowered instead of
+silently passing.
+"""
+
+import os
+import json
+import math
+import time
+import random
+import fnmatch
+import platform
+import datetime
+import statistics
+
+
+def measure(fn, repeat=5, warmup=1):
+    """
+    Time repeated calls of a function
+
+    Args:
+        fn (callable): Function to time; called without arguments
+        repeat (int): Number of timed calls
+        warmup (int): Number of untimed calls before timing
+
+    Returns:
+        list: Wall-clock duration of each timed call in seconds
+    """
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def environment():
+    """Return a description of the machine the benchmarks ran on"""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count()
+    }
+
+
+def new_results(suite):
+    """Return an empty results document for a suite"""
+    return {
+        "suite": suite,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "metrics": {}
+    }
+
+
+def add_metric(results, name, samples, unit="s", better="lower"):
+    """
+    Add the samples of a metric to a results document
+
+    Args:
+        results (dict): Results document
+        name (str): Metric name, e.g. "list_files/10k/server"
+        samples (list): Measured values
+        unit (str): Unit of the values
+        better (str): "lower" or "higher"
+    """
+    results["metrics"][name] = {"unit": unit, "better": better, "samples": list(samples)}
+
+
+def load_results(path):
+    """Load a results document, or return None if the file does not exist"""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(results, path):
+    """Write a results document, creating parent directories as needed"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# Fewest samples per side a comparison needs. The smallest two-sided p-value
+# of the Mann-Whitney U test is 2 / C(n1 + n2, n1): 0.1 for 3 against 3,
+# 0.029 for 4 against 4 and 0.008 for 5 against 5.
+MIN_SAMPLES = 5
+
+
+def min_p_value(n1, n2):
+    """Return the smallest two-sided Mann-Whitney p-value possible for two sample sizes"""
+    if not n1 or not n2:
+        return 1.0
+    return min(1.0, 2 / math.comb(n1 + n2, n1))
+
+
+def mann_whitney_u(a, b):
+    """
+    Two-sided Mann-Whitney U test
+
+    Uses the exact distribution of U for small samples without ties and the
+    normal approximation with tie correction otherwise.
+
+    Args:
+        a (list): First sample
+        b (list): Second sample
+
+    Returns:
+        tuple: (U statistic of a, two-sided p-value)
+    """
+    n1, n2 = len(a), len(b)
+    if not n1 or not n2:
+        return 0.0, 1.0
+    combined = sorted([(value, 0) for value in a] + [(value, 1) for value in b])
+    ranks = [0.0] * len(combined)
+    tie_term = 0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        tie_term += (j - i + 1) ** 3 - (j - i + 1)
+        i = j + 1
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, combined) if group == 0)
+    u = rank_sum - n1 * (n1 + 1) / 2
+    u_min = min(u, n1 * n2 - u)
+
+    if not tie_term and n1 + n2 <= 40:
+        # counts[k] = number of arrangements with U == k
+        counts = [[[0] * (n1 * n2 + 1) for _ in range(n2 + 1)] for _ in range(n1 + 1)]
+        for i in range(n1 + 1):
+            for j in range(n2 + 1):
+                if i == 0 or j == 0:
+                    counts[i][j][0] = 1
+                    continue
+                for k in range(i * j + 1):
+                    counts[i][j][k] = (counts[i - 1][j][k - j] if k >= j else 0) + counts[i][j - 1][k]
+        total = math.comb(n1 + n2, n1)
+        p = 2 * sum(counts[n1][n2][:int(u_min) + 1]) / total
+        return u, min(1.0, p)
+
+    n = n1 + n2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+    if sigma == 0:
+        return u, 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / sigma
+    p = math.erfc(max(z, 0.0) / math.sqrt(2))
+    return u, min(1.0, p)
+
+
+def bootstrap_ci(baseline, current, confidence=0.95, iterations=2000, seed=0):
+    """
+    Bootstrap confidence interval of the relative change of the median
+
+    Args:
+        baseline (list): Baseline samples
+        current (list): Current samples
+        confidence (float): Confidence level of the interval
+        iterations (int): Number of bootstrap resamples
+        seed (int): Seed, so reports are reproducible
+
+    Returns:
+        tuple: (low, high) relative change, e.g. (0.05, 0.12) for +5%..+12%
+    """
+    rng = random.Random(seed)
+    changes = []
+    for _ in range(iterations):
+        base = statistics.median(rng.choices(baseline, k=len(baseline)))
+        value = statistics.median(rng.choices(current, k=len(current)))
+        changes.append((value - base) / base if base else 0.0)
+    changes.sort()
+    tail = (1 - confidence) / 2
+    low = changes[int(tail * (iterations - 1))]
+    high = changes[int(math.ceil((1 - tail) * (iterations - 1)))]
+    return low, high
+
+
+def compare_to_baseline(results, baseline, threshold=0.2, alpha=0.05, metrics=None):
+    """
+    Compare current results with a baseline, filtering out noise
+
+    A metric regresses when its median is worse than the baseline median by
+    more than the threshold (a fraction, 0.2 = 20%), the Mann-Whitney U test
+    gives p < alpha and the bootstrap confidence interval of the change lies
+    entirely on the worse side of zero.
+
+    A metric with fewer than MIN_SAMPLES samples on either side, or whose
+    sample sizes cannot give p < alpha at all, is flagged "underpowered":
+    it can never be reported as regressed.
+
+    Args:
+        results (dict): Current results document
+        baseline (dict): Baseline results document
+        threshold (float): Allowed relative change
+        alpha (float): Significance level
+        metrics (list): fnmatch patterns of metrics that may fail the
+            comparison; other metrics are reported but never flagged.
+            None gates every metric.
+
+    Returns:
+        list: One dictionary per metric present in both documents with the
+            baseline and current medians, the relative change, its
+            confidence interval, the p-value and "significant", "gated",
+            "underpowered" and "regressed" flags
+    """
+    rows = []
+    for name, metric in sorted(results["metrics"].items()):
+        reference = baseline["metrics"].get(name)
+        if not reference or not reference["samples"] or not metric["samples"]:
+            continue
+        base = statistics.median(reference["samples"])
+        current = statistics.median(metric["samples"])
+        change = (current - base) / base if base else 0.0
+        lower_is_better = metric.get("better", "lower") == "lower"
+        worse = change if lower_is_better else -change
+        _, p_value = mann_whitney_u(reference["samples"], metric["samples"])
+        ci_low, ci_high = bootstrap_ci(reference["samples"], metric["samples"], 1 - alpha)
+        excludes_zero = ci_low > 0 if lower_is_better else ci_high < 0
+        significant = p_value < alpha and excludes_zero
+        gated = metrics is None or any(fnmatch.fnmatch(name, pattern) for pattern in metrics)
+        n1, n2 = len(reference["samples"]), len(metric["samples"])
+        underpowered = min(n1, n2) < MIN_SAMPLES or min_p_value(n1, n2) >= alpha
+        rows.append({
+            "metric": name,
+            "unit": metric.get("unit", "s"),
+            "better": metric.get("better", "lower"),
+            "baseline": base,
+            "current": current,
+            "change": change,
+            "ci_low": ci_low,
+            "ci_high": ci_high,
+            "p_value": p_value,
+            "significant": significant,
+            "gated": gated,
+            "underpowered": underpowered,
+            "regressed": gated and significant and worse > threshold
+        })
+    return rows
+
+
+def print_comparison(rows, threshold):
+    """Print a baseline comparison as a table"""
+    if not rows:
+        print("No metrics in common with the baseline.")
+        return
+    width = max(len(row["metric"]) for row in rows)
+    print(f"{'metric':<{width}} {'baseline':>12} {'current':>12} {'change':>9} "
+          f"{'95% CI':>17} {'p':>7}")
+    print("-" * (width + 63))
+    for row in rows:
+        flag = "  REGRESSION" if row["regressed"] else "  UNDERPOWERED" if row["underpowered"] else ""
+        ci = f"{row['ci_low'] * 100:+.1f}..{row['ci_high'] * 100:+.1f}%"
+        print(f"{row['metric']:<{width}} {row['baseline']:>12.6f} {row['current']:>12.6f} "
+              f"{row['change'] * 100:>+8.1f}% {ci:>17} {row['p_value']:>7.3f}{flag}")
+    regressions = sum(row["regressed"] for row in rows)
+    print(f"\n{regressions} of {len(rows)} metrics regressed significantly by more than "
+          f"{threshold * 100:.0f}%.")
+    underpowered = underpowered_metrics(rows)
+    if underpowered:
+        print(f"WARNING: {len(underpowered)} gated metric(s) have fewer than {MIN_SAMPLES} samples in the "
+              f"baseline or the results, so no regression could be detected: {', '.join(underpowered)}. "
+              f"Rerun with more repeats and update the baseline.")
+
+
+def underpowered_metrics(rows):
+    """Return the names of the gated metrics of a comparison that cannot detect a regression"""
+    return [row["metric"] for row in rows if row["gated"] and row["underpowered"]]
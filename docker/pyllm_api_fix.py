@@ -7,17 +7,48 @@ This module provides a FastAPI server for interacting with LLM models.
 """
 
 import os
+import re
 import sys
+import json
+import time
+import ast
+import asyncio
+import difflib
+import hashlib
+import functools
+import textwrap
+import threading
 import uvicorn
-from fastapi import FastAPI, HTTPException, Depends
+from contextlib import asynccontextmanager
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, Any, List
 
 # Use relative import instead of absolute import
 from .models import ModelManager
 
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Build the model manager at startup and warm the models up.
+    
+    The server accepts requests as soon as the manager exists; the warm-up
+    runs in the background and /ready reports when it has finished.
+    """
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(backend_executor, get_model_manager)
+    task = asyncio.ensure_future(warm_up())
+    try:
+        yield
+    finally:
+        task.cancel()
+
 # Create FastAPI app
 app = FastAPI(
+    lifespan=lifespan,
     title="PyLLM API",
     description="""
     PyLLM API - A REST API for interacting with LLM models.
@@ -27,8 +58,702 @@ app = FastAPI(
     version="0.1.0"
 )
 
-# Initialize model manager
+# Initialize model manager; it is built once, at startup or on first use
 model_manager = None
+model_manager_lock = threading.Lock()
+
+def get_model_manager():
+    """Return the model manager, building it if needed."""
+    global model_manager
+    if model_manager is None:
+        with model_manager_lock:
+            if model_manager is None:
+                model_manager = ModelManager()
+    return model_manager
+
+# At startup each model of PYLLM_PRELOAD_MODELS ("llama3,codellama", default
+# llama3, empty for none) runs a one-token generation, so it is loaded before
+# the first request needs it. /ready answers 503 until that warm-up has
+# finished.
+PRELOAD_MODELS = [name.strip() for name in os.environ.get("PYLLM_PRELOAD_MODELS", "llama3").split(",")
+                  if name.strip()]
+WARMUP_PROMPT = "Hello"
+warmup = {"ready": False, "models": {}, "seconds": None}
+
+async def warm_up(models=None):
+    """
+    Run a short generation on each model to load it.
+    
+    Failures are recorded in warmup["models"] but don't keep the API from
+    becoming ready, since the backend may load the model on the next call.
+    """
+    start = time.perf_counter()
+    for model in PRELOAD_MODELS if models is None else models:
+        try:
+            await run_model_call(model, model_manager.query_model, WARMUP_PROMPT, model, 1, 0.0)
+            warmup["models"][model] = "ok"
+        except Exception as e:
+            warmup["models"][model] = str(e)
+    warmup["seconds"] = time.perf_counter() - start
+    warmup["ready"] = True
+
+# Backend calls are blocking, so they run in a bounded thread pool instead of
+# on the event loop. PYLLM_MAX_WORKERS bounds the total number of in-flight
+# generations; PYLLM_MODEL_CONCURRENCY bounds them per model and
+# PYLLM_MODEL_LIMITS overrides it for single models ("llama3=2,codellama=1").
+MAX_WORKERS = int(os.environ.get("PYLLM_MAX_WORKERS", "32"))
+MODEL_CONCURRENCY = int(os.environ.get("PYLLM_MODEL_CONCURRENCY", "4"))
+
+def parse_model_limits(spec):
+    """
+    Parse per-model concurrency limits such as "llama3=2,codellama:13b=1".
+    
+    Args:
+        spec (str): Comma-separated model=limit pairs.
+        
+    Returns:
+        dict: Limit per model name.
+    """
+    limits = {}
+    for part in (spec or "").split(","):
+        name, sep, limit = part.strip().rpartition("=")
+        if sep and name:
+            limits[name] = max(1, int(limit))
+    return limits
+
+MODEL_LIMITS = parse_model_limits(os.environ.get("PYLLM_MODEL_LIMITS", ""))
+
+backend_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="pyllm-backend")
+model_semaphores = {}
+
+def get_model_semaphore(model):
+    """Return the semaphore limiting concurrent generations of a model."""
+    semaphore = model_semaphores.get(model)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MODEL_LIMITS.get(model, MODEL_CONCURRENCY))
+        model_semaphores[model] = semaphore
+    return semaphore
+
+async def run_model_call(model, func, *args, timings=None):
+    """
+    Run a blocking backend call without blocking the event loop.
+    
+    The call waits for a free slot of its model and then runs in the
+    backend thread pool, so slow generations never stall other requests.
+    A running call cannot be interrupted: when the caller is cancelled,
+    the slot is kept until the call has returned.
+    
+    Args:
+        model (str): The model the call uses, for the concurrency limit.
+        func (callable): The blocking function to call.
+        *args: Arguments for func.
+        timings (dict, optional): Filled with "queue_wait", the seconds
+            until a slot of the model was free.
+        
+    Returns:
+        The return value of func.
+    """
+    start = time.perf_counter()
+    async with get_model_semaphore(model):
+        if timings is not None:
+            timings["queue_wait"] = time.perf_counter() - start
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(backend_executor, functools.partial(func, *args))
+        try:
+            return await asyncio.shield(future)
+        finally:
+            # Keep the model slot until the backend has actually returned
+            while not future.done():
+                try:
+                    await asyncio.shield(future)
+                except BaseException:
+                    pass
+
+async def stream_model(model, prompt, max_tokens, temperature, timings=None):
+    """
+    Stream the output of a generation as it is produced.
+    
+    Uses model_manager.query_model_stream (a blocking iterator of text
+    chunks) when the backend provides it; otherwise the complete
+    query_model result is yielded as a single chunk. The backend runs in the
+    backend thread pool under the model's concurrency limit. Closing the
+    generator early (client disconnect, early stop) stops the backend
+    iterator at its next chunk.
+    
+    Args:
+        model (str): The model to query.
+        prompt (str): The prompt.
+        max_tokens (int): Maximum number of tokens to generate.
+        temperature (float): Sampling temperature.
+        timings (dict, optional): Filled with "queue_wait" (seconds until a
+            backend slot was free) and "first_chunk" (seconds until the first
+            chunk, from the call of stream_model).
+        
+    Yields:
+        str: Text chunks.
+    """
+    timings = {} if timings is None else timings
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stopped = threading.Event()
+    finished = object()
+    start = time.perf_counter()
+    
+    def put(item):
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+    
+    def produce():
+        try:
+            query_stream = getattr(model_manager, "query_model_stream", None)
+            if query_stream is None:
+                put(model_manager.query_model(prompt, model, max_tokens, temperature))
+                return
+            chunks = query_stream(prompt, model, max_tokens, temperature)
+            try:
+                for chunk in chunks:
+                    if stopped.is_set():
+                        break
+                    if chunk:
+                        put(chunk)
+            finally:
+                close = getattr(chunks, "close", None)
+                if close is not None:
+                    close()
+        except Exception as e:
+            put(e)
+        finally:
+            put(finished)
+    
+    async with get_model_semaphore(model):
+        timings["queue_wait"] = time.perf_counter() - start
+        future = loop.run_in_executor(backend_executor, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is finished:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                if "first_chunk" not in timings:
+                    timings["first_chunk"] = time.perf_counter() - start
+                yield item
+        finally:
+            stopped.set()
+            # Keep the model slot until the backend has actually stopped
+            try:
+                await asyncio.shield(future)
+            except BaseException:
+                pass
+
+STREAM_MEDIA_TYPES = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson"
+}
+
+def format_stream_event(stream_format, event, data):
+    """
+    Encode one streaming event.
+    
+    Args:
+        stream_format (str): "sse" for Server-Sent Events, "ndjson" for
+            newline-delimited JSON.
+        event (str): The event type ("chunk", "done" or "error").
+        data (dict): The event payload.
+        
+    Returns:
+        str: The encoded event.
+    """
+    if stream_format == "ndjson":
+        return json.dumps({"type": event, **data}) + "\n"
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def streaming_response(chunks, stream_format, summarize, headers=None):
+    """
+    Build a streaming HTTP response from an async iterator of text chunks.
+    
+    The first chunk is awaited before the response starts, so backend
+    errors before any output still produce an HTTP 500 and the time to the
+    first byte equals the backend's time to the first token. After the last
+    chunk a "done" event carries summarize(full_text); errors during the
+    stream are sent as an "error" event.
+    
+    Args:
+        chunks: Async iterator of text chunks.
+        stream_format (str): "sse" or "ndjson".
+        summarize (callable): Returns the payload of the "done" event from
+            the complete text.
+        headers (dict, optional): Additional response headers.
+        
+    Returns:
+        StreamingResponse: The response.
+    """
+    if stream_format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown stream_format: {stream_format}")
+    iterator = chunks.__aiter__()
+    try:
+        first = await iterator.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def events():
+        parts = []
+        try:
+            if first is not None:
+                parts.append(first)
+                yield format_stream_event(stream_format, "chunk", {"text": first})
+                async for chunk in iterator:
+                    parts.append(chunk)
+                    yield format_stream_event(stream_format, "chunk", {"text": chunk})
+            yield format_stream_event(stream_format, "done", summarize("".join(parts)))
+        except Exception as e:
+            yield format_stream_event(stream_format, "error", {"detail": str(e)})
+        finally:
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+    
+    return StreamingResponse(events(), media_type=STREAM_MEDIA_TYPES[stream_format],
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **(headers or {})})
+
+def stream_timings(timings, start, text):
+    """Return the timing summary of a finished stream."""
+    total = time.perf_counter() - start
+    return {
+        "queue_wait": timings.get("queue_wait"),
+        "time_to_first_chunk": timings.get("first_chunk"),
+        "total": total,
+        "output_chars": len(text)
+    }
+
+# Identical requests (CI bots and editors resubmitting the same /fix-code
+# payload) are answered from an in-memory cache. Only requests sampled at a
+# temperature of at most PYLLM_CACHE_MAX_TEMPERATURE are cached, since others
+# are expected to vary between calls. PYLLM_CACHE_SIZE=0 disables the cache.
+CACHE_SIZE = int(os.environ.get("PYLLM_CACHE_SIZE", "1024"))
+CACHE_TTL = float(os.environ.get("PYLLM_CACHE_TTL", "3600"))
+CACHE_MAX_TEMPERATURE = float(os.environ.get("PYLLM_CACHE_MAX_TEMPERATURE", "0.5"))
+
+class ResponseCache:
+    """
+    Size-bounded LRU cache of generated texts with a time to live.
+
+    Args:
+        max_entries (int): Maximum number of entries; the least recently used
+            entry is evicted first.
+        ttl (float): Seconds an entry stays valid; 0 means forever.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "bypassed": 0}
+
+    @staticmethod
+    def make_key(endpoint, model, prompt, **params):
+        """Return a canonical hash of a request."""
+        request = {"endpoint": endpoint, "model": model, "prompt": prompt, "params": params}
+        canonical = json.dumps(request, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the cached text of key, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl and time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                self.counters["expired"] += 1
+                entry = None
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[1]
+
+    def put(self, key, text):
+        """Store text under key, evicting the least recently used entries."""
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic(), text)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def count_bypass(self):
+        with self.lock:
+            self.counters["bypassed"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Return the counters and the current size."""
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "size": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hit_ratio": self.counters["hits"] / lookups if lookups else None
+            }
+
+response_cache = ResponseCache(CACHE_SIZE, CACHE_TTL)
+
+def cache_policy(temperature, enabled=True, cache_control=None):
+    """
+    Decide how a request uses the response cache.
+
+    Requests above CACHE_MAX_TEMPERATURE are never cached. A request can
+    bypass the cache with "cache": false or the Cache-Control header:
+    "no-cache" skips the lookup but stores the fresh result, "no-store" (like
+    "cache": false) skips both.
+
+    Args:
+        temperature (float): Sampling temperature of the request.
+        enabled (bool): The "cache" field of the request.
+        cache_control (str, optional): The Cache-Control request header.
+
+    Returns:
+        tuple: (lookup, store) booleans.
+    """
+    if response_cache.max_entries <= 0 or temperature > CACHE_MAX_TEMPERATURE:
+        return False, False
+    directives = {d.strip().lower() for d in (cache_control or "").split(",")}
+    if not enabled or "no-store" in directives:
+        response_cache.count_bypass()
+        return False, False
+    if "no-cache" in directives:
+        response_cache.count_bypass()
+        return False, True
+    return True, True
+
+class Flight:
+    """
+    One backend generation shared by all identical requests in flight.
+
+    The generation starts with the first follower. Its chunks are kept, so
+    followers that join late replay the output from the beginning. The
+    generation is cancelled only when every follower has gone away.
+
+    Args:
+        group (SingleFlight): The registry the flight belongs to.
+        key: The key of the flight in the registry.
+        start (callable): Called with a timings dict, returns the async
+            iterator of text chunks of the generation.
+    """
+
+    def __init__(self, group, key, start):
+        self.group = group
+        self.key = key
+        self.start = start
+        self.timings = {}
+        self.chunks = []
+        self.error = None
+        self.done = False
+        self.waiters = 0
+        self.task = None
+        self.updated = asyncio.Event()
+
+    def notify(self):
+        updated, self.updated = self.updated, asyncio.Event()
+        updated.set()
+
+    async def run(self):
+        source = self.start(self.timings)
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self.notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self.group.discard(self)
+            self.notify()
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    async def follow(self, timings=None):
+        """
+        Yield the chunks of the generation, from the first one.
+
+        Args:
+            timings (dict, optional): Filled like the timings of stream_model,
+                from the point of view of this follower.
+        """
+        start = time.perf_counter()
+        self.waiters += 1
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        index = 0
+        try:
+            while True:
+                if index < len(self.chunks):
+                    chunk = self.chunks[index]
+                    index += 1
+                    if timings is not None and "first_chunk" not in timings:
+                        timings["queue_wait"] = self.timings.get("queue_wait", 0.0)
+                        timings["first_chunk"] = time.perf_counter() - start
+                    yield chunk
+                elif self.error is not None:
+                    raise self.error
+                elif self.done:
+                    return
+                else:
+                    await self.updated.wait()
+        finally:
+            self.waiters -= 1
+            if self.waiters == 0 and not self.done:
+                self.group.discard(self)
+                self.group.count("cancelled")
+                self.task.cancel()
+
+class SingleFlight:
+    """Registry of the generations in flight, by request key."""
+
+    def __init__(self):
+        self.flights = {}
+        self.counters = {"flights": 0, "coalesced": 0, "cancelled": 0}
+
+    def join(self, key, start):
+        """Return the flight of key, creating it with start if there is none."""
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = Flight(self, key, start)
+            self.count("flights")
+        else:
+            self.count("coalesced")
+        return flight
+
+    def discard(self, flight):
+        if self.flights.get(flight.key) is flight:
+            del self.flights[flight.key]
+
+    def count(self, counter):
+        self.counters[counter] += 1
+
+    def stats(self):
+        return {**self.counters, "in_flight": len(self.flights)}
+
+# Identical deterministic requests that arrive while one of them is being
+# generated share its backend call instead of starting their own.
+SINGLE_FLIGHT = os.environ.get("PYLLM_SINGLE_FLIGHT", "1").lower() not in ("0", "false", "no")
+
+single_flight = SingleFlight()
+
+def can_coalesce(temperature):
+    """Whether identical requests at this temperature may share one generation."""
+    return SINGLE_FLIGHT and temperature <= CACHE_MAX_TEMPERATURE
+
+# Non-streaming generations with the same model and sampling parameters are
+# collected for up to PYLLM_BATCH_WINDOW_MS, or until PYLLM_MAX_BATCH of them
+# are waiting, and sent to model_manager.query_model_batch in one call when
+# the backend has it. Other backends get one call per request, bounded by
+# the model limits.
+BATCH_WINDOW = float(os.environ.get("PYLLM_BATCH_WINDOW_MS", "10")) / 1000
+MAX_BATCH = int(os.environ.get("PYLLM_MAX_BATCH", "8"))
+
+def percentile(ordered, q):
+    """Return the q-quantile of an ordered list, or None if it is empty."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class MicroBatcher:
+    """
+    Groups concurrent generations into backend batches.
+
+    Args:
+        window (float): Seconds a batch waits for more requests after its
+            first request.
+        max_batch (int): Maximum number of prompts per batch; a full batch
+            is dispatched at once.
+        samples (int): Number of recent queue waits kept for the stats.
+    """
+
+    def __init__(self, window, max_batch, samples=1000):
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.pending = {}
+        self.timers = {}
+        self.tasks = set()
+        self.queue_waits = deque(maxlen=samples)
+        self.batch_sizes = Counter()
+        self.counters = {"requests": 0, "batches": 0, "single_calls": 0}
+
+    async def submit(self, model, prompt, max_tokens, temperature):
+        """Return the generated text of prompt, generated in a batch if possible."""
+        self.counters["requests"] += 1
+        if getattr(model_manager, "query_model_batch", None) is None or self.max_batch == 1:
+            self.counters["single_calls"] += 1
+            self.batch_sizes[1] += 1
+            timings = {}
+            try:
+                return await run_model_call(model, model_manager.query_model, prompt, model, max_tokens,
+                                            temperature, timings=timings)
+            finally:
+                if "queue_wait" in timings:
+                    self.queue_waits.append(timings["queue_wait"])
+
+        key = (model, max_tokens, temperature)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self.pending.setdefault(key, [])
+        batch.append((prompt, future, time.perf_counter()))
+        if len(batch) >= self.max_batch:
+            self.flush(key)
+        elif key not in self.timers:
+            self.timers[key] = loop.call_later(self.window, self.flush, key)
+        return await future
+
+    def flush(self, key):
+        """Dispatch the pending requests of key, skipping those already cancelled."""
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = [item for item in self.pending.pop(key, []) if not item[1].done()]
+        if batch:
+            task = asyncio.get_running_loop().create_task(self.dispatch(key, batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def dispatch(self, key, batch):
+        model, max_tokens, temperature = key
+        self.counters["batches"] += 1
+        self.batch_sizes[len(batch)] += 1
+        flushed = time.perf_counter()
+        timings = {}
+        try:
+            results = await run_model_call(model, model_manager.query_model_batch, [item[0] for item in batch],
+                                           model, max_tokens, temperature, timings=timings)
+            if len(results) != len(batch):
+                raise RuntimeError(f"query_model_batch returned {len(results)} results for {len(batch)} prompts")
+        except Exception as e:
+            results = [e] * len(batch)
+        finally:
+            slot_wait = timings.get("queue_wait", 0.0)
+            self.queue_waits.extend(flushed - enqueued + slot_wait for _, _, enqueued in batch)
+        for (_, future, _), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        """Return the counters, the batch size distribution and queue waits."""
+        waits = sorted(self.queue_waits)
+        dispatches = sum(self.batch_sizes.values())
+        return {
+            **self.counters,
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batch_size": {
+                "mean": sum(size * n for size, n in self.batch_sizes.items()) / dispatches if dispatches else None,
+                "max": max(self.batch_sizes) if self.batch_sizes else None,
+                "histogram": {str(size): n for size, n in sorted(self.batch_sizes.items())}
+            },
+            "queue_wait": {
+                "samples": len(waits),
+                "mean": sum(waits) / len(waits) if waits else None,
+                "p50": percentile(waits, 0.5),
+                "p95": percentile(waits, 0.95),
+                "max": waits[-1] if waits else None
+            }
+        }
+
+batcher = MicroBatcher(BATCH_WINDOW, MAX_BATCH)
+
+async def single_chunk(text):
+    """Yield text as the only chunk of a stream."""
+    yield text
+
+async def single_result(func, *args):
+    """Yield the result of await func(*args) as the only chunk of a stream."""
+    yield await func(*args)
+
+async def store_when_complete(chunks, key):
+    """Pass chunks through and cache the full text once the stream has finished."""
+    parts = []
+    async for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    response_cache.put(key, "".join(parts))
+
+async def generate(endpoint, model, prompt, max_tokens, temperature, policy):
+    """
+    Return the generated text of a prompt, using the response cache.
+
+    Args:
+        endpoint (str): The endpoint, part of the cache key.
+        model (str): The model to query.
+        prompt (str): The prompt.
+        max_tokens (int): Maximum number of tokens to generate.
+        temperature (float): Sampling temperature.
+        policy (tuple): (lookup, store) from cache_policy.
+
+    Returns:
+        tuple: (text, cache status "HIT", "MISS" or "BYPASS").
+    """
+    lookup, store = policy
+    key = ResponseCache.make_key(endpoint, model, prompt, max_tokens=max_tokens, temperature=temperature)
+    if lookup:
+        text = response_cache.get(key)
+        if text is not None:
+            return text, "HIT"
+    if can_coalesce(temperature):
+        flight = single_flight.join(("complete", key), lambda timings: single_result(
+            batcher.submit, model, prompt, max_tokens, temperature))
+        text = "".join([chunk async for chunk in flight.follow()])
+    else:
+        text = await batcher.submit(model, prompt, max_tokens, temperature)
+    if store:
+        response_cache.put(key, text)
+    return text, "MISS" if lookup else "BYPASS"
+
+def generate_stream(endpoint, model, prompt, max_tokens, temperature, policy, timings, stop_after_code=False,
+                    fence=None):
+    """
+    Streaming counterpart of generate.
+
+    A cache hit is streamed as a single chunk; a miss is cached only when
+    the stream completes. With stop_after_code the generation is stopped as
+    soon as its first code block is complete, and the text up to there is
+    what gets cached and shared; fence is the opening fence pattern of
+    that block (default: a Python block).
+
+    Returns:
+        tuple: (async iterator of text chunks, cache status).
+    """
+    def open_stream(stream_timings):
+        chunks = stream_model(model, prompt, max_tokens, temperature, stream_timings)
+        return until_code_block(chunks, fence) if stop_after_code else chunks
+
+    lookup, store = policy
+    key = ResponseCache.make_key(endpoint, model, prompt, max_tokens=max_tokens, temperature=temperature)
+    if lookup:
+        text = response_cache.get(key)
+        if text is not None:
+            timings.update(queue_wait=0.0, first_chunk=0.0)
+            return single_chunk(text), "HIT"
+    if can_coalesce(temperature):
+        flight = single_flight.join(("stream", key), lambda flight_timings: open_stream(flight_timings))
+        chunks = flight.follow(timings)
+    else:
+        chunks = open_stream(timings)
+    if store:
+        chunks = store_when_complete(chunks, key)
+    return chunks, "MISS" if lookup else "BYPASS"
 
 # Define request models
 class QueryRequest(BaseModel):
@@ -36,6 +761,9 @@ class QueryRequest(BaseModel):
     model: str = "llama3"
     max_tokens: int = 1000
     temperature: float = 0.7
+    stream: bool = False
+    stream_format: str = "sse"
+    cache: bool = True
 
 class CodeFixRequest(BaseModel):
     code: str
@@ -43,6 +771,14 @@ class CodeFixRequest(BaseModel):
     is_logic_error: bool = False
     attempt: int = 1
     prompt_type: Optional[str] = None
+    stream: bool = False
+    stream_format: str = "sse"
+    cache: bool = True
+    strategy: str = "sequential"
+    local_repair: bool = True
+    context: str = "full"
+    response_format: str = "code"
+    include_code: bool = False
 
 # Helper function to extract Python code from LLM response
 def extract_python_code(text):
@@ -55,8 +791,6 @@ def extract_python_code(text):
     Returns:
         str: The extracted Python code.
     """
-    import re
-    
     # Try to extract code from markdown code blocks
     pattern = r'```(?:python)?\n([\s\S]*?)\n```'
     matches = re.findall(pattern, text)
@@ -69,143 +803,1010 @@ def extract_python_code(text):
     # This handles cases where the LLM might not use markdown formatting
     return text.strip()
 
+class CodeFenceParser:
+    """
+    Incremental version of extract_python_code for streamed output.
+
+    Feed it the chunks of a completion; once the first code block is closed,
+    feed returns True and code holds what extract_python_code would return
+    for the complete text. Each chunk is scanned only once.
+
+    Args:
+        opening (re.Pattern, optional): Pattern of the opening fence, for
+            blocks other than Python code; it must not match more than
+            lookback characters.
+        lookback (int): Characters of the previous text rescanned for an
+            opening fence split across chunks.
+    """
+
+    OPENING = re.compile(r'```(?:python)?\n')
+    CLOSING = "\n```"
+
+    def __init__(self, opening=None, lookback=len("```python\n")):
+        self.opening = opening or self.OPENING
+        self.lookback = lookback
+        self.text = ""
+        self.scanned = 0
+        self.body_start = None
+        self.code = None
+
+    def feed(self, chunk):
+        """
+        Add a chunk of the completion.
+
+        Args:
+            chunk (str): The next text chunk.
+
+        Returns:
+            bool: Whether the first code block is complete.
+        """
+        if self.code is not None:
+            return True
+        # Fences may be split across chunks, so rescan the tail of the old text
+        rescan = max(0, len(self.text) - self.lookback)
+        self.text += chunk
+        if self.body_start is None:
+            opening = self.opening.search(self.text, min(self.scanned, rescan))
+            if opening is None:
+                self.scanned = len(self.text)
+                return False
+            self.body_start = self.scanned = opening.end()
+            rescan = self.body_start
+        close = self.text.find(self.CLOSING, max(self.body_start, min(self.scanned, rescan)))
+        self.scanned = len(self.text)
+        if close == -1:
+            return False
+        self.code = self.text[self.body_start:close].strip()
+        return True
+
+    def result(self):
+        """Return the extracted code of the text fed so far."""
+        return self.code if self.code is not None else extract_python_code(self.text)
+
+async def until_code_block(chunks, fence=None):
+    """
+    Pass chunks through until the first code block is complete.
+
+    Stopping closes chunks, which stops the backend generation, so no
+    tokens are spent on explanations after the code. fence is the opening
+    fence pattern (default: a Python block), see CodeFenceParser.
+    """
+    parser = CodeFenceParser(*fence) if fence else CodeFenceParser()
+    try:
+        async for chunk in chunks:
+            yield chunk
+            if parser.feed(chunk):
+                break
+    finally:
+        aclose = getattr(chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+# Prompts of /fix-code by error type and attempt number. The templates are
+# dedented, so the code and error message are inserted at column 0 instead
+# of indenting their first line
+PROMPT_TEMPLATES = {
+    "syntax": {
+        1: textwrap.dedent("""
+        Fix the following Python code that has a syntax error:
+        
+        ```python
+        {code}
+        ```
+        
+        Error message:
+        ```
+        {error_message}
+        ```
+        
+        Please provide only the corrected code without explanations.
+        """).strip(),
+        2: textwrap.dedent("""
+        The previous attempt to fix this Python code didn't work. Please try again with a different approach:
+        
+        ```python
+        {code}
+        ```
+        
+        Error message:
+        ```
+        {error_message}
+        ```
+        
+        Analyze the error carefully and provide only the corrected code without explanations.
+        """).strip(),
+        3: textwrap.dedent("""
+        This is the third attempt to fix this Python code. Please provide a completely different solution:
+        
+        ```python
+        {code}
+        ```
+        
+        Error message:
+        ```
+        {error_message}
+        ```
+        
+        Focus on fixing the specific error mentioned and provide only the corrected code.
+        """).strip()
+    },
+    "logic": {
+        1: textwrap.dedent("""
+        Fix the following Python code that has a logic error:
+        
+        ```python
+        {code}
+        ```
+        
+        Problem description:
+        ```
+        {error_message}
+        ```
+        
+        Please provide only the corrected code without explanations.
+        """).strip(),
+        2: textwrap.dedent("""
+        The previous attempt to fix this Python code with a logic error didn't work. Please try again:
+        
+        ```python
+        {code}
+        ```
+        
+        Problem description:
+        ```
+        {error_message}
+        ```
+        
+        Analyze the logic carefully and provide only the corrected code without explanations.
+        """).strip(),
+        3: textwrap.dedent("""
+        This is the third attempt to fix this Python code with a logic error. Please provide a completely different approach:
+        
+        ```python
+        {code}
+        ```
+        
+        Problem description:
+        ```
+        {error_message}
+        ```
+        
+        Think step by step about the logic and provide only the corrected code.
+        """).strip()
+    }
+}
+
+# Prompts of /fix-code with response_format="diff", by error type; the
+# attempt adds a retry note
+DIFF_PROMPT_TEMPLATES = {
+    "syntax": textwrap.dedent("""
+        Fix the following Python code that has a syntax error:{retry}
+        
+        ```python
+        {code}
+        ```
+        
+        Error message:
+        ```
+        {error_message}
+        ```
+        
+        Reply with only a minimal unified diff in a ```diff block, with --- a/code.py and +++ b/code.py
+        headers and three lines of context per hunk. Do not repeat unchanged code.
+        """).strip(),
+    "logic": textwrap.dedent("""
+        Fix the following Python code that has a logic error:{retry}
+        
+        ```python
+        {code}
+        ```
+        
+        Problem description:
+        ```
+        {error_message}
+        ```
+        
+        Reply with only a minimal unified diff in a ```diff block, with --- a/code.py and +++ b/code.py
+        headers and three lines of context per hunk. Do not repeat unchanged code.
+        """).strip()
+}
+
+DIFF_RETRY_NOTES = {
+    2: " The previous attempt didn't work, please try a different approach.",
+    3: " This is the third attempt, please provide a completely different solution."
+}
+
+# Token budgets of /fix-code. Tokens are estimated at CHARS_PER_TOKEN
+# characters each; the answer is given max_tokens sized from the code
+# between MIN_FIX_TOKENS and PYLLM_MAX_FIX_TOKENS, and error messages are
+# trimmed to PYLLM_ERROR_MESSAGE_TOKENS.
+CHARS_PER_TOKEN = 4
+MAX_FIX_TOKENS = int(os.environ.get("PYLLM_MAX_FIX_TOKENS", "2000"))
+MIN_FIX_TOKENS = 256
+ERROR_MESSAGE_TOKENS = int(os.environ.get("PYLLM_ERROR_MESSAGE_TOKENS", "512"))
+
+def estimate_tokens(text):
+    """Return a rough token count of text."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def fix_max_tokens(code, response_format="code"):
+    """
+    Return max_tokens of the answer to a /fix-code prompt for code.
+    
+    A fixed file is about as long as the code, plus room for the fence and
+    changes; a diff repeats only the changed lines and their context, so it
+    gets half of that.
+    """
+    tokens = estimate_tokens(code) * 5 // 4 + 64
+    if response_format == "diff":
+        tokens //= 2
+    return max(MIN_FIX_TOKENS, min(MAX_FIX_TOKENS, tokens))
+
+def trim_error_message(error_message, budget=ERROR_MESSAGE_TOKENS):
+    """
+    Trim an error message to about budget tokens.
+    
+    Tracebacks keep their first line, the exception line and as many of
+    the innermost frames as fit; the omitted lines are replaced by a
+    marker. Messages without such structure keep their beginning and end.
+    """
+    limit = budget * CHARS_PER_TOKEN
+    if len(error_message) <= limit:
+        return error_message
+    lines = error_message.strip("\n").split("\n")
+    first, last = lines[0], lines[-1]
+    marker = "  ... {} lines omitted ..."
+    size = len(first) + len(last) + len(marker) + 8
+    if len(lines) < 3 or size > limit // 2:
+        half = limit // 2
+        return f"{error_message[:half]}\n...\n{error_message[-half:]}"
+    kept = []
+    for line in reversed(lines[1:-1]):
+        size += len(line) + 1
+        if size > limit:
+            break
+        kept.insert(0, line)
+    # Don't keep the source line of a frame without its "File" line
+    if any(line.lstrip().startswith("File ") for line in kept):
+        while not kept[0].lstrip().startswith("File "):
+            kept.pop(0)
+    return "\n".join([first, marker.format(len(lines) - 2 - len(kept)), *kept, last])
+
+def build_fix_prompt(code, error_message, error_type, attempt=1, prompt_type=None, response_format="code"):
+    """
+    Build the /fix-code prompt of an attempt.
+    
+    Long error messages are trimmed with trim_error_message.
+    
+    Args:
+        code (str): The code to fix.
+        error_message (str): The error message or problem description.
+        error_type (str): "syntax" or "logic".
+        attempt (int): The attempt number; unknown attempts use the first prompt.
+        prompt_type (str, optional): Overrides error_type when it names a
+            prompt set.
+        response_format (str): "code" asks for the corrected code, "diff"
+            for a unified diff.
+        
+    Returns:
+        str: The prompt.
+    """
+    error_message = trim_error_message(error_message)
+    if response_format == "diff":
+        template = DIFF_PROMPT_TEMPLATES.get(prompt_type) or DIFF_PROMPT_TEMPLATES[error_type]
+        return template.format(code=code, error_message=error_message, retry=DIFF_RETRY_NOTES.get(attempt, ""))
+    templates = PROMPT_TEMPLATES.get(prompt_type) or PROMPT_TEMPLATES[error_type]
+    return templates.get(attempt, templates[1]).format(code=code, error_message=error_message)
+
+# A diff answer ends with its first fenced block, whatever its language
+DIFF_FENCE = (re.compile(r'```[\w+-]{0,20}\n'), 24)
+FENCED_BLOCK = re.compile(r'```[\w+-]*\n([\s\S]*?)\n```')
+HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,\d+)? \+\d+(?:,\d+)? @@', re.MULTILINE)
+
+class PatchError(ValueError):
+    """A diff that does not apply to the code."""
+
+def parse_unified_diff(diff):
+    """
+    Parse the hunks of a unified diff.
+    
+    Returns:
+        list: (old start line, [(" ", "-" or "+", text), ...]) per hunk.
+    """
+    hunks = []
+    for line in diff.split("\n"):
+        header = HUNK_HEADER.match(line)
+        if header:
+            hunks.append((int(header.group(1)), []))
+        elif not hunks or line.startswith(("--- ", "+++ ", "\\")):
+            continue
+        elif line.startswith(("-", "+")):
+            hunks[-1][1].append((line[0], line[1:]))
+        else:
+            # Context; models often drop the space of empty context lines
+            hunks[-1][1].append((" ", line[1:]))
+    return hunks
+
+def apply_unified_diff(code, diff):
+    """
+    Apply a unified diff, locating each hunk by its context.
+    
+    The line numbers of the hunk headers are only used to choose between
+    several places the context matches; trailing whitespace is ignored, and
+    context lines keep their text from the code.
+    
+    Raises:
+        PatchError: If the diff has no hunks or a hunk does not match.
+    """
+    hunks = parse_unified_diff(diff)
+    if not hunks:
+        raise PatchError("The diff has no hunks")
+    lines = code.split("\n")
+    stripped = [line.rstrip() for line in lines]
+    position = 0
+    shift = 0
+    for number, (start, changes) in enumerate(hunks, 1):
+        while changes and changes[-1][0] == " " and not changes[-1][1].strip():
+            changes.pop()
+        wanted = [text.rstrip() for tag, text in changes if tag != "+"]
+        expected = max(position, start - 1 + shift)
+        matches = [i for i in range(position, len(lines) - len(wanted) + 1)
+                   if stripped[i:i + len(wanted)] == wanted]
+        if not matches:
+            raise PatchError(f"Hunk {number} does not match the code")
+        index = min(matches, key=lambda i: abs(i - expected))
+        old = iter(lines[index:index + len(wanted)])
+        new = []
+        for tag, text in changes:
+            if tag == "+":
+                new.append(text)
+            elif tag == " ":
+                new.append(next(old))
+            else:
+                next(old)
+        lines[index:index + len(wanted)] = new
+        stripped[index:index + len(wanted)] = [line.rstrip() for line in new]
+        position = index + len(new)
+        shift += len(new) - len(wanted)
+    return "\n".join(lines)
+
+def apply_model_diff(code, text):
+    """
+    Return the fixed code from a diff answer of the model.
+    
+    Models sometimes answer with the corrected code instead of a diff;
+    such answers are used as they are.
+    
+    Raises:
+        PatchError: If the diff does not apply.
+    """
+    match = FENCED_BLOCK.search(text)
+    body = match.group(1) if match else text
+    if not HUNK_HEADER.search(body):
+        return extract_python_code(text)
+    return apply_unified_diff(code, body)
+
+def make_patch(original, fixed_code):
+    """Return the unified diff from original to fixed_code, ignoring a final newline."""
+    lines = difflib.unified_diff(original.splitlines(), fixed_code.splitlines(), "a/code.py", "b/code.py", lineterm="")
+    return "".join(line + "\n" for line in lines)
+
+def fix_response(original, fixed_code, full_response=None, response_format="code", include_code=False):
+    """
+    Build the /fix-code response of a fix.
+    
+    The "diff" format carries only the patch and whether the fixed code
+    compiles; the complete code is added with include_code. The "code"
+    format leaves full_response out when it is None, e.g. after streaming it.
+    """
+    if response_format == "diff":
+        response = {"patch": make_patch(original, fixed_code), "compiled": compiles(fixed_code)}
+        if include_code:
+            response["fixed_code"] = fixed_code
+        return response
+    response = {"fixed_code": fixed_code}
+    if full_response is not None:
+        response["full_response"] = full_response
+    return response
+
+async def complete_fix(prompt, policy, fence=None, max_tokens=MAX_FIX_TOKENS):
+    """
+    Return the answer to a /fix-code prompt and its cache status.
+    
+    Backends that can stream are streamed internally, so the generation
+    stops once the first code block (opening with fence) is complete.
+    """
+    if getattr(model_manager, "query_model_stream", None) is not None:
+        chunks, status = generate_stream("fix-code", "llama3", prompt, max_tokens, 0.5, policy, {},
+                                         stop_after_code=True, fence=fence)
+        return "".join([chunk async for chunk in chunks]), status
+    return await generate("fix-code", "llama3", prompt, max_tokens, 0.5, policy)
+
+def compiles(code):
+    """Whether code is valid Python source."""
+    try:
+        compile(code, "<fixed_code>", "exec")
+        return True
+    except (SyntaxError, ValueError):
+        return False
+
+# Trivial syntax errors are repaired locally, without a model call. Each
+# repair handles one compiler message and edits the reported line; they are
+# applied one at a time until the code compiles or no repair applies.
+BRACKETS = {"(": ")", "[": "]", "{": "}"}
+SYNTAX_ERROR_NAMES = ("SyntaxError", "IndentationError", "TabError")
+
+def scan_brackets(text):
+    """
+    Find the brackets left open in text, skipping strings and comments.
+
+    Returns:
+        tuple: (unclosed opening brackets in order, index of the comment on
+        the last line of text or None).
+    """
+    stack = []
+    comment = None
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == "#":
+            end = text.find("\n", i)
+            if end == -1:
+                comment = i
+                break
+            i = end
+        elif char in "'\"":
+            quote = text[i:i + 3] if text[i:i + 3] in ('"""', "'''") else char
+            j = i + len(quote)
+            while j < len(text) and not text.startswith(quote, j):
+                if len(quote) == 1 and text[j] == "\n":
+                    break
+                j += 2 if text[j] == "\\" else 1
+            i = j + len(quote)
+            continue
+        elif char in BRACKETS:
+            stack.append(char)
+        elif stack and char == BRACKETS[stack[-1]]:
+            stack.pop()
+        i += 1
+    return stack, comment
+
+def indent_width(line):
+    """Width of the indentation of line, with tab stops every 8 columns like the tokenizer."""
+    return len(line[:len(line) - len(line.lstrip())].expandtabs(8))
+
+def reindent(line, width):
+    return " " * width + line.lstrip()
+
+def code_end(line):
+    """Index after the code of line, before a trailing comment and whitespace."""
+    _, comment = scan_brackets(line)
+    return len(line[:comment].rstrip()) if comment is not None else len(line.rstrip())
+
+def repair_missing_colon(lines, error):
+    if error.msg != "expected ':'":
+        return None
+    index = error.lineno - 1
+    end = code_end(lines[index])
+    if lines[index][:end].endswith(":"):
+        return None
+    lines[index] = lines[index][:end] + ":" + lines[index][end:]
+    return lines
+
+def repair_unclosed_bracket(lines, error):
+    match = re.match(r"'([(\[{])' was never closed", error.msg)
+    if not match:
+        return None
+    # The bracket ends with the lines continuing its statement
+    start = last = error.lineno - 1
+    for index in range(start + 1, len(lines)):
+        if lines[index].strip():
+            if indent_width(lines[index]) <= indent_width(lines[start]):
+                break
+            last = index
+    region = "\n".join(lines[start:last + 1])
+    stack, _ = scan_brackets(region)
+    if not stack:
+        return None
+    end = code_end(lines[last])
+    closers = "".join(BRACKETS[bracket] for bracket in reversed(stack))
+    lines[last] = lines[last][:end] + closers + lines[last][end:]
+    return lines
+
+def repair_mismatched_bracket(lines, error):
+    match = re.match(r"closing parenthesis '(.)' does not match opening parenthesis '(.)'", error.msg)
+    if not match:
+        return None
+    line = lines[error.lineno - 1]
+    index = error.offset - 1
+    if line[index:index + 1] != match.group(1):
+        return None
+    # Close the inner bracket first; a now unmatched closer is removed next
+    lines[error.lineno - 1] = line[:index] + BRACKETS[match.group(2)] + line[index:]
+    return lines
+
+def repair_unmatched_bracket(lines, error):
+    match = re.match(r"unmatched '([)\]}])'", error.msg)
+    if not match:
+        return None
+    line = lines[error.lineno - 1]
+    index = error.offset - 1
+    if line[index:index + 1] != match.group(1):
+        return None
+    lines[error.lineno - 1] = line[:index] + line[index + 1:]
+    return lines
+
+def repair_indentation(lines, error):
+    index = error.lineno - 1
+    expected_block = re.match(r"expected an indented block after .* on line (\d+)", error.msg)
+    if expected_block:
+        header = int(expected_block.group(1)) - 1
+        width = indent_width(lines[header]) + 4
+        # At the end of the code the error points at the header itself, and
+        # a block holding only comments is empty too
+        if index <= header or index >= len(lines) or not lines[index].strip() \
+                or lines[index].lstrip().startswith("#"):
+            lines.insert(header + 1, reindent("pass", width))
+        else:
+            lines[index] = reindent(lines[index], width)
+        return lines
+    previous = [line for line in lines[:index] if line.strip() and not line.lstrip().startswith("#")]
+    if error.msg == "unexpected indent":
+        lines[index] = reindent(lines[index], indent_width(previous[-1]) if previous else 0)
+        return lines
+    if error.msg == "unindent does not match any outer indentation level":
+        # Snap to the nearest enclosing level, the deeper one on a tie
+        levels = [0]
+        for line in previous:
+            width = indent_width(line)
+            while levels[-1] > width:
+                levels.pop()
+            if width > levels[-1]:
+                levels.append(width)
+        width = indent_width(lines[index])
+        lines[index] = reindent(lines[index], min(levels, key=lambda level: (abs(level - width), -level)))
+        return lines
+    return None
+
+def repair_tabs(lines, error):
+    if not isinstance(error, TabError):
+        return None
+    return [reindent(line, indent_width(line)) if line.strip() else line for line in lines]
+
+LOCAL_REPAIRS = [
+    ("tabs", repair_tabs),
+    ("indentation", repair_indentation),
+    ("missing_colon", repair_missing_colon),
+    ("unclosed_bracket", repair_unclosed_bracket),
+    ("mismatched_bracket", repair_mismatched_bracket),
+    ("unmatched_bracket", repair_unmatched_bracket),
+]
+
+def repair_locally(code, max_passes=20):
+    """
+    Try to fix code with the deterministic repairs.
+
+    Args:
+        code (str): The code to fix.
+        max_passes (int): Maximum number of repairs to apply.
+
+    Returns:
+        tuple: (code that compiles or None, names of the applied repairs).
+    """
+    applied = []
+    for _ in range(max_passes + 1):
+        try:
+            compile(code, "<fixed_code>", "exec")
+            return code, applied
+        except SyntaxError as e:
+            error = e
+        except ValueError:
+            return None, applied
+        if error.lineno is None:
+            return None, applied
+        for name, repair in LOCAL_REPAIRS:
+            try:
+                lines = repair(code.split("\n"), error)
+            except (IndexError, TypeError):
+                lines = None
+            if lines is not None and "\n".join(lines) != code:
+                code = "\n".join(lines)
+                applied.append(name)
+                break
+        else:
+            return None, applied
+    return None, applied
+
+def local_fix(code, error_message):
+    """
+    Fix a syntax error without the model, if possible.
+
+    Code that already compiles is returned unchanged only when the error
+    message reports a syntax error, which it then no longer has.
+
+    Returns:
+        dict: The /fix-code response, or None if the model is needed.
+    """
+    fixed_code, repairs = repair_locally(code)
+    if fixed_code is None:
+        return None
+    if not repairs and not any(name in error_message for name in SYNTAX_ERROR_NAMES):
+        return None
+    return {"fixed_code": fixed_code, "full_response": "", "source": "local", "repairs": repairs}
+
+# With context="slice" only the function or class around the error line is
+# sent to the model, with the imports it uses, so prompt and answer scale
+# with the function instead of the file.
+BLOCK_HEADER = re.compile(r"\s*(?:async\s+def|def|class)\b")
+IMPORT_LINE = re.compile(r"(?:import|from)\s")
+ERROR_LINE = re.compile(r"\bline (\d+)")
+
+def error_line_number(error_message):
+    """Return the last line number mentioned in an error message, or None."""
+    numbers = ERROR_LINE.findall(error_message)
+    return int(numbers[-1]) if numbers else None
+
+def is_code_line(line):
+    return bool(line.strip()) and not line.lstrip().startswith("#")
+
+def enclosing_block(code, line):
+    """
+    Find the innermost function or class containing a line.
+
+    Uses the AST when the code parses, and the indentation otherwise.
+
+    Args:
+        code (str): The source code.
+        line (int): The line number, starting at 1.
+
+    Returns:
+        tuple: First and last line index (from 0) of the block including its
+        decorators, or None if the line is not inside a function or class.
+    """
+    lines = code.split("\n")
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        tree = None
+    if tree is not None:
+        best = None
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+                if start <= line <= node.end_lineno and (best is None or start > best[0]):
+                    best = (start, node.end_lineno)
+        return (best[0] - 1, best[1] - 1) if best else None
+
+    index = line - 1
+    if not 0 <= index < len(lines):
+        return None
+    header = None
+    width = indent_width(lines[index]) if is_code_line(lines[index]) else float("inf")
+    for i in range(index, -1, -1):
+        if not is_code_line(lines[i]):
+            continue
+        if BLOCK_HEADER.match(lines[i]) and (i == index or indent_width(lines[i]) < width):
+            header = i
+            break
+        width = min(width, indent_width(lines[i]))
+        if width == 0:
+            return None
+    if header is None:
+        return None
+    start = end = header
+    while start > 0 and lines[start - 1].strip().startswith("@") \
+            and indent_width(lines[start - 1]) == indent_width(lines[header]):
+        start -= 1
+    for i in range(header + 1, len(lines)):
+        if is_code_line(lines[i]):
+            if indent_width(lines[i]) <= indent_width(lines[header]):
+                break
+            end = i
+    return start, end
+
+def top_level_imports(lines):
+    """Return (line index, statement, bound names) of the module-level imports."""
+    imports = []
+    index = 0
+    while index < len(lines):
+        if IMPORT_LINE.match(lines[index]):
+            # Parenthesized imports may span several lines
+            last = index
+            while "(" in lines[index] and ")" not in "".join(lines[index:last + 1]) and last + 1 < len(lines):
+                last += 1
+            statement = "\n".join(lines[index:last + 1])
+            try:
+                node = ast.parse(statement).body[0]
+                imports.append((index, statement,
+                                [alias.asname or alias.name.split(".")[0] for alias in node.names]))
+            except (SyntaxError, IndexError, AttributeError):
+                pass
+            index = last
+        index += 1
+    return imports
+
+class CodeSlice:
+    """
+    The part of a file sent to the model in context="slice" mode.
+
+    Args:
+        code (str): The complete source code.
+        start (int): First line index of the slice.
+        end (int): Last line index of the slice.
+    """
+
+    def __init__(self, code, start, end):
+        self.lines = code.split("\n")
+        self.start = start
+        self.end = end
+        self.indent = self.lines[start][:len(self.lines[start]) - len(self.lines[start].lstrip())]
+        self.body = textwrap.dedent("\n".join(self.lines[start:end + 1]))
+        self.imports = top_level_imports(self.lines)
+        self.used_imports = [statement for _, statement, names in self.imports
+                             if "*" in names or any(re.search(rf"\b{re.escape(name)}\b", self.body)
+                                                    for name in names)]
+        self.header_lines = len("\n".join(self.used_imports).split("\n")) + 2 if self.used_imports else 0
+
+    def code(self):
+        """Return the code sent to the model: the used imports and the dedented block."""
+        if not self.used_imports:
+            return self.body
+        return "\n".join(self.used_imports) + "\n\n\n" + self.body
+
+    def map_error(self, error_message):
+        """Renumber the lines of the slice in an error message to match code()."""
+        def renumber(match):
+            index = int(match.group(1)) - 1
+            if self.start <= index <= self.end:
+                return f"line {index - self.start + 1 + self.header_lines}"
+            return match.group(0)
+        return ERROR_LINE.sub(renumber, error_message)
+
+    def splice(self, fixed_code):
+        """
+        Put a fixed slice back into the complete source.
+
+        Imports at the top of the fix that the file does not have yet are
+        added after the file's last module-level import.
+        """
+        fixed_lines = fixed_code.split("\n")
+        leading = {index: statement for index, statement, _ in top_level_imports(fixed_lines)}
+        known = {statement.strip() for _, statement, _ in self.imports}
+        new_imports = []
+        position = 0
+        while position < len(fixed_lines):
+            if position in leading:
+                statement = leading[position]
+                if statement.strip() not in known and statement not in new_imports:
+                    new_imports.append(statement)
+                position += statement.count("\n") + 1
+            elif not fixed_lines[position].strip():
+                position += 1
+            else:
+                break
+        body = textwrap.dedent("\n".join(fixed_lines[position:]).rstrip()).split("\n")
+        body = [self.indent + line if line.strip() else line for line in body]
+        lines = self.lines[:self.start] + body + self.lines[self.end + 1:]
+        if new_imports:
+            before = [index + statement.count("\n") for index, statement, _ in self.imports if index < self.start]
+            position = before[-1] + 1 if before else 0
+            lines[position:position] = "\n".join(new_imports).split("\n")
+        return "\n".join(lines)
+
+def slice_code(code, error_message):
+    """Return the CodeSlice around the error line, or None if there is none."""
+    line = error_line_number(error_message)
+    if line is None:
+        return None
+    block = enclosing_block(code, line)
+    return CodeSlice(code, *block) if block else None
+
+async def race_fixes(prompts, policy, finish=extract_python_code, fence=None, max_tokens=MAX_FIX_TOKENS):
+    """
+    Generate the answers to several /fix-code prompts concurrently.
+    
+    Each answer is validated as soon as it arrives; the first one whose code
+    compiles wins and the remaining generations are cancelled. If none
+    compiles, the answer of the lowest attempt is returned.
+    
+    Only streamed generations actually stop when cancelled. On backends
+    without query_model_stream the losing calls run to completion in the
+    backend pool and keep their model slots until then (see run_model_call).
+    
+    Args:
+        prompts (dict): Prompt per attempt number.
+        policy (tuple): (lookup, store) from cache_policy.
+        finish (callable): Turns an answer into the fixed code; answers it
+            raises for count as failed.
+        fence (tuple, optional): The fence of the answers' code blocks, see
+            CodeFenceParser.
+        max_tokens (int): Maximum tokens of each answer.
+        
+    Returns:
+        dict: fixed_code, full_response, attempt and compiled.
+    """
+    tasks = {asyncio.ensure_future(complete_fix(prompt, policy, fence, max_tokens)): attempt
+             for attempt, prompt in prompts.items()}
+    pending = set(tasks)
+    results = []
+    errors = []
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=tasks.get):
+                if task.exception() is not None:
+                    errors.append(task.exception())
+                    continue
+                response, _ = task.result()
+                try:
+                    fixed_code = finish(response)
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                result = {"fixed_code": fixed_code, "full_response": response, "source": "model",
+                          "attempt": tasks[task], "compiled": compiles(fixed_code)}
+                if result["compiled"]:
+                    return result
+                results.append(result)
+    finally:
+        for task in pending:
+            task.cancel()
+    if results:
+        return min(results, key=lambda result: result["attempt"])
+    raise errors[0]
+
 # API endpoints
 @app.post("/query")
-async def query_model(request: QueryRequest):
+async def query_model(request: QueryRequest, http_request: Request, http_response: Response):
     """
     Query an LLM model with a prompt
+    
+    With stream=true the output is sent as it is generated, as Server-Sent
+    Events or NDJSON (stream_format), followed by a "done" event with timings.
+    
+    Low-temperature requests are answered from the response cache when
+    possible; the X-Cache response header tells whether it was used.
     """
-    global model_manager
-    if model_manager is None:
-        model_manager = ModelManager()
+    get_model_manager()
+    
+    if request.stream and request.stream_format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown stream_format: {request.stream_format}")
+    
+    policy = cache_policy(request.temperature, request.cache, http_request.headers.get("cache-control"))
+    
+    if request.stream:
+        start = time.perf_counter()
+        timings = {}
+        chunks, status = generate_stream("query", request.model, request.prompt, request.max_tokens,
+                                         request.temperature, policy, timings)
+        return await streaming_response(chunks, request.stream_format,
+                                        lambda text: {"timings": stream_timings(timings, start, text)},
+                                        headers={"X-Cache": status})
     
     try:
-        response = model_manager.query_model(request.prompt, request.model, request.max_tokens, request.temperature)
+        response, status = await generate("query", request.model, request.prompt, request.max_tokens,
+                                          request.temperature, policy)
+        http_response.headers["X-Cache"] = status
         return {"response": response}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/fix-code")
-async def fix_code(request: CodeFixRequest):
+async def fix_code(request: CodeFixRequest, http_request: Request, http_response: Response):
     """
     Fix Python code using LLM
+    
+    With strategy="race" the prompts of attempts 1 to 3 are generated
+    concurrently and the first fix that compiles is returned, with its
+    attempt number; the other generations are cancelled (on backends that
+    cannot stream they run to completion, holding their model slots).
+    
+    Syntax errors are first repaired locally (missing colons, brackets,
+    indentation, tabs); the model is only queried when that fails. The
+    response tells where the fix came from in "source" ("local" or "model").
+    
+    With context="slice" only the function or class containing the error
+    line (taken from error_message) is sent to the model, with the imports
+    it uses; the fix is spliced back into the complete code and "slice"
+    gives the replaced lines. Errors outside any function or class use the
+    complete code.
+    
+    With response_format="diff" the model is asked for a unified diff
+    instead of the whole file, which is applied to the code; the response
+    holds the "patch" from the submitted code and whether the result
+    "compiled", plus the "fixed_code" with include_code=true. A diff that
+    does not apply gives HTTP 422.
+    
+    The answer gets max_tokens in proportion to the code sent (see
+    fix_max_tokens), and long tracebacks are trimmed to their innermost
+    frames before they go into the prompt.
     """
-    global model_manager
-    if model_manager is None:
-        model_manager = ModelManager()
+    get_model_manager()
     
     # Determine the type of error
     error_type = "logic" if request.is_logic_error else "syntax"
     
+    if request.stream and request.stream_format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown stream_format: {request.stream_format}")
+    if request.strategy not in ("sequential", "race"):
+        raise HTTPException(status_code=400, detail=f"Unknown strategy: {request.strategy}")
+    if request.context not in ("full", "slice"):
+        raise HTTPException(status_code=400, detail=f"Unknown context: {request.context}")
+    if request.response_format not in ("code", "diff"):
+        raise HTTPException(status_code=400, detail=f"Unknown response_format: {request.response_format}")
+    diff = request.response_format == "diff"
+    
+    policy = cache_policy(0.5, request.cache, http_request.headers.get("cache-control"))
+    
+    def respond(fixed_code, full_response=None):
+        return fix_response(request.code, fixed_code, full_response, request.response_format, request.include_code)
+    
+    if request.local_repair and (request.prompt_type or error_type) == "syntax":
+        local = local_fix(request.code, request.error_message)
+        if local is not None:
+            if diff:
+                local = {**respond(local["fixed_code"]), "source": "local", "repairs": local["repairs"]}
+            if request.stream:
+                text = f"```diff\n{local['patch']}```" if diff else f"```python\n{local['fixed_code']}\n```"
+                return await streaming_response(single_chunk(text), request.stream_format, lambda text: local)
+            return local
+    
+    code, error_message, finish, extra = request.code, request.error_message, None, {}
+    code_slice = slice_code(request.code, request.error_message) if request.context == "slice" else None
+    if code_slice is not None:
+        code, error_message, finish = code_slice.code(), code_slice.map_error(request.error_message), code_slice.splice
+        extra = {"slice": {"start_line": code_slice.start + 1, "end_line": code_slice.end + 1}}
+    fence = DIFF_FENCE if diff else None
+    max_tokens = fix_max_tokens(code, request.response_format)
+    
+    def finish_code(text):
+        fixed_code = apply_model_diff(code, text) if diff else extract_python_code(text)
+        return finish(fixed_code) if finish is not None else fixed_code
+    
     # Create a prompt based on the error type and attempt number
-    prompt_templates = {
-        "syntax": {
-            1: """
-            Fix the following Python code that has a syntax error:
-            
-            ```python
-            {code}
-            ```
-            
-            Error message:
-            ```
-            {error_message}
-            ```
-            
-            Please provide only the corrected code without explanations.
-            """,
-            2: """
-            The previous attempt to fix this Python code didn't work. Please try again with a different approach:
-            
-            ```python
-            {code}
-            ```
-            
-            Error message:
-            ```
-            {error_message}
-            ```
-            
-            Analyze the error carefully and provide only the corrected code without explanations.
-            """,
-            3: """
-            This is the third attempt to fix this Python code. Please provide a completely different solution:
-            
-            ```python
-            {code}
-            ```
-            
-            Error message:
-            ```
-            {error_message}
-            ```
-            
-            Focus on fixing the specific error mentioned and provide only the corrected code.
-            """
-        },
-        "logic": {
-            1: """
-            Fix the following Python code that has a logic error:
-            
-            ```python
-            {code}
-            ```
-            
-            Problem description:
-            ```
-            {error_message}
-            ```
-            
-            Please provide only the corrected code without explanations.
-            """,
-            2: """
-            The previous attempt to fix this Python code with a logic error didn't work. Please try again:
-            
-            ```python
-            {code}
-            ```
-            
-            Problem description:
-            ```
-            {error_message}
-            ```
-            
-            Analyze the logic carefully and provide only the corrected code without explanations.
-            """,
-            3: """
-            This is the third attempt to fix this Python code with a logic error. Please provide a completely different approach:
-            
-            ```python
-            {code}
-            ```
-            
-            Problem description:
-            ```
-            {error_message}
-            ```
-            
-            Think step by step about the logic and provide only the corrected code.
-            """
-        }
-    }
+    prompt = build_fix_prompt(code, error_message, error_type, request.attempt, request.prompt_type,
+                              request.response_format)
     
-    # Use custom prompt if provided
-    if request.prompt_type and request.prompt_type in prompt_templates:
-        prompt_template = prompt_templates[request.prompt_type].get(request.attempt, prompt_templates[request.prompt_type][1])
-    else:
-        prompt_template = prompt_templates[error_type].get(request.attempt, prompt_templates[error_type][1])
+    if request.strategy == "race":
+        if request.stream:
+            raise HTTPException(status_code=400, detail="strategy=race does not support streaming")
+        prompts = {attempt: build_fix_prompt(code, error_message, error_type, attempt, request.prompt_type,
+                                             request.response_format)
+                   for attempt in (1, 2, 3)}
+        try:
+            result = await race_fixes(prompts, policy, finish_code, fence, max_tokens)
+        except PatchError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        return {**respond(result["fixed_code"], result["full_response"]), "source": "model",
+                "attempt": result["attempt"], "compiled": result["compiled"], **extra}
     
-    # Format the prompt
-    prompt = prompt_template.format(code=request.code, error_message=request.error_message)
+    # Only the first code block of the answer is used, so the generation
+    # stops once it is complete
+    if request.stream:
+        start = time.perf_counter()
+        timings = {}
+        chunks, status = generate_stream("fix-code", "llama3", prompt, max_tokens, 0.5, policy, timings,
+                                         stop_after_code=True, fence=fence)
+        return await streaming_response(chunks, request.stream_format, lambda text: {
+            **respond(finish_code(text)),
+            "source": "model",
+            **extra,
+            "timings": stream_timings(timings, start, text)
+        }, headers={"X-Cache": status})
     
     try:
-        # Query the model
-        response = model_manager.query_model(prompt, "llama3", 2000, 0.5)
+        # Query the model, or reuse the answer to an identical request
+        response, status = await complete_fix(prompt, policy, fence, max_tokens)
+        http_response.headers["X-Cache"] = status
         
         # Extract code from the response
-        fixed_code = extract_python_code(response)
+        fixed_code = finish_code(response)
         
-        return {"fixed_code": fixed_code, "full_response": response}
+        return {**respond(fixed_code, response), "source": "model", **extra}
+    except PatchError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -232,6 +1833,41 @@ async def health_check():
         "service": "PyLLM API"
     }
 
+@app.get("/ready")
+async def ready(http_response: Response):
+    """
+    Check if the API is ready to serve requests
+    
+    Unlike /health, this answers HTTP 503 until the model manager has been
+    built and the models of PYLLM_PRELOAD_MODELS have been warmed up, so
+    load balancers only route requests to warm instances. "models" gives
+    the warm-up result per model ("ok" or the error) and "warmup_seconds"
+    its duration.
+    """
+    if not warmup["ready"]:
+        http_response.status_code = 503
+        return {"status": "warming_up", "models": dict(warmup["models"])}
+    return {"status": "ready", "models": dict(warmup["models"]), "warmup_seconds": warmup["seconds"]}
+
+@app.get("/stats")
+async def stats():
+    """
+    Return runtime counters of the API
+    
+    "cache" holds the response cache's hits, misses, evictions, expired
+    entries, bypassed requests and current size; "single_flight" the number
+    of backend generations started, requests that joined one already in
+    flight, generations cancelled after all their requests went away, and
+    the generations in flight; "batching" the batch sizes and queue waits
+    (seconds until the backend started a request) of non-streaming
+    generations.
+    """
+    return {
+        "cache": response_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "batching": batcher.stats()
+    }
+
 def start_server(host="0.0.0.0", port=8001):
     """Start the PyLLM API server"""
     uvicorn.run(app, host=host, port=port)
@@ -0,0 +1,591 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PyLLM API Load Test
+
+This script drives the /query and /fix-code endpoints of the PyLLM API
+(docker/pyllm_api_fix.py) with a configurable workload and reports
+throughput, error rate and latency percentiles.
+
+Two load models are supported:
+- open loop: requests arrive at a fixed rate whether or not earlier ones
+  have completed, and latency is measured from the scheduled arrival time
+  so queueing delay is not hidden (no coordinated omission);
+- closed loop: N concurrent users each send a request, wait for the
+  response, optionally think, and repeat.
+
+With --stub the API is started in-process on a free port with a stub
+ModelManager that simulates generation latency, so the harness runs
+offline without a model backend.
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import types
+import random
+import socket
+import argparse
+import threading
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Path of the API module exercised in stub mode
+API_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "docker", "pyllm_api_fix.py")
+
+# Words used to build synthetic prompts
+WORDS = ("explain how the python function handles errors and returns values "
+         "with examples tests edge cases performance memory strings lists").split()
+
+
+class StubModelManager:
+    """
+    Offline stand-in for getllm's ModelManager.
+
+    query_model sleeps for a fixed latency plus the time it would take to
+    generate the output at a fixed token rate. For code-fixing prompts it
+    returns the code block of the prompt, so the API's code extraction runs
+    on realistic output. query_model_stream yields the same output in
+    4-character tokens, the first one after the fixed latency.
+    """
+
+    latency = 0.05
+    tokens_per_second = 200.0
+
+    def generate(self, prompt, max_tokens):
+        match = re.search(r"```python\n([\s\S]*?)\n\s*```", prompt)
+        if match:
+            return f"```python\n{match.group(1)}\n```"
+        return " ".join(WORDS[i % len(WORDS)] for i in range(max(1, min(max_tokens, len(prompt) // 8))))
+
+    def query_model(self, prompt, model="llama3", max_tokens=1000, temperature=0.7):
+        text = self.generate(prompt, max_tokens)
+        tokens = min(max_tokens, max(1, len(text) // 4))
+        time.sleep(self.latency + tokens / self.tokens_per_second)
+        return text
+
+    def query_model_stream(self, prompt, model="llama3", max_tokens=1000, temperature=0.7):
+        text = self.generate(prompt, max_tokens)
+        time.sleep(self.latency)
+        for i in range(0, min(len(text), max_tokens * 4), 4):
+            time.sleep(1.0 / self.tokens_per_second)
+            yield text[i:i + 4]
+
+
+class BatchingStubModelManager(StubModelManager):
+    """
+    StubModelManager with query_model_batch.
+
+    A batch costs one fixed latency plus the generation time of its longest
+    output, like batched decoding on a local backend.
+    """
+
+    def query_model_batch(self, prompts, model="llama3", max_tokens=1000, temperature=0.7):
+        texts = [self.generate(prompt, max_tokens) for prompt in prompts]
+        tokens = max(min(max_tokens, max(1, len(text) // 4)) for text in texts)
+        time.sleep(self.latency + tokens / self.tokens_per_second)
+        return texts
+
+
+def load_api(manager_class=StubModelManager, path=API_PATH):
+    """
+    Import the PyLLM API module with a stub ModelManager
+
+    The API module uses a relative import (`from .models import ModelManager`),
+    so it is loaded as a submodule of a synthetic package whose `models`
+    module provides the stub.
+
+    Args:
+        manager_class (type): ModelManager replacement
+        path (str): Path to the API module
+
+    Returns:
+        module: The loaded API module
+    """
+    package = types.ModuleType("pyllm_loadtest")
+    package.__path__ = []
+    models = types.ModuleType("pyllm_loadtest.models")
+    models.ModelManager = manager_class
+    sys.modules["pyllm_loadtest"] = package
+    sys.modules["pyllm_loadtest.models"] = models
+
+    spec = importlib.util.spec_from_file_location("pyllm_loadtest.api", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["pyllm_loadtest.api"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def free_port():
+    """Return a free TCP port on localhost"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub_server(latency=0.05, tokens_per_second=200.0, batch=False):
+    """
+    Start the PyLLM API with a stub ModelManager in a background thread
+
+    Returns once the API is ready, so the warm-up generation does not
+    overlap the measured requests.
+
+    Args:
+        latency (float): Fixed latency of every stub generation in seconds
+        tokens_per_second (float): Simulated generation speed
+        batch (bool): Give the stub query_model_batch, so the API batches
+            concurrent non-streaming requests
+
+    Returns:
+        tuple: (base URL, uvicorn.Server)
+    """
+    import uvicorn
+
+    StubModelManager.latency = latency
+    StubModelManager.tokens_per_second = tokens_per_second
+    api = load_api(BatchingStubModelManager if batch else StubModelManager)
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="pyllm-stub", daemon=True).start()
+
+    deadline = time.time() + 10
+    while not (server.started and api.warmup["ready"]):
+        if time.time() > deadline:
+            raise RuntimeError("Stub PyLLM API did not start within 10 seconds")
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server
+
+
+def parse_distribution(spec):
+    """
+    Parse a size distribution
+
+    Supported forms are "fixed:N", "uniform:LOW:HIGH" and
+    "lognormal:MEDIAN:SIGMA".
+
+    Args:
+        spec (str): The distribution specification
+
+    Returns:
+        callable: Function taking a random.Random and returning a positive int
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(":")] if args else []
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: max(1, int(values[0]))
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: max(1, int(rng.uniform(values[0], values[1])))
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: max(1, int(rng.lognormvariate(math.log(values[0]), values[1])))
+    raise argparse.ArgumentTypeError(f"Invalid distribution: {spec!r}")
+
+
+def parse_mix(spec):
+    """
+    Parse an endpoint mix such as "query=0.7,fix-code=0.3"
+
+    Returns:
+        list: (endpoint, weight) pairs
+    """
+    mix = []
+    for part in spec.split(","):
+        endpoint, _, weight = part.partition("=")
+        if endpoint.strip() not in ("query", "fix-code"):
+            raise argparse.ArgumentTypeError(f"Unknown endpoint in mix: {endpoint!r}")
+        mix.append((endpoint.strip(), float(weight or 1)))
+    return mix
+
+
+def make_prompt(chars, rng):
+    """Return a synthetic prompt of about `chars` characters"""
+    words = []
+    length = 0
+    while length < chars:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)
+
+
+def make_broken_code(lines, rng):
+    """
+    Return synthetic Python code of about `lines` lines with a syntax error
+
+    One function definition is missing its colon; the matching error message
+    mimics the output of the Python interpreter.
+
+    Returns:
+        tuple: (code, error message)
+    """
+    source = []
+    functions = max(1, lines // 4)
+    broken = rng.randrange(functions)
+    error_line = None
+    for i in range(functions):
+        if i == broken:
+            error_line = len(source) + 1
+            source.append(f"def function_{i}(value)")
+        else:
+            source.append(f"def function_{i}(value):")
+        source.append(f"    result = value * {i + 1}")
+        source.append(f"    return result + {rng.randint(0, 100)}")
+        source.append("")
+    code = "\n".join(source)
+    error = (f'  File "main.py", line {error_line}\n'
+             f"    def function_{broken}(value)\n"
+             f"{' ' * (len(f'    def function_{broken}(value)'))}^\n"
+             f"SyntaxError: expected ':'")
+    return code, error
+
+
+class Workload:
+    """
+    Random request generator for the /query and /fix-code endpoints.
+    """
+
+    def __init__(self, mix, prompt_size, code_lines, model="llama3", max_tokens=256, seed=None, stream=False,
+                 local_repair=False):
+        self.stream = stream
+        self.local_repair = local_repair
+        self.endpoints = [endpoint for endpoint, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.prompt_size = prompt_size
+        self.code_lines = code_lines
+        self.model = model
+        self.max_tokens = max_tokens
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def next_request(self):
+        """Return (endpoint, JSON payload) of the next request"""
+        with self.lock:
+            endpoint = self.rng.choices(self.endpoints, self.weights)[0]
+            if endpoint == "query":
+                payload = {
+                    "prompt": make_prompt(self.prompt_size(self.rng), self.rng),
+                    "model": self.model,
+                    "max_tokens": self.max_tokens,
+                    "temperature": 0.7
+                }
+            else:
+                code, error = make_broken_code(self.code_lines(self.rng), self.rng)
+                payload = {"code": code, "error_message": error, "attempt": 1,
+                           "local_repair": self.local_repair}
+            if self.stream:
+                payload.update(stream=True, stream_format="ndjson")
+            return endpoint, payload
+
+
+_local = threading.local()
+
+
+def send_request(base_url, endpoint, payload, timeout, scheduled=None):
+    """
+    Send one request and time it
+
+    Args:
+        base_url (str): Base URL of the API
+        endpoint (str): "query" or "fix-code"
+        payload (dict): JSON body
+        timeout (float): Request timeout in seconds
+        scheduled (float): Intended start time (defaults to the actual start)
+
+    Streaming requests (payload "stream": true, NDJSON) also record the time
+    the first chunk arrived; an "error" event counts as a failed request.
+
+    Returns:
+        dict: Record with endpoint, scheduled/start/first/end times, HTTP status and error
+    """
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    start = time.perf_counter()
+    record = {"endpoint": endpoint, "scheduled": start if scheduled is None else scheduled,
+              "start": start, "first": None, "status": 0, "error": None}
+    try:
+        streaming = payload.get("stream", False)
+        with _local.session.post(f"{base_url}/{endpoint}", json=payload, timeout=timeout,
+                                 stream=streaming) as response:
+            record["status"] = response.status_code
+            if response.status_code != 200:
+                record["error"] = f"HTTP {response.status_code}"
+            elif streaming:
+                for line in response.iter_lines():
+                    if record["first"] is None:
+                        record["first"] = time.perf_counter()
+                    if line and json.loads(line).get("type") == "error":
+                        record["error"] = "stream error"
+    except (requests.RequestException, ValueError) as e:
+        record["error"] = type(e).__name__
+    record["end"] = time.perf_counter()
+    return record
+
+
+def run_open_loop(base_url, workload, rate, duration, timeout=60, max_in_flight=512, arrival="poisson", seed=None):
+    """
+    Send requests at a fixed arrival rate
+
+    Arrivals that find max_in_flight requests outstanding are recorded as
+    dropped instead of queued without bound.
+
+    Args:
+        base_url (str): Base URL of the API
+        workload (Workload): Request generator
+        rate (float): Arrival rate in requests per second
+        duration (float): Length of the run in seconds
+        timeout (float): Request timeout in seconds
+        max_in_flight (int): Maximum number of outstanding requests
+        arrival (str): "poisson" for exponential inter-arrival times, "uniform" for a constant gap
+        seed (int): Seed of the arrival process
+
+    Returns:
+        list: Request records
+    """
+    rng = random.Random(seed)
+    records = []
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    def task(endpoint, payload, scheduled):
+        try:
+            return send_request(base_url, endpoint, payload, timeout, scheduled)
+        finally:
+            in_flight.release()
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        start = time.perf_counter()
+        scheduled = start
+        while scheduled < start + duration:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            endpoint, payload = workload.next_request()
+            if in_flight.acquire(blocking=False):
+                futures.append(executor.submit(task, endpoint, payload, scheduled))
+            else:
+                records.append({"endpoint": endpoint, "scheduled": scheduled, "start": scheduled,
+                                "end": scheduled, "status": 0, "error": "dropped"})
+            scheduled += rng.expovariate(rate) if arrival == "poisson" else 1.0 / rate
+    records.extend(future.result() for future in futures)
+    return records
+
+
+def run_closed_loop(base_url, workload, users, duration, timeout=60, think_time=0.0):
+    """
+    Run N users that each send requests back to back
+
+    Args:
+        base_url (str): Base URL of the API
+        workload (Workload): Request generator
+        users (int): Number of concurrent users
+        duration (float): Length of the run in seconds
+        timeout (float): Request timeout in seconds
+        think_time (float): Pause of a user between requests in seconds
+
+    Returns:
+        list: Request records
+    """
+    deadline = time.perf_counter() + duration
+
+    def user():
+        records = []
+        while time.perf_counter() < deadline:
+            endpoint, payload = workload.next_request()
+            records.append(send_request(base_url, endpoint, payload, timeout))
+            if think_time > 0:
+                time.sleep(think_time)
+        return records
+
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        futures = [executor.submit(user) for _ in range(users)]
+    return [record for future in futures for record in future.result()]
+
+
+def percentile(sorted_values, q):
+    """Return the q-th percentile (0-100) of sorted values using the nearest-rank method"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(len(sorted_values) * q / 100))
+    return sorted_values[rank - 1]
+
+
+def summarize(records, elapsed):
+    """
+    Summarize request records per endpoint and overall
+
+    Latency is measured from the scheduled start, so it includes any time an
+    open-loop request waited for a free worker; service time starts when the
+    request was actually sent.
+
+    Args:
+        records (list): Request records
+        elapsed (float): Wall-clock duration of the run in seconds
+
+    Returns:
+        dict: Summary keyed by endpoint name and "all"
+    """
+    groups = {"all": records}
+    for record in records:
+        groups.setdefault(record["endpoint"], []).append(record)
+
+    summary = {}
+    for name, group in groups.items():
+        ok = [r for r in group if r["error"] is None]
+        latencies = sorted(r["end"] - r["scheduled"] for r in ok)
+        service = sorted(r["end"] - r["start"] for r in ok)
+        errors = {}
+        for record in group:
+            if record["error"] is not None:
+                errors[record["error"]] = errors.get(record["error"], 0) + 1
+        summary[name] = {
+            "requests": len(group),
+            "ok": len(ok),
+            "errors": errors,
+            "error_rate": (len(group) - len(ok)) / len(group) if group else 0.0,
+            "throughput": len(ok) / elapsed if elapsed > 0 else 0.0,
+            "latency": {
+                "mean": sum(latencies) / len(latencies) if latencies else None,
+                "p50": percentile(latencies, 50),
+                "p90": percentile(latencies, 90),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": latencies[-1] if latencies else None
+            },
+            "service_time": {
+                "p50": percentile(service, 50),
+                "p99": percentile(service, 99)
+            }
+        }
+        first = sorted(r["first"] - r["scheduled"] for r in ok if r.get("first") is not None)
+        if first:
+            summary[name]["time_to_first_chunk"] = {
+                "p50": percentile(first, 50),
+                "p90": percentile(first, 90),
+                "p99": percentile(first, 99)
+            }
+    return summary
+
+
+def print_report(summary, config):
+    """Print a load test summary"""
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.1f}"
+
+    print(f"\nPyLLM load test: {config}")
+    header = f"{'endpoint':<10} {'requests':>8} {'ok':>7} {'err %':>6} {'req/s':>8} " \
+             f"{'p50 ms':>9} {'p90 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for name in sorted(summary, key=lambda n: (n == "all", n)):
+        s = summary[name]
+        latency = s["latency"]
+        print(f"{name:<10} {s['requests']:>8} {s['ok']:>7} {s['error_rate'] * 100:>6.2f} {s['throughput']:>8.2f} "
+              f"{ms(latency['p50']):>9} {ms(latency['p90']):>9} {ms(latency['p95']):>9} "
+              f"{ms(latency['p99']):>9} {ms(latency['max']):>9}")
+    if "time_to_first_chunk" in summary["all"]:
+        print("\nTime to first chunk:")
+        for name in sorted(summary, key=lambda n: (n == "all", n)):
+            first = summary[name].get("time_to_first_chunk")
+            if first:
+                print(f"{name:<10} p50 {ms(first['p50'])} ms, p90 {ms(first['p90'])} ms, p99 {ms(first['p99'])} ms")
+    errors = summary["all"]["errors"]
+    if errors:
+        print("Errors: " + ", ".join(f"{error}: {count}" for error, count in sorted(errors.items())))
+
+
+def main(argv=None):
+    """
+    Main function
+    """
+    parser = argparse.ArgumentParser(description="Load test the PyLLM API /query and /fix-code endpoints")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Base URL of a running PyLLM API, e.g. http://localhost:9001")
+    target.add_argument("--stub", action="store_true",
+                        help="Start the API in-process with a stub ModelManager (offline)")
+    parser.add_argument("--stub-latency", type=float, default=0.05,
+                        help="Fixed latency of a stub generation in seconds (default: 0.05)")
+    parser.add_argument("--stub-tokens-per-second", type=float, default=200.0,
+                        help="Simulated stub generation speed (default: 200)")
+    parser.add_argument("--stub-batch", action="store_true",
+                        help="Give the stub query_model_batch so the API batches non-streaming requests")
+    parser.add_argument("--mode", choices=["open", "closed"], default="closed",
+                        help="open: fixed arrival rate, closed: N concurrent users (default: closed)")
+    parser.add_argument("--rate", type=float, default=10.0, help="Open loop arrival rate in requests/s (default: 10)")
+    parser.add_argument("--arrival", choices=["poisson", "uniform"], default="poisson",
+                        help="Open loop inter-arrival distribution (default: poisson)")
+    parser.add_argument("--max-in-flight", type=int, default=512,
+                        help="Open loop cap on outstanding requests; excess arrivals are dropped (default: 512)")
+    parser.add_argument("--users", type=int, default=8, help="Closed loop concurrent users (default: 8)")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="Closed loop pause between requests of a user in seconds (default: 0)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Run length in seconds (default: 30)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Request timeout in seconds (default: 120)")
+    parser.add_argument("--mix", default="query=0.5,fix-code=0.5",
+                        help="Endpoint weights (default: query=0.5,fix-code=0.5)")
+    parser.add_argument("--prompt-size", default="lognormal:400:0.8",
+                        help="/query prompt length in characters: fixed:N, uniform:LOW:HIGH or "
+                             "lognormal:MEDIAN:SIGMA (default: lognormal:400:0.8)")
+    parser.add_argument("--code-lines", default="lognormal:40:0.8",
+                        help="/fix-code code length in lines, same forms as --prompt-size "
+                             "(default: lognormal:40:0.8)")
+    parser.add_argument("--model", default="llama3", help="Model for /query requests (default: llama3)")
+    parser.add_argument("--max-tokens", type=int, default=256, help="max_tokens of /query requests (default: 256)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Request streamed (NDJSON) responses and report time to first chunk")
+    parser.add_argument("--local-repair", action="store_true",
+                        help="Let the API repair the synthetic /fix-code errors locally instead of "
+                             "querying the model")
+    parser.add_argument("--seed", type=int, help="Random seed for a reproducible workload")
+    parser.add_argument("--json-out", help="Write the summary as JSON to this file")
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+        prompt_size = parse_distribution(args.prompt_size)
+        code_lines = parse_distribution(args.code_lines)
+    except (argparse.ArgumentTypeError, ValueError) as e:
+        parser.error(str(e))
+
+    server = None
+    base_url = args.url.rstrip("/") if args.url else None
+    if args.stub:
+        base_url, server = start_stub_server(args.stub_latency, args.stub_tokens_per_second, args.stub_batch)
+        print(f"Started stub PyLLM API at {base_url}")
+
+    workload = Workload(mix, prompt_size, code_lines, args.model, args.max_tokens, args.seed, args.stream,
+                        args.local_repair)
+    if args.mode == "open":
+        config = f"open loop, {args.rate} req/s ({args.arrival}), {args.duration}s"
+    else:
+        config = f"closed loop, {args.users} users, think {args.think_time}s, {args.duration}s"
+    print(f"Running {config} against {base_url}...")
+
+    start = time.perf_counter()
+    try:
+        if args.mode == "open":
+            records = run_open_loop(base_url, workload, args.rate, args.duration, args.timeout,
+                                    args.max_in_flight, args.arrival, args.seed)
+        else:
+            records = run_closed_loop(base_url, workload, args.users, args.duration, args.timeout, args.think_time)
+    finally:
+        if server is not None:
+            server.should_exit = True
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(records, elapsed)
+    print_report(summary, config)
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({"config": vars(args), "elapsed": elapsed, "summary": summary}, f, indent=2)
+        print(f"Summary written to {args.json_out}")
+
+    return 0 if summary["all"]["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
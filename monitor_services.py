@@ -9,16 +9,35 @@ This script monitors the health of all WebLama microservices and reports their s
 import requests
 import time
 import json
+import math
 import os
+import random
+import re
+import subprocess
+import sys
+import sqlite3
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from queue import Queue
+from fnmatch import fnmatch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
 from datetime import datetime
 from rich.console import Console
 from rich.table import Table
 from rich.panel import Panel
 
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
 # Initialize rich console
 console = Console()
 
-# Service endpoints
+# Legacy service endpoints, used when discovery finds nothing
 SERVICES = {
     "Bexy": "http://localhost:8000/health",
     "PyLLM": "http://localhost:8001/health",
@@ -26,19 +45,185 @@ SERVICES = {
     "WebLama": "http://localhost:5000/health"
 }
 
-def check_service_health(name, url):
+# Default ports of the local stack started by start-pylama.sh; override with
+# <NAME>_PORT environment variables (e.g. BEXY_PORT=8000 for Makefile.logging)
+LOCAL_PORTS = {
+    "bexy": 7000,
+    "getllm": 7001,
+    "shellama": 7002,
+    "devlama": 7003,
+    "apilama": 7080,
+    "weblama": 6081,
+    "loglama": 5001
+}
+
+# Health check paths for services that do not serve /health
+HEALTH_PATHS = {
+    "weblama": "/",
+    "ollama": "/api/version"
+}
+
+# Consecutive RSS increases (one sample per cycle) that raise a leak alert,
+# and the minimum total growth in bytes over those samples
+RSS_GROWTH_SAMPLES = 10
+RSS_GROWTH_MIN_BYTES = 1024 * 1024
+
+# Per-service process sampling state: name -> {"prev", "rss", "alerted"}
+PROCESS_STATE = {}
+
+# Rolling latency windows: name -> (window length in seconds, number of slots)
+LATENCY_WINDOWS = {
+    "1m": (60, 6),
+    "15m": (900, 15),
+    "1h": (3600, 12)
+}
+
+# Per-service rolling latency histograms: name -> {window name -> RollingHistogram}
+LATENCY = {}
+
+
+class LatencyHistogram:
+    """
+    Log-linear latency histogram with two significant digits of precision.
+
+    Latencies are bucketed in microseconds. Every power of ten is split into
+    90 linear sub-buckets, so percentiles are accurate to within 10% while the
+    number of buckets stays bounded no matter how many samples are recorded.
+    Buckets include their upper bound, like the "le" buckets of OpenMetrics.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.max = 0.0
+
+    @staticmethod
+    def bucket_index(seconds):
+        """Return the bucket index for a latency in seconds."""
+        # Rounded to the nanosecond first, so that a latency such as 0.025
+        # is not pushed past its bound by floating point error
+        micros = max(math.ceil(round(seconds * 1000000, 3)) - 1, 0)
+        if micros < 10:
+            return micros
+        exponent = len(str(micros)) - 2
+        return exponent * 90 + micros // 10 ** exponent
+
+    @staticmethod
+    def bucket_upper_bound(index):
+        """Return the inclusive upper bound, in seconds, of a bucket."""
+        if index < 10:
+            return (index + 1) / 1000000
+        exponent = (index - 10) // 90
+        mantissa = index - exponent * 90
+        return (mantissa + 1) * 10 ** exponent / 1000000
+
+    def record(self, seconds, count=1):
+        """Record a latency sample."""
+        index = self.bucket_index(seconds)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.total += count
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        """Add the samples of another histogram to this one."""
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        """
+        Return the latency at percentile q (0-100), or None if empty
+
+        The upper bound of the matching bucket is reported, capped at the
+        largest recorded sample.
+        """
+        if self.total == 0:
+            return None
+        rank = max(1, int(-(-self.total * q // 100)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.bucket_upper_bound(index), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "counts": {str(index): count for index, count in self.counts.items()},
+            "total": self.total,
+            "max": self.max
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.counts = {int(index): count for index, count in data.get("counts", {}).items()}
+        histogram.total = data.get("total", sum(histogram.counts.values()))
+        histogram.max = data.get("max", 0.0)
+        return histogram
+
+
+class RollingHistogram:
+    """
+    Latency histogram over a sliding time window.
+
+    The window is divided into fixed-width slots, each holding its own
+    LatencyHistogram. Slots that fall out of the window are dropped, so memory
+    is bounded by the slot count rather than by the number of samples.
+    """
+
+    def __init__(self, window, slots):
+        self.window = window
+        self.slot_width = window / slots
+        self.slots = deque()
+
+    def _expire(self, now):
+        while self.slots and self.slots[0][0] + self.slot_width <= now - self.window:
+            self.slots.popleft()
+
+    def record(self, seconds, now=None):
+        """Record a latency sample at time now (defaults to the current time)."""
+        now = time.time() if now is None else now
+        self._expire(now)
+        slot_start = now - now % self.slot_width
+        if not self.slots or self.slots[-1][0] != slot_start:
+            self.slots.append((slot_start, LatencyHistogram()))
+        self.slots[-1][1].record(seconds)
+
+    def snapshot(self, now=None):
+        """Return a LatencyHistogram with all samples still inside the window."""
+        now = time.time() if now is None else now
+        self._expire(now)
+        merged = LatencyHistogram()
+        for _, histogram in self.slots:
+            merged.merge(histogram)
+        return merged
+
+    def to_dict(self):
+        return [[slot_start, histogram.to_dict()] for slot_start, histogram in self.slots]
+
+    def load(self, data, now=None):
+        self.slots = deque(
+            (slot_start, LatencyHistogram.from_dict(histogram)) for slot_start, histogram in data
+        )
+        self._expire(time.time() if now is None else now)
+
+def check_service_health(name, url, session=None):
     """
     Check the health of a service and return its status
     
     Args:
         name (str): The name of the service
         url (str): The health check URL
+        session (requests.Session): Session to reuse connections from (optional)
         
     Returns:
         dict: The service status information
     """
+    http = session or requests
     try:
-        response = requests.get(url, timeout=5)
+        response = http.get(url, timeout=5)
         if response.status_code == 200:
             data = response.json()
             return {
@@ -68,12 +253,495 @@ def check_service_health(name, url):
             "error": str(e)
         }
 
-def display_status(results):
+def make_target(name, url, stack="default", pid_file=None):
+    """Return a monitoring target description"""
+    return {"name": name, "url": url, "stack": stack, "pid_file": pid_file}
+
+def expand_env(text):
+    """Expand ${VAR}, ${VAR:-default} and $VAR references like docker-compose does"""
+    def replace(match):
+        name = match.group(1) or match.group(3)
+        default = match.group(2)
+        value = os.environ.get(name)
+        if value is None or (value == "" and default is not None):
+            return default or ""
+        return value
+    return re.sub(r"\$\{(\w+)(?::?-([^}]*))?\}|\$(\w+)", replace, str(text))
+
+def parse_published_port(port):
+    """
+    Return the host port published by a compose port mapping, or None
+    
+    Handles "9001:8001", "127.0.0.1:9001:8001", "9001:8001/tcp", port ranges
+    (the first port is used) and the long syntax with a "published" key.
+    Container-only ports are not reachable from the host and return None.
+    """
+    if isinstance(port, dict):
+        published = port.get("published")
+        return int(str(expand_env(published)).split("-")[0]) if published else None
+    parts = expand_env(port).split("/")[0].split(":")
+    if len(parts) < 2 or not parts[-2]:
+        return None
+    return int(parts[-2].split("-")[0])
+
+def discover_compose_services(path, host="localhost"):
+    """
+    Discover monitoring targets from a docker-compose file
+    
+    Every service with a published port becomes a target named
+    "<stack>/<service>", where the stack is the compose project name or the
+    file name. The health path can be set with a "monitor.health_path" label.
+    
+    Args:
+        path (str): Path to the compose file
+        host (str): Host the published ports are reachable on
+        
+    Returns:
+        list: Target dictionaries
+    """
+    if yaml is None:
+        console.print(f"[yellow]PyYAML is not installed, skipping {path}[/yellow]")
+        return []
+    try:
+        with open(path) as f:
+            data = yaml.safe_load(f) or {}
+    except (OSError, yaml.YAMLError) as e:
+        console.print(f"[yellow]Could not read {path}: {e}[/yellow]")
+        return []
+    
+    stack = data.get("name") or os.path.splitext(os.path.basename(path))[0]
+    targets = []
+    for service, config in (data.get("services") or {}).items():
+        config = config or {}
+        ports = [p for p in map(parse_published_port, config.get("ports") or []) if p]
+        if not ports:
+            continue
+        labels = config.get("labels") or {}
+        if isinstance(labels, list):
+            labels = dict(label.split("=", 1) for label in labels if "=" in label)
+        health_path = labels.get("monitor.health_path", HEALTH_PATHS.get(service, "/health"))
+        targets.append(make_target(f"{stack}/{service}", f"http://{host}:{ports[0]}{health_path}", stack))
+    return targets
+
+def discover_pid_services(pid_dir="logs", host="127.0.0.1"):
+    """
+    Discover monitoring targets of a local stack from its PID files
+    
+    start-pylama.sh and Makefile.logging write logs/<name>.pid for every
+    service they start. The port comes from the <NAME>_PORT environment
+    variable or LOCAL_PORTS; PID files of unknown services are skipped.
+    
+    Args:
+        pid_dir (str): Directory containing the PID files
+        host (str): Host the local services listen on
+        
+    Returns:
+        list: Target dictionaries
+    """
+    if not os.path.isdir(pid_dir):
+        return []
+    targets = []
+    for filename in sorted(os.listdir(pid_dir)):
+        if not filename.endswith(".pid"):
+            continue
+        name = filename[:-len(".pid")]
+        port = os.environ.get(f"{name.upper()}_PORT", LOCAL_PORTS.get(name))
+        if port is None:
+            continue
+        url = f"http://{host}:{port}{HEALTH_PATHS.get(name, '/health')}"
+        targets.append(make_target(f"local/{name}", url, "local", os.path.join(pid_dir, filename)))
+    return targets
+
+def discover_services(compose_files=(), pid_dir="logs", environ=None):
+    """
+    Build the list of monitoring targets
+    
+    Targets are collected from the compose files and PID files, then the
+    MONITOR_SERVICES environment variable ("name=url,name=url") adds or
+    replaces targets and MONITOR_EXCLUDE ("pattern,pattern") removes targets
+    whose names match a glob pattern. The legacy SERVICES endpoints are used
+    when nothing is found.
+    
+    Args:
+        compose_files (list): docker-compose files to read
+        pid_dir (str): Directory containing PID files of a local stack
+        environ (dict): Environment to read overrides from (defaults to os.environ)
+        
+    Returns:
+        list: Target dictionaries sorted by name
+    """
+    environ = os.environ if environ is None else environ
+    targets = {}
+    for path in compose_files:
+        for target in discover_compose_services(path):
+            targets[target["name"]] = target
+    if pid_dir:
+        for target in discover_pid_services(pid_dir):
+            targets[target["name"]] = target
+    
+    for entry in environ.get("MONITOR_SERVICES", "").split(","):
+        if "=" in entry:
+            name, url = (part.strip() for part in entry.split("=", 1))
+            targets[name] = make_target(name, url, "env", targets.get(name, {}).get("pid_file"))
+    
+    if not targets:
+        targets = {name: make_target(name, url) for name, url in SERVICES.items()}
+    
+    excluded = [p.strip() for p in environ.get("MONITOR_EXCLUDE", "").split(",") if p.strip()]
+    return sorted(
+        (t for t in targets.values() if not any(fnmatch(t["name"], p) for p in excluded)),
+        key=lambda t: t["name"]
+    )
+
+def probe_offset(name, spread):
+    """Return a stable start offset within [0, spread) for a target"""
+    return (zlib.crc32(name.encode("utf-8")) % 10000) / 10000 * spread
+
+def probe_services(targets, spread=0, workers=32, session=None, on_result=None):
+    """
+    Check the health of all targets
+    
+    Each target is started at a stable offset within the spread so that
+    hundreds of endpoints are not hit in one burst, and at most `workers`
+    checks run concurrently over a shared connection pool.
+    
+    Args:
+        targets (list): Target dictionaries
+        spread (float): Seconds over which to spread the probe start times
+        workers (int): Maximum number of concurrent checks
+        session (requests.Session): Session to reuse connections from (optional)
+        on_result (callable): Called with (target, result) in the calling
+            thread as soon as each check completes (optional)
+        
+    Returns:
+        list: Service status dictionaries in target order
+    """
+    start = time.monotonic()
+    schedule = sorted(targets, key=lambda t: probe_offset(t["name"], spread))
+    futures = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(targets)))) as executor:
+        for target in schedule:
+            delay = start + probe_offset(target["name"], spread) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            futures[executor.submit(check_service_health, target["name"], target["url"], session)] = target
+        if on_result:
+            for future in as_completed(futures):
+                on_result(futures[future], future.result())
+    results = {target["name"]: future.result() for future, target in futures.items()}
+    return [results[target["name"]] for target in targets]
+
+def make_session(workers=32):
+    """Return a requests session with a connection pool sized for `workers` concurrent checks"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def read_pid_file(path):
+    """Return the PID stored in a PID file, or None if it is missing or invalid"""
+    try:
+        with open(path) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def process_children(proc="/proc"):
+    """
+    Scan procfs once and return a map of parent PID -> child PIDs
+    
+    The scan reads the stat file of every process on the host, so a probe
+    cycle builds the map once and shares it between all of its targets.
+    """
+    children = {}
+    for entry in os.listdir(proc):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"{proc}/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+def process_tree(pid, proc="/proc", children=None):
+    """
+    Return pid and all of its descendants
+    
+    start-pylama.sh records the PID of the shell that launches a service, so
+    the actual server usually runs as a child of the recorded process.
+    
+    Args:
+        pid (int): The root process ID
+        proc (str): Mount point of procfs
+        children (dict): Map from process_children (scanned when omitted)
+    """
+    if children is None:
+        children = process_children(proc)
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+def read_process_stats(pid, proc="/proc"):
+    """
+    Read resource counters of a single process from /proc
+    
+    Args:
+        pid (int): The process ID
+        proc (str): Mount point of procfs
+        
+    Returns:
+        dict: CPU ticks, RSS bytes, open fds, threads and context switches,
+            or None if the process does not exist
+    """
+    try:
+        with open(f"{proc}/{pid}/stat") as f:
+            # The command name may contain spaces; fields resume after ")"
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"{proc}/{pid}/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+    except (OSError, IndexError):
+        return None
+    try:
+        fds = len(os.listdir(f"{proc}/{pid}/fd"))
+    except OSError:
+        fds = None
+    return {
+        "cpu_ticks": int(fields[11]) + int(fields[12]),
+        "threads": int(fields[17]),
+        "rss": int(status.get("VmRSS", "0 kB").split()[0]) * 1024,
+        "fds": fds,
+        "voluntary_ctxt_switches": int(status.get("voluntary_ctxt_switches", 0)),
+        "nonvoluntary_ctxt_switches": int(status.get("nonvoluntary_ctxt_switches", 0))
+    }
+
+def sample_process(name, pid_file, now=None, proc="/proc", children=None):
+    """
+    Sample the resource usage of a service process tree
+    
+    CPU usage is computed against the previous sample of the same service,
+    so the first sample of a service reports None.
+    
+    Args:
+        name (str): The name of the service
+        pid_file (str): PID file of the service
+        now (float): Monotonic timestamp of the sample (defaults to the current time)
+        proc (str): Mount point of procfs
+        children (dict): Map from process_children (scanned when omitted)
+        
+    Returns:
+        dict: Aggregated counters of the process and its descendants, or None
+            if the PID file or the process is missing
+    """
+    pid = read_pid_file(pid_file)
+    if pid is None or not os.path.exists(f"{proc}/{pid}"):
+        PROCESS_STATE.pop(name, None)
+        return None
+    now = time.monotonic() if now is None else now
+    
+    totals = {"cpu_ticks": 0, "threads": 0, "rss": 0, "fds": 0,
+              "voluntary_ctxt_switches": 0, "nonvoluntary_ctxt_switches": 0}
+    processes = 0
+    for member in process_tree(pid, proc, children):
+        stats = read_process_stats(member, proc)
+        if stats is None:
+            continue
+        processes += 1
+        for key, value in stats.items():
+            if value is not None and totals[key] is not None:
+                totals[key] += value
+            elif key == "fds":
+                totals["fds"] = None
+    
+    state = PROCESS_STATE.setdefault(name, {"prev": None, "rss": deque(maxlen=RSS_GROWTH_SAMPLES), "alerted": False})
+    cpu_percent = None
+    if state["prev"] and state["prev"][0] == pid and now > state["prev"][1]:
+        ticks = max(totals["cpu_ticks"] - state["prev"][2], 0)
+        cpu_percent = 100.0 * ticks / os.sysconf("SC_CLK_TCK") / (now - state["prev"][1])
+    elif state["prev"] and state["prev"][0] != pid:
+        state["rss"].clear()
+        state["alerted"] = False
+    state["prev"] = (pid, now, totals["cpu_ticks"])
+    state["rss"].append(totals["rss"])
+    
+    sample = dict(totals, pid=pid, processes=processes, cpu_percent=cpu_percent)
+    del sample["cpu_ticks"]
+    return sample
+
+def check_rss_growth(name):
+    """
+    Check whether the RSS of a service has grown monotonically
+    
+    Returns an alert message the first time the last RSS_GROWTH_SAMPLES
+    samples are strictly increasing by at least RSS_GROWTH_MIN_BYTES in total;
+    the alert is re-armed once the growth stops.
+    
+    Args:
+        name (str): The name of the service
+        
+    Returns:
+        str: The alert message, or None
+    """
+    state = PROCESS_STATE.get(name)
+    if not state:
+        return None
+    rss = list(state["rss"])
+    growing = (len(rss) == RSS_GROWTH_SAMPLES
+               and all(later > earlier for earlier, later in zip(rss, rss[1:]))
+               and rss[-1] - rss[0] >= RSS_GROWTH_MIN_BYTES)
+    if not growing:
+        state["alerted"] = False
+        return None
+    if state["alerted"]:
+        return None
+    state["alerted"] = True
+    return (f"RSS of {name} grew for {len(rss)} consecutive samples: "
+            f"{format_bytes(rss[0])} -> {format_bytes(rss[-1])}")
+
+def sample_processes(targets, results):
+    """
+    Attach process samples to the results of targets that have a PID file
+    
+    Procfs is scanned once for all targets. Leak alerts are stored in
+    result["alerts"] and printed.
+    
+    Args:
+        targets (list): Target dictionaries
+        results (list): Service status dictionaries in target order
+    """
+    children = None
+    for target, result in zip(targets, results):
+        if not target.get("pid_file"):
+            continue
+        if children is None:
+            children = process_children()
+        result["process"] = sample_process(target["name"], target["pid_file"], children=children)
+        alert = check_rss_growth(target["name"])
+        if alert:
+            result.setdefault("alerts", []).append(alert)
+            console.print(f"[bold red]ALERT: {alert}[/bold red]")
+
+def format_bytes(size):
+    """Format a size in bytes for display"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024 or unit == "GB":
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+
+def record_latency(results, now=None):
+    """
+    Record the response times of a check cycle in the rolling histograms
+    
+    Offline services have no meaningful response time and are skipped.
+    
+    Args:
+        results (list): List of service status dictionaries
+        now (float): Timestamp of the samples (defaults to the current time)
+    """
+    for result in results:
+        if result["status"] == "offline":
+            continue
+        windows = LATENCY.setdefault(result["name"], {
+            name: RollingHistogram(length, slots) for name, (length, slots) in LATENCY_WINDOWS.items()
+        })
+        for histogram in windows.values():
+            histogram.record(result["response_time"], now)
+
+def latency_summary(name, window="15m", now=None):
+    """
+    Summarize the latency of a service over a rolling window
+    
+    Args:
+        name (str): The name of the service
+        window (str): One of the LATENCY_WINDOWS names
+        now (float): Reference timestamp (defaults to the current time)
+        
+    Returns:
+        dict: Sample count and p50/p95/p99/max latencies in seconds (None when empty)
+    """
+    histogram = LatencyHistogram()
+    if name in LATENCY:
+        histogram = LATENCY[name][window].snapshot(now)
+    return {
+        "count": histogram.total,
+        "p50": histogram.percentile(50),
+        "p95": histogram.percentile(95),
+        "p99": histogram.percentile(99),
+        "max": histogram.max if histogram.total else None
+    }
+
+def save_histograms(path="service_latency.json"):
+    """
+    Persist the rolling latency histograms to a file
+    
+    Only bucket counts are written, never raw samples, so the file size is
+    bounded by the number of services and windows.
+    
+    Args:
+        path (str): Path to the histogram file
+    """
+    data = {
+        "saved_at": time.time(),
+        "services": {
+            name: {window: histogram.to_dict() for window, histogram in windows.items()}
+            for name, windows in LATENCY.items()
+        }
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def load_histograms(path="service_latency.json"):
+    """
+    Restore rolling latency histograms saved by save_histograms
+    
+    Args:
+        path (str): Path to the histogram file
+    """
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        console.print(f"[yellow]Could not load latency histograms from {path}: {e}[/yellow]")
+        return
+    for name, windows in data.get("services", {}).items():
+        LATENCY[name] = {}
+        for window, (length, slots) in LATENCY_WINDOWS.items():
+            histogram = RollingHistogram(length, slots)
+            histogram.load(windows.get(window, []))
+            LATENCY[name][window] = histogram
+
+def format_latency(seconds):
+    """Format a latency in seconds for display"""
+    if seconds is None:
+        return "-"
+    if seconds < 1:
+        return f"{seconds * 1000:.1f}ms"
+    return f"{seconds:.2f}s"
+
+def format_process(sample):
+    """Format a process sample for display"""
+    if not sample:
+        return "-"
+    cpu = "-" if sample["cpu_percent"] is None else f"{sample['cpu_percent']:.1f}%"
+    fds = "-" if sample["fds"] is None else sample["fds"]
+    return f"cpu {cpu} rss {format_bytes(sample['rss'])} fds {fds} thr {sample['threads']}"
+
+def display_status(results, window="15m"):
     """
     Display the service status in a rich table
     
     Args:
         results (list): List of service status dictionaries
+        window (str): Rolling window used for the latency percentiles
     """
     table = Table(title="WebLama Microservices Status")
     
@@ -81,86 +749,1151 @@ def display_status(results):
     table.add_column("Status", style="green")
     table.add_column("Version", style="blue")
     table.add_column("Response Time", style="magenta")
+    table.add_column(f"p50 ({window})", style="magenta")
+    table.add_column(f"p95 ({window})", style="magenta")
+    table.add_column(f"p99 ({window})", style="magenta")
+    table.add_column(f"Max ({window})", style="magenta")
+    show_process = any("process" in result for result in results)
+    if show_process:
+        table.add_column("Process", style="yellow")
     table.add_column("Error", style="red")
     
     for result in results:
         status_style = "green" if result["status"] == "healthy" else "red"
+        summary = latency_summary(result["name"], window)
         
-        table.add_row(
+        row = [
             result["name"],
             f"[{status_style}]{result['status']}",
             result["version"],
             f"{result['response_time']:.4f}s",
-            result["error"] or ""
-        )
+            format_latency(summary["p50"]),
+            format_latency(summary["p95"]),
+            format_latency(summary["p99"]),
+            format_latency(summary["max"])
+        ]
+        if show_process:
+            row.append(format_process(result.get("process")))
+        row.append("; ".join([result["error"] or ""] + result.get("alerts", [])).strip("; "))
+        table.add_row(*row)
     
     console.print(table)
 
-def log_status(results, log_file="service_status.log"):
+# Retention in seconds for each tier of the status store
+STORE_RETENTION = {
+    "samples": 2 * 86400,
+    "process_samples": 2 * 86400,
+    "llm_probes": 14 * 86400,
+    "rollup_1m": 14 * 86400,
+    "rollup_1h": 400 * 86400
+}
+
+# Rollup tiers: table -> (bucket width in seconds, source table)
+STORE_ROLLUPS = {
+    "rollup_1m": (60, "samples"),
+    "rollup_1h": (3600, "rollup_1m")
+}
+
+
+class StatusStore:
     """
-    Log the service status to a file
+    Time-partitioned SQLite store for service status samples.
+    
+    Raw check results are written to the ``samples`` table and downsampled
+    into 1 minute and 1 hour rollups as soon as each period completes. Every
+    rollup row keeps the sample and up counts plus a sparse latency histogram,
+    so uptime and percentiles can be answered from the coarsest tier that
+    covers a time range. Each tier has its own retention, which bounds the
+    database size, and all lookups go through (service, time) indexes.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS samples (
+            ts REAL NOT NULL,
+            service TEXT NOT NULL,
+            status TEXT,
+            up INTEGER NOT NULL,
+            code INTEGER,
+            response_time REAL,
+            version TEXT,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS samples_service_ts ON samples (service, ts);
+        CREATE INDEX IF NOT EXISTS samples_ts ON samples (ts);
+        CREATE TABLE IF NOT EXISTS rollup_1m (
+            service TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            up INTEGER NOT NULL,
+            latency TEXT NOT NULL,
+            PRIMARY KEY (service, bucket)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS rollup_1m_bucket ON rollup_1m (bucket);
+        CREATE TABLE IF NOT EXISTS rollup_1h (
+            service TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            up INTEGER NOT NULL,
+            latency TEXT NOT NULL,
+            PRIMARY KEY (service, bucket)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS rollup_1h_bucket ON rollup_1h (bucket);
+        CREATE TABLE IF NOT EXISTS process_samples (
+            ts REAL NOT NULL,
+            service TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            processes INTEGER NOT NULL,
+            cpu_percent REAL,
+            rss INTEGER,
+            fds INTEGER,
+            threads INTEGER,
+            voluntary_ctxt_switches INTEGER,
+            nonvoluntary_ctxt_switches INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS process_samples_service_ts ON process_samples (service, ts);
+        CREATE INDEX IF NOT EXISTS process_samples_ts ON process_samples (ts);
+        CREATE TABLE IF NOT EXISTS llm_probes (
+            ts REAL NOT NULL,
+            target TEXT NOT NULL,
+            ok INTEGER NOT NULL,
+            code INTEGER,
+            ttfb REAL,
+            total REAL,
+            output_tokens INTEGER,
+            tokens_per_second REAL,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS llm_probes_target_ts ON llm_probes (target, ts);
+        CREATE INDEX IF NOT EXISTS llm_probes_ts ON llm_probes (ts);
+        CREATE TABLE IF NOT EXISTS services (name TEXT PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL NOT NULL);
+    """
+
+    def __init__(self, path="service_status.db"):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _watermark(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def write(self, results, now=None):
+        """
+        Store the results of a check cycle and roll up completed periods
+        
+        Args:
+            results (list): List of service status dictionaries
+            now (float): Timestamp of the results (defaults to the current time)
+        """
+        now = time.time() if now is None else now
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO samples (ts, service, status, up, code, response_time, version, error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(now, r["name"], r["status"], int(r["code"] == 200), r["code"],
+                  r["response_time"], r["version"], r["error"]) for r in results]
+            )
+            self.conn.executemany(
+                "INSERT INTO process_samples (ts, service, pid, processes, cpu_percent, rss, fds, threads, "
+                "voluntary_ctxt_switches, nonvoluntary_ctxt_switches) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(now, r["name"], p["pid"], p["processes"], p["cpu_percent"], p["rss"], p["fds"], p["threads"],
+                  p["voluntary_ctxt_switches"], p["nonvoluntary_ctxt_switches"])
+                 for r in results for p in [r.get("process")] if p]
+            )
+            self.conn.executemany("INSERT OR IGNORE INTO services (name) VALUES (?)",
+                                  [(r["name"],) for r in results])
+            self.downsample(now)
+
+    def downsample(self, now=None):
+        """
+        Roll completed periods up into the coarser tiers and apply retention
+        
+        Args:
+            now (float): Reference timestamp (defaults to the current time)
+        """
+        now = time.time() if now is None else now
+        for table, (width, source) in STORE_ROLLUPS.items():
+            end = int(now // width * width)
+            start = self._watermark(table)
+            if start is None:
+                if source == "samples":
+                    row = self.conn.execute("SELECT MIN(ts) FROM samples").fetchone()
+                else:
+                    row = self.conn.execute(f"SELECT MIN(bucket) FROM {source}").fetchone()
+                if row[0] is None:
+                    continue
+                start = int(row[0] // width * width)
+            if start >= end:
+                continue
+            
+            rollups = {}
+            if source == "samples":
+                rows = self.conn.execute(
+                    "SELECT service, ts, up, status, response_time FROM samples WHERE ts >= ? AND ts < ?",
+                    (start, end)
+                )
+                for service, ts, up, status, response_time in rows:
+                    key = (service, int(ts // width * width))
+                    entry = rollups.setdefault(key, [0, 0, LatencyHistogram()])
+                    entry[0] += 1
+                    entry[1] += up
+                    if status != "offline":
+                        entry[2].record(response_time)
+            else:
+                rows = self.conn.execute(
+                    f"SELECT service, bucket, samples, up, latency FROM {source} WHERE bucket >= ? AND bucket < ?",
+                    (start, end)
+                )
+                for service, bucket, samples, up, latency in rows:
+                    key = (service, int(bucket // width * width))
+                    entry = rollups.setdefault(key, [0, 0, LatencyHistogram()])
+                    entry[0] += samples
+                    entry[1] += up
+                    entry[2].merge(LatencyHistogram.from_dict(json.loads(latency)))
+            
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO {table} (service, bucket, samples, up, latency) VALUES (?, ?, ?, ?, ?)",
+                [(service, bucket, samples, up, json.dumps(histogram.to_dict()))
+                 for (service, bucket), (samples, up, histogram) in rollups.items()]
+            )
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (table, end))
+        
+        for table, retention in STORE_RETENTION.items():
+            column = "bucket" if table.startswith("rollup") else "ts"
+            self.conn.execute(f"DELETE FROM {table} WHERE {column} < ?", (now - retention,))
+
+    def write_llm_probe(self, result):
+        """
+        Store the result of a synthetic LLM probe
+        
+        Args:
+            result (dict): Result of LLMProbe.run
+        """
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO llm_probes (ts, target, ok, code, ttfb, total, output_tokens, tokens_per_second, error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (result["timestamp"], result["name"], int(result["ok"]), result["code"], result["ttfb"],
+                 result["total"], result["output_tokens"], result["tokens_per_second"], result["error"])
+            )
+
+    def services(self):
+        """Return the names of all services that have been recorded."""
+        return [row[0] for row in self.conn.execute("SELECT name FROM services ORDER BY name")]
+
+    def query(self, service, since, now=None):
+        """
+        Summarize uptime and latency of a service over a recent period
+        
+        Fully rolled-up hours and minutes are read from the rollup tiers and
+        only the edges of the range are read from the raw samples, so the cost
+        of a query grows with the number of periods, not with the history size.
+        Hourly rollups are only used for ranges longer than a day.
+        
+        Args:
+            service (str): The name of the service
+            since (float): Length of the period in seconds, ending now
+            now (float): End of the period (defaults to the current time)
+            
+        Returns:
+            dict: Sample count, uptime percentage and latency percentiles
+        """
+        now = time.time() if now is None else now
+        start = now - since
+        samples = up = 0
+        histogram = LatencyHistogram()
+        
+        def add_raw(lo, hi):
+            nonlocal samples, up
+            if lo >= hi:
+                return
+            rows = self.conn.execute(
+                "SELECT up, status, response_time FROM samples WHERE service = ? AND ts >= ? AND ts < ?",
+                (service, lo, hi)
+            )
+            for row_up, status, response_time in rows:
+                samples += 1
+                up += row_up
+                if status != "offline":
+                    histogram.record(response_time)
+        
+        def add_rollup(table, lo, hi):
+            nonlocal samples, up
+            if lo >= hi:
+                return
+            rows = self.conn.execute(
+                f"SELECT samples, up, latency FROM {table} WHERE service = ? AND bucket >= ? AND bucket < ?",
+                (service, lo, hi)
+            )
+            for row_samples, row_up, latency in rows:
+                samples += row_samples
+                up += row_up
+                histogram.merge(LatencyHistogram.from_dict(json.loads(latency)))
+        
+        rolled_1m = self._watermark("rollup_1m") or 0
+        rolled_1h = self._watermark("rollup_1h") or 0
+        
+        # Leading partial minute from the raw samples
+        cursor = min(-(-start // 60) * 60, now)
+        add_raw(start, cursor)
+        
+        if since > 86400:
+            # Minutes up to the first whole hour, then whole hours
+            hour_start = min(-(-start // 3600) * 3600, rolled_1m)
+            add_rollup("rollup_1m", cursor, hour_start)
+            cursor = max(cursor, hour_start)
+            if rolled_1h > cursor:
+                add_rollup("rollup_1h", cursor, rolled_1h)
+                cursor = rolled_1h
+        
+        if rolled_1m > cursor:
+            add_rollup("rollup_1m", cursor, rolled_1m)
+            cursor = rolled_1m
+        
+        # Trailing samples that have not been rolled up yet
+        add_raw(cursor, now + 1)
+        
+        return {
+            "service": service,
+            "since": since,
+            "samples": samples,
+            "uptime": 100.0 * up / samples if samples else None,
+            "p50": histogram.percentile(50),
+            "p95": histogram.percentile(95),
+            "p99": histogram.percentile(99),
+            "max": histogram.max if histogram.total else None
+        }
+
+
+def parse_duration(text):
+    """
+    Parse a duration such as "90s", "15m", "6h", "2d" or "1w" into seconds
+    
+    Args:
+        text (str): The duration; a bare number is taken as seconds
+        
+    Returns:
+        float: The duration in seconds
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*", text)
+    if not match:
+        raise ValueError(f"Invalid duration: {text!r}")
+    units = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+    return float(match.group(1)) * units[match.group(2)]
+
+def log_status(results, store):
+    """
+    Record the service status in the status store
     
     Args:
         results (list): List of service status dictionaries
-        log_file (str): Path to the log file
+        store (StatusStore): The store to write to
+    """
+    store.write(results)
+
+def query_status(db_path, service=None, since="6h", as_json=False):
+    """
+    Print uptime and latency summaries from the status store
+    
+    Args:
+        db_path (str): Path to the status database
+        service (str): The service to summarize (all services if None)
+        since (str): Length of the period, e.g. "6h"
+        as_json (bool): Print JSON instead of a table
+    """
+    try:
+        seconds = parse_duration(since)
+    except ValueError as e:
+        console.print(f"[red]{e}[/red]")
+        return 2
+    
+    if not os.path.exists(db_path):
+        console.print(f"[red]Status database {db_path} not found.[/red]")
+        return 1
+    
+    store = StatusStore(db_path)
+    try:
+        names = [service] if service else store.services()
+        summaries = [store.query(name, seconds) for name in names]
+    finally:
+        store.close()
+    
+    if as_json:
+        print(json.dumps(summaries, indent=2))
+        return 0
+    
+    table = Table(title=f"Service Status over the last {since}")
+    table.add_column("Service", style="cyan")
+    table.add_column("Samples", style="blue")
+    table.add_column("Uptime", style="green")
+    table.add_column("p50", style="magenta")
+    table.add_column("p95", style="magenta")
+    table.add_column("p99", style="magenta")
+    table.add_column("Max", style="magenta")
+    
+    for summary in summaries:
+        uptime = "-" if summary["uptime"] is None else f"{summary['uptime']:.2f}%"
+        table.add_row(
+            summary["service"],
+            str(summary["samples"]),
+            uptime,
+            format_latency(summary["p50"]),
+            format_latency(summary["p95"]),
+            format_latency(summary["p99"]),
+            format_latency(summary["max"])
+        )
+    
+    console.print(table)
+    return 0
+
+# Bucket boundaries (seconds) for OpenMetrics histograms; two significant
+# digits so they line up exactly with LatencyHistogram buckets
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+class MonitorMetrics:
+    """
+    In-memory metrics of the monitor, rendered in OpenMetrics text format.
+    
+    The state is only updated by the probe loop; rendering reads a snapshot
+    under a lock and never triggers a probe.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.up = {}
+        self.probes = {}
+        self.latency = {}
+        self.latency_sum = {}
+        self.errors = {}
+        self.process = {}
+        self.states = {}
+        self.llm = {}
+        self.cycles = LatencyHistogram()
+        self.cycles_sum = 0.0
+        self.last_cycle = None
+
+    def observe_cycle(self, results, duration, now=None):
+        """
+        Update the metrics with the results of a probe cycle
+        
+        Args:
+            results (list): List of service status dictionaries
+            duration (float): Wall-clock duration of the cycle in seconds
+            now (float): Completion time of the cycle (defaults to the current time)
+        """
+        with self.lock:
+            for result in results:
+                name = result["name"]
+                self.up[name] = int(result["code"] == 200)
+                self.probes[name] = self.probes.get(name, 0) + 1
+                if result["status"] != "offline":
+                    self.latency.setdefault(name, LatencyHistogram()).record(result["response_time"])
+                    self.latency_sum[name] = self.latency_sum.get(name, 0.0) + result["response_time"]
+                if result["code"] != 200:
+                    code = str(result["code"]) if result["code"] else "connection"
+                    self.errors[(name, code)] = self.errors.get((name, code), 0) + 1
+                if result.get("process"):
+                    self.process[name] = result["process"]
+                elif "process" in result:
+                    self.process.pop(name, None)
+            self.cycles.record(duration)
+            self.cycles_sum += duration
+            self.last_cycle = time.time() if now is None else now
+
+    def observe_llm_probe(self, result):
+        """
+        Update the synthetic LLM probe series with a probe result
+        
+        Args:
+            result (dict): Result of LLMProbe.run, or a skipped marker
+        """
+        with self.lock:
+            entry = self.llm.setdefault(result["name"], {
+                "ttfb": LatencyHistogram(), "ttfb_sum": 0.0,
+                "total": LatencyHistogram(), "total_sum": 0.0,
+                "tokens_per_second": None, "probes": {"ok": 0, "error": 0, "skipped": 0}
+            })
+            if result.get("skipped"):
+                entry["probes"]["skipped"] += 1
+                return
+            entry["probes"]["ok" if result["ok"] else "error"] += 1
+            if result["ok"]:
+                entry["ttfb"].record(result["ttfb"])
+                entry["ttfb_sum"] += result["ttfb"]
+                entry["total"].record(result["total"])
+                entry["total_sum"] += result["total"]
+                entry["tokens_per_second"] = result["tokens_per_second"]
+
+    def set_state(self, name, state):
+        """Record the scheduling state of a service"""
+        with self.lock:
+            self.states[name] = state
+
+    @staticmethod
+    def _labels(**labels):
+        if not labels:
+            return ""
+        parts = []
+        for key, value in labels.items():
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            parts.append(f'{key}="{value}"')
+        return "{" + ",".join(parts) + "}"
+
+    @classmethod
+    def _histogram_lines(cls, metric, histogram, total, **labels):
+        lines = []
+        for bound in METRICS_BUCKETS:
+            count = sum(c for index, c in histogram.counts.items()
+                        if LatencyHistogram.bucket_upper_bound(index) <= bound)
+            lines.append(f"{metric}_bucket{cls._labels(**labels, le=repr(float(bound)))} {count}")
+        lines.append(f"{metric}_bucket{cls._labels(**labels, le='+Inf')} {histogram.total}")
+        lines.append(f"{metric}_count{cls._labels(**labels)} {histogram.total}")
+        lines.append(f"{metric}_sum{cls._labels(**labels)} {total}")
+        return lines
+
+    def render(self):
+        """Return the metrics in OpenMetrics text exposition format."""
+        with self.lock:
+            lines = [
+                "# TYPE monitor_service_up gauge",
+                "# HELP monitor_service_up Whether the last health check of the service returned HTTP 200.",
+            ]
+            for name, value in sorted(self.up.items()):
+                lines.append(f"monitor_service_up{self._labels(service=name)} {value}")
+            
+            lines += [
+                "# TYPE monitor_service_state stateset",
+                "# HELP monitor_service_state Scheduling state of the service.",
+            ]
+            for name, current in sorted(self.states.items()):
+                for state in ("healthy", "degraded", "offline", "recovering"):
+                    labels = self._labels(service=name, monitor_service_state=state)
+                    lines.append(f"monitor_service_state{labels} {int(state == current)}")
+            
+            lines += [
+                "# TYPE monitor_probes counter",
+                "# HELP monitor_probes Health checks performed per service.",
+            ]
+            for name, value in sorted(self.probes.items()):
+                lines.append(f"monitor_probes_total{self._labels(service=name)} {value}")
+            
+            lines += [
+                "# TYPE monitor_probe_latency_seconds histogram",
+                "# UNIT monitor_probe_latency_seconds seconds",
+                "# HELP monitor_probe_latency_seconds Health check response time per service.",
+            ]
+            for name, histogram in sorted(self.latency.items()):
+                lines += self._histogram_lines("monitor_probe_latency_seconds", histogram,
+                                               self.latency_sum[name], service=name)
+            
+            lines += [
+                "# TYPE monitor_probe_errors counter",
+                "# HELP monitor_probe_errors Failed health checks by service and HTTP code.",
+            ]
+            for (name, code), value in sorted(self.errors.items()):
+                lines.append(f"monitor_probe_errors_total{self._labels(service=name, code=code)} {value}")
+            
+            process_metrics = [
+                ("monitor_process_resident_memory_bytes", "gauge", "rss", "Resident memory of the service process tree."),
+                ("monitor_process_open_fds", "gauge", "fds", "Open file descriptors of the service process tree."),
+                ("monitor_process_threads", "gauge", "threads", "Threads of the service process tree."),
+                ("monitor_process_cpu_percent", "gauge", "cpu_percent", "CPU usage of the service process tree since the previous sample."),
+                ("monitor_process_voluntary_context_switches", "counter", "voluntary_ctxt_switches", "Voluntary context switches of the service process tree."),
+                ("monitor_process_nonvoluntary_context_switches", "counter", "nonvoluntary_ctxt_switches", "Involuntary context switches of the service process tree."),
+            ]
+            for metric, kind, key, help_text in process_metrics:
+                lines += [f"# TYPE {metric} {kind}", f"# HELP {metric} {help_text}"]
+                suffix = "_total" if kind == "counter" else ""
+                for name, sample in sorted(self.process.items()):
+                    if sample[key] is not None:
+                        lines.append(f"{metric}{suffix}{self._labels(service=name)} {sample[key]}")
+            
+            lines += [
+                "# TYPE monitor_probe_cycle_duration_seconds histogram",
+                "# UNIT monitor_probe_cycle_duration_seconds seconds",
+                "# HELP monitor_probe_cycle_duration_seconds Wall-clock duration of a probe cycle.",
+            ]
+            lines += self._histogram_lines("monitor_probe_cycle_duration_seconds", self.cycles, self.cycles_sum)
+            
+            if self.llm:
+                lines += [
+                    "# TYPE monitor_llm_probes counter",
+                    "# HELP monitor_llm_probes Synthetic LLM probes by result.",
+                ]
+                for name, entry in sorted(self.llm.items()):
+                    for outcome, value in entry["probes"].items():
+                        lines.append(f"monitor_llm_probes_total{self._labels(target=name, result=outcome)} {value}")
+                for metric, key, help_text in (
+                        ("monitor_llm_ttfb_seconds", "ttfb", "Time to first byte of the synthetic LLM query."),
+                        ("monitor_llm_latency_seconds", "total", "Total latency of the synthetic LLM query.")):
+                    lines += [f"# TYPE {metric} histogram", f"# UNIT {metric} seconds", f"# HELP {metric} {help_text}"]
+                    for name, entry in sorted(self.llm.items()):
+                        lines += self._histogram_lines(metric, entry[key], entry[f"{key}_sum"], target=name)
+                lines += [
+                    "# TYPE monitor_llm_tokens_per_second gauge",
+                    "# HELP monitor_llm_tokens_per_second Output tokens per second of the last synthetic LLM query.",
+                ]
+                for name, entry in sorted(self.llm.items()):
+                    if entry["tokens_per_second"] is not None:
+                        lines.append(f"monitor_llm_tokens_per_second{self._labels(target=name)} {entry['tokens_per_second']}")
+            
+            if self.last_cycle is not None:
+                lines += [
+                    "# TYPE monitor_last_cycle_timestamp_seconds gauge",
+                    "# UNIT monitor_last_cycle_timestamp_seconds seconds",
+                    "# HELP monitor_last_cycle_timestamp_seconds Completion time of the last probe cycle.",
+                    f"monitor_last_cycle_timestamp_seconds {self.last_cycle}",
+                ]
+        
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+# Metrics shared by the probe loop and the metrics server
+METRICS = MonitorMetrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve METRICS on /metrics."""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = METRICS.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(address):
+    """
+    Serve the monitor metrics over HTTP in a background thread
+    
+    Args:
+        address (str): Listen address as ":PORT" or "HOST:PORT"
+        
+    Returns:
+        ThreadingHTTPServer: The running server
     """
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = {
-        "timestamp": timestamp,
-        "services": results
+    host, _, port = address.rpartition(":")
+    server = ThreadingHTTPServer((host or "0.0.0.0", int(port)), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    console.print(f"[blue]Serving OpenMetrics on http://{host or '0.0.0.0'}:{server.server_address[1]}/metrics[/blue]")
+    return server
+
+# Adaptive scheduling: healthy services are checked every `interval` seconds,
+# degraded and recovering ones every `fast_interval` seconds, and offline ones
+# with exponential backoff from `fast_interval` up to `max_backoff`
+RECOVERY_CHECKS = 3
+SCHEDULE_JITTER = 0.1
+
+
+def classify_result(result):
+    """Return "healthy", "degraded" or "offline" for a check result"""
+    if result["status"] == "offline":
+        return "offline"
+    if result["code"] != 200 or str(result["status"]).lower() in ("error", "unhealthy", "degraded"):
+        return "degraded"
+    return "healthy"
+
+
+class AdaptiveScheduler:
+    """
+    Per-target probe schedule driven by the last observed state.
+    
+    States are "unknown", "healthy", "degraded", "offline" and "recovering";
+    a target that comes back from degraded or offline stays "recovering" for
+    RECOVERY_CHECKS successful checks at the fast interval. Every delay gets
+    +/- SCHEDULE_JITTER random jitter so targets do not synchronize.
+    """
+
+    def __init__(self, targets, interval=60, fast_interval=5, max_backoff=None, spread=0, now=None):
+        now = time.monotonic() if now is None else now
+        self.interval = interval
+        self.fast_interval = min(fast_interval, interval)
+        self.max_backoff = interval if max_backoff is None else max_backoff
+        self.entries = {
+            target["name"]: {"state": "unknown", "next": now + probe_offset(target["name"], spread),
+                             "failures": 0, "recovered": 0}
+            for target in targets
+        }
+
+    def due(self, targets, now=None):
+        """Return the targets whose next check is due"""
+        now = time.monotonic() if now is None else now
+        return [target for target in targets if self.entries[target["name"]]["next"] <= now]
+
+    def next_due(self):
+        """Return the monotonic time of the earliest scheduled check"""
+        return min((entry["next"] for entry in self.entries.values()), default=time.monotonic() + self.interval)
+
+    def update(self, name, result, now=None):
+        """
+        Record a check result and schedule the next check
+        
+        Args:
+            name (str): The name of the service
+            result (dict): The service status information
+            now (float): Monotonic time of the result (defaults to the current time)
+            
+        Returns:
+            tuple: (previous state, new state)
+        """
+        now = time.monotonic() if now is None else now
+        entry = self.entries[name]
+        previous = entry["state"]
+        observed = classify_result(result)
+        
+        if observed == "offline":
+            entry["failures"] += 1
+            entry["recovered"] = 0
+            state = "offline"
+            delay = min(self.fast_interval * 2 ** (entry["failures"] - 1), self.max_backoff)
+        elif observed == "degraded":
+            entry["failures"] = 0
+            entry["recovered"] = 0
+            state = "degraded"
+            delay = self.fast_interval
+        elif previous in ("degraded", "offline") or (
+                previous == "recovering" and entry["recovered"] + 1 < RECOVERY_CHECKS):
+            entry["failures"] = 0
+            entry["recovered"] = 1 if previous != "recovering" else entry["recovered"] + 1
+            state = "recovering"
+            delay = self.fast_interval
+        else:
+            entry["failures"] = 0
+            entry["recovered"] = 0
+            state = "healthy"
+            delay = self.interval
+        
+        entry["state"] = state
+        entry["next"] = now + delay * random.uniform(1 - SCHEDULE_JITTER, 1 + SCHEDULE_JITTER)
+        return previous, state
+
+
+class EventHooks:
+    """
+    Deliver monitor events to a command and/or a webhook.
+    
+    Events are queued and delivered in order by a background thread, so a
+    slow hook never delays probing. The command runs through the shell with
+    the event JSON on stdin and in the MONITOR_EVENT environment variable;
+    the webhook receives the event as a JSON POST body.
+    """
+
+    def __init__(self, command=None, url=None, timeout=10):
+        self.command = command
+        self.url = url
+        self.timeout = timeout
+        self.queue = Queue()
+        if command or url:
+            threading.Thread(target=self._deliver, name="event-hooks", daemon=True).start()
+
+    def emit(self, event):
+        """Queue an event for delivery"""
+        if self.command or self.url:
+            self.queue.put(event)
+
+    def _deliver(self):
+        while True:
+            event = self.queue.get()
+            payload = json.dumps(event)
+            if self.command:
+                try:
+                    subprocess.run(self.command, shell=True, input=payload, text=True, timeout=self.timeout,
+                                   env=dict(os.environ, MONITOR_EVENT=payload), check=False)
+                except (OSError, subprocess.SubprocessError) as e:
+                    console.print(f"[yellow]Event hook command failed: {e}[/yellow]")
+            if self.url:
+                try:
+                    requests.post(self.url, data=payload, headers={"Content-Type": "application/json"},
+                                  timeout=self.timeout)
+                except requests.RequestException as e:
+                    console.print(f"[yellow]Event webhook failed: {e}[/yellow]")
+            self.queue.task_done()
+
+
+def make_event(kind, target, result, **fields):
+    """Return a structured monitor event"""
+    event = {
+        "event": kind,
+        "timestamp": datetime.now().astimezone().isoformat(),
+        "service": target["name"],
+        "stack": target.get("stack"),
+        "url": target["url"],
+        "code": result["code"],
+        "response_time": result["response_time"],
+        "error": result["error"]
     }
+    event.update(fields)
+    return event
+
+# Fixed prompt of the synthetic LLM probe; kept tiny to bound its cost
+LLM_PROBE_PROMPT = "Reply with the single word: pong"
+
+
+def estimate_tokens(text):
+    """Roughly estimate the number of LLM tokens in a text (about 4 characters per token)"""
+    return max(1, (len(text) + 3) // 4)
+
+
+class LLMProbe:
+    """
+    Synthetic end-to-end probe of an LLM query endpoint.
     
-    with open(log_file, "a") as f:
-        f.write(json.dumps(log_entry) + "\n")
+    Sends LLM_PROBE_PROMPT to a PyLLM-style /query endpoint at its own
+    interval, asking for a streamed response, and measures time to first
+    token, total latency and output tokens per second. The worst-case cost of every probe (prompt tokens plus
+    max_tokens) is charged against an hourly token budget and probes that
+    would exceed it are skipped, which gives a hard cap on the load the probe
+    puts on the model backend. Probes run in a background thread and their
+    results are collected from `results`.
+    """
+
+    def __init__(self, url, model="llama3", interval=300, max_tokens=8, budget=500, timeout=60,
+                 prompt=LLM_PROBE_PROMPT):
+        self.url = url
+        self.name = f"llm/{urlparse(url).netloc or url}"
+        self.model = model
+        self.interval = interval
+        self.max_tokens = max_tokens
+        self.budget = budget
+        self.timeout = timeout
+        self.prompt = prompt
+        self.cost = estimate_tokens(prompt) + max_tokens
+        self.spent = deque()
+        self.results = Queue()
+        self.running = False
+        self.next_due = time.monotonic()
+        self.last = None
+
+    def budget_used(self, now=None):
+        """Return the tokens charged during the last hour"""
+        now = time.monotonic() if now is None else now
+        while self.spent and self.spent[0][0] <= now - 3600:
+            self.spent.popleft()
+        return sum(tokens for _, tokens in self.spent)
+
+    def start_if_due(self, now=None):
+        """
+        Start a probe in the background if it is due and within budget
+        
+        Returns:
+            bool: Whether a probe was started
+        """
+        now = time.monotonic() if now is None else now
+        if self.running or now < self.next_due:
+            return False
+        self.next_due = now + self.interval
+        if self.budget_used(now) + self.cost > self.budget:
+            self.results.put({"name": self.name, "skipped": True, "timestamp": time.time()})
+            return False
+        self.spent.append((now, self.cost))
+        self.running = True
+        threading.Thread(target=self._run, name="llm-probe", daemon=True).start()
+        return True
+
+    def _run(self):
+        try:
+            self.results.put(self.run())
+        finally:
+            self.running = False
+
+    @staticmethod
+    def response_text(lines):
+        """
+        Return the generated text of a probe response
+        
+        Servers that support streaming answer with NDJSON chunk events;
+        older ones ignore the stream flag and return a single JSON object
+        with a "response" field.
+        """
+        if len(lines) == 1 and "type" not in lines[0]:
+            return lines[0].get("response", "")
+        for line in lines:
+            if line.get("type") == "error":
+                raise ValueError(line.get("detail", "stream error"))
+        return "".join(line.get("text", "") for line in lines if line.get("type") == "chunk")
+
+    def run(self):
+        """
+        Send the probe query and measure it
+        
+        Returns:
+            dict: ok flag, HTTP code, ttfb and total latency in seconds,
+                output token count, tokens per second and error
+        """
+        result = {"name": self.name, "timestamp": time.time(), "ok": False, "code": 0, "ttfb": None,
+                  "total": None, "output_tokens": None, "tokens_per_second": None, "error": None}
+        # The probe must reach the backend, so it bypasses the API's response cache
+        payload = {"prompt": self.prompt, "model": self.model, "max_tokens": self.max_tokens, "temperature": 0,
+                   "stream": True, "stream_format": "ndjson", "cache": False}
+        start = time.monotonic()
+        try:
+            with requests.post(self.url, json=payload, timeout=self.timeout, stream=True) as response:
+                result["code"] = response.status_code
+                lines = []
+                for line in response.iter_lines():
+                    if result["ttfb"] is None:
+                        result["ttfb"] = time.monotonic() - start
+                    if line:
+                        lines.append(json.loads(line))
+                result["total"] = time.monotonic() - start
+            if result["code"] != 200:
+                result["error"] = f"HTTP {result['code']}"
+                return result
+            text = self.response_text(lines)
+            result["output_tokens"] = estimate_tokens(text) if text else 0
+            # When tokens were streamed the rate covers decoding only, not the time to the first token
+            streamed = sum(line.get("type") == "chunk" for line in lines) > 1
+            generation_time = result["total"] - result["ttfb"] if streamed else result["total"]
+            result["tokens_per_second"] = result["output_tokens"] / generation_time if generation_time > 0 else None
+            result["ok"] = True
+        except (requests.RequestException, ValueError, AttributeError) as e:
+            result["total"] = time.monotonic() - start
+            result["error"] = str(e)
+        return result
 
-def monitor_services(interval=60, log=True):
+
+def display_llm_probes(probes):
+    """
+    Display the last result of each synthetic LLM probe in a rich table
+    
+    Args:
+        probes (list): LLMProbe instances
+    """
+    table = Table(title="Synthetic LLM Probes")
+    table.add_column("Target", style="cyan")
+    table.add_column("Status", style="green")
+    table.add_column("TTFB", style="magenta")
+    table.add_column("Total", style="magenta")
+    table.add_column("Tokens/s", style="blue")
+    table.add_column("Budget (1h)", style="yellow")
+    table.add_column("Error", style="red")
+    
+    for probe in probes:
+        last = probe.last or {}
+        status = "[green]ok" if last.get("ok") else ("[red]error" if last else "-")
+        tokens_per_second = last.get("tokens_per_second")
+        table.add_row(
+            probe.name,
+            status,
+            format_latency(last.get("ttfb")),
+            format_latency(last.get("total")),
+            "-" if tokens_per_second is None else f"{tokens_per_second:.1f}",
+            f"{probe.budget_used()}/{probe.budget}",
+            last.get("error") or ""
+        )
+    
+    console.print(table)
+
+def monitor_services(interval=60, log=True, window="15m", histogram_file="service_latency.json",
+                     db_path="service_status.db", targets=None, spread=None, workers=32,
+                     fast_interval=5, max_backoff=None, hooks=None, llm_probes=()):
     """
     Monitor services continuously
     
+    Each target is probed on its own adaptive schedule (see AdaptiveScheduler)
+    and state transitions are emitted to the event hooks as soon as the probe
+    that observed them completes. The status table is printed every
+    `interval` seconds and whenever a state changes.
+    
     Args:
-        interval (int): Monitoring interval in seconds
-        log (bool): Whether to log results to a file
+        interval (int): Check interval of healthy services in seconds (0 for a single check)
+        log (bool): Whether to record results in the status store
+        window (str): Rolling window used for the displayed latency percentiles
+        histogram_file (str): File the latency histograms are persisted to
+        db_path (str): Path to the status database
+        targets (list): Target dictionaries (discovered with the defaults if None)
+        spread (float): Seconds to spread the initial probe start times over
+            (defaults to a quarter of the interval, at most 15 seconds)
+        workers (int): Maximum number of concurrent checks
+        fast_interval (float): Check interval of degraded and recovering services
+        max_backoff (float): Longest delay between checks of an offline service
+            (defaults to the interval)
+        hooks (EventHooks): Receivers of state-change and alert events (optional)
+        llm_probes (list): Synthetic LLM probes, run on their own intervals (optional)
     """
+    if targets is None:
+        targets = discover_services()
+    if spread is None:
+        spread = min(max(interval, 0) / 4, 15)
+    hooks = hooks or EventHooks()
+    session = make_session(workers)
+    scheduler = AdaptiveScheduler(targets, max(interval, 0), fast_interval, max_backoff,
+                                  spread if interval > 0 else 0)
+    last_results = {}
+    console.print(f"[blue]Monitoring {len(targets)} endpoints[/blue]")
+    
+    store = None
+    if log:
+        load_histograms(histogram_file)
+        store = StatusStore(db_path)
+    
+    def on_result(target, result):
+        previous, state = scheduler.update(target["name"], result)
+        if previous != state:
+            METRICS.set_state(target["name"], state)
+            if previous != "unknown":
+                console.print(f"[bold]{target['name']}: {previous} -> {state}[/bold]")
+                hooks.emit(make_event("state_change", target, result, previous=previous, state=state))
+    
     try:
+        next_display = time.monotonic()
         while True:
-            console.print(Panel(f"Checking services at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", 
-                               style="blue"))
-            
-            results = []
-            for name, url in SERVICES.items():
-                result = check_service_health(name, url)
-                results.append(result)
+            due = scheduler.due(targets)
+            changed = False
+            if due:
+                cycle_start = time.monotonic()
+                states_before = {t["name"]: scheduler.entries[t["name"]]["state"] for t in due}
+                results = probe_services(due, 0, workers, session, on_result)
+                sample_processes(due, results)
+                METRICS.observe_cycle(results, time.monotonic() - cycle_start)
+                
+                for target, result in zip(due, results):
+                    last_results[target["name"]] = result
+                    for alert in result.get("alerts", []):
+                        hooks.emit(make_event("alert", target, result, message=alert))
+                    if states_before[target["name"]] not in ("unknown", scheduler.entries[target["name"]]["state"]):
+                        changed = True
+                
+                record_latency(results)
+                if log:
+                    log_status(results, store)
             
-            display_status(results)
+            for probe in llm_probes:
+                if interval <= 0:
+                    # A single check waits for the probe so it can be reported
+                    probe.start_if_due()
+                    while probe.running:
+                        time.sleep(0.1)
+                else:
+                    probe.start_if_due()
+                while not probe.results.empty():
+                    result = probe.results.get()
+                    METRICS.observe_llm_probe(result)
+                    if result.get("skipped"):
+                        console.print(f"[yellow]{probe.name}: probe skipped, hourly token budget exhausted[/yellow]")
+                        continue
+                    probe.last = result
+                    if log:
+                        store.write_llm_probe(result)
             
-            if log:
-                log_status(results)
+            if interval <= 0 or changed or time.monotonic() >= next_display:
+                console.print(Panel(f"Service status at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                                    style="blue"))
+                display_status([last_results[t["name"]] for t in targets if t["name"] in last_results], window)
+                if llm_probes:
+                    display_llm_probes(llm_probes)
+                if log:
+                    save_histograms(histogram_file)
+                if interval <= 0:
+                    break
+                if time.monotonic() >= next_display:
+                    next_display = time.monotonic() + interval
+                    console.print(f"\nNext status report in {interval} seconds. Press Ctrl+C to exit.\n")
             
-            if interval <= 0:
-                break
-                
-            console.print(f"\nNext check in {interval} seconds. Press Ctrl+C to exit.\n")
-            time.sleep(interval)
+            wake = min([scheduler.next_due(), next_display] + [probe.next_due for probe in llm_probes])
+            time.sleep(max(0.0, wake - time.monotonic()))
             
     except KeyboardInterrupt:
         console.print("\n[bold yellow]Monitoring stopped by user.[/bold yellow]")
+    finally:
+        if store is not None:
+            store.close()
 
 def main():
     """
     Main function
     """
-    console.print(Panel.fit("WebLama Microservices Monitoring", style="bold green"))
-    
     # Parse command line arguments
     import argparse
     parser = argparse.ArgumentParser(description="Monitor WebLama microservices")
     parser.add_argument("-i", "--interval", type=int, default=60,
-                        help="Monitoring interval in seconds (default: 60, 0 for single check)")
-    parser.add_argument("--no-log", action="store_true", help="Disable logging to file")
+                        help="Check interval of healthy services and status report interval in seconds "
+                             "(default: 60, 0 for single check)")
+    parser.add_argument("--fast-interval", type=float, default=5,
+                        help="Check interval of degraded and recovering services in seconds (default: 5)")
+    parser.add_argument("--max-backoff", type=float,
+                        help="Longest delay between checks of an offline service (default: the interval)")
+    parser.add_argument("--on-change-command", metavar="CMD",
+                        help="Shell command run for every state change or alert, with the event JSON on stdin")
+    parser.add_argument("--on-change-url", metavar="URL",
+                        help="Webhook that receives every state change or alert as a JSON POST")
+    parser.add_argument("--no-log", action="store_true", help="Disable recording results in the status database")
+    parser.add_argument("--db", default="service_status.db",
+                        help="Status database path (default: service_status.db)")
+    parser.add_argument("-w", "--window", choices=list(LATENCY_WINDOWS), default="15m",
+                        help="Rolling window for latency percentiles (default: 15m)")
+    parser.add_argument("--compose", action="append", metavar="FILE",
+                        help="docker-compose file to discover services from (repeatable, "
+                             "default: docker-compose.yml if present)")
+    parser.add_argument("--pid-dir", default="logs",
+                        help="Directory with <service>.pid files of a local stack (default: logs)")
+    parser.add_argument("--spread", type=float,
+                        help="Seconds to spread the initial probes over (default: interval/4, at most 15)")
+    parser.add_argument("--workers", type=int, default=32,
+                        help="Maximum number of concurrent health checks (default: 32)")
+    parser.add_argument("--llm-probe", action="append", metavar="URL",
+                        help="PyLLM /query endpoint to send a synthetic prompt to (repeatable)")
+    parser.add_argument("--llm-probe-interval", type=float, default=300,
+                        help="Seconds between synthetic LLM probes (default: 300)")
+    parser.add_argument("--llm-probe-model", default="llama3", help="Model for synthetic LLM probes (default: llama3)")
+    parser.add_argument("--llm-probe-max-tokens", type=int, default=8,
+                        help="max_tokens of a synthetic LLM probe (default: 8)")
+    parser.add_argument("--llm-probe-budget", type=int, default=500,
+                        help="Hard cap on tokens per hour for each synthetic LLM probe (default: 500)")
+    parser.add_argument("--serve-metrics", metavar="[HOST]:PORT",
+                        help="Expose OpenMetrics on HOST:PORT/metrics while monitoring, e.g. :9464")
+    parser.add_argument("--histogram-file", default="service_latency.json",
+                        help="File to persist latency histograms to (default: service_latency.json)")
+    
+    subparsers = parser.add_subparsers(dest="command")
+    query_parser = subparsers.add_parser("query", help="Summarize uptime and latency from the status database")
+    query_parser.add_argument("--service", help="Service name (default: all services)")
+    query_parser.add_argument("--since", default="6h", help="Period to summarize, e.g. 30m, 6h, 7d (default: 6h)")
+    query_parser.add_argument("--json", action="store_true", help="Print JSON instead of a table")
     args = parser.parse_args()
     
+    if args.command == "query":
+        return query_status(args.db, service=args.service, since=args.since, as_json=args.json)
+    
+    console.print(Panel.fit("WebLama Microservices Monitoring", style="bold green"))
+    
+    compose_files = args.compose
+    if compose_files is None:
+        compose_files = [path for path in ["docker-compose.yml"] if os.path.exists(path)]
+    targets = discover_services(compose_files, args.pid_dir)
+    
+    if args.serve_metrics:
+        serve_metrics(args.serve_metrics)
+    
     # Start monitoring
-    monitor_services(interval=args.interval, log=not args.no_log)
+    monitor_services(interval=args.interval, log=not args.no_log, window=args.window,
+                     histogram_file=args.histogram_file, db_path=args.db, targets=targets,
+                     spread=args.spread, workers=args.workers, fast_interval=args.fast_interval,
+                     max_backoff=args.max_backoff,
+                     hooks=EventHooks(args.on_change_command, args.on_change_url),
+                     llm_probes=[LLMProbe(url, args.llm_probe_model, args.llm_probe_interval,
+                                          args.llm_probe_max_tokens, args.llm_probe_budget)
+                                 for url in args.llm_probe or []])
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
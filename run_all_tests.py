@@ -9,6 +9,7 @@ This script runs all tests for the PyLama ecosystem components, including:
 - Docker tests
 - Integration tests
 - LogLama integration tests
+- Benchmark comparison against stored baselines (bench compare)
 
 It generates HTML reports for all test results.
 """
@@ -18,6 +19,7 @@ import sys
 import unittest
 import argparse
 import time
+import html
 import datetime
 import importlib
 from pathlib import Path
@@ -27,6 +29,10 @@ import shutil
 # Root directory of the project
 ROOT_DIR = Path(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# Benchmark suites, their helpers and accepted baselines
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+BASELINES_DIR = os.path.join(BENCHMARKS_DIR, "baselines")
+
 # Components to test
 COMPONENTS = [
     "bexy",
@@ -287,6 +293,80 @@ def run_ansible_tests(html_dir, verbosity=1):
     
     return success
 
+def run_bench_compare(results_dir, baselines_dir=BASELINES_DIR, threshold=0.1, alpha=0.05, metrics=None):
+    """
+    Compare benchmark results with the last accepted baselines.
+
+    Every <suite>.json in results_dir is compared with the file of the same
+    name in baselines_dir. A metric fails the build when the regression is
+    larger than the threshold and statistically significant across the
+    repeated samples, or when it has too few samples for the test to detect
+    a regression at all (see benchmarks/common.py).
+
+    Returns:
+        tuple: (success, {suite: comparison rows})
+    """
+    sys.path.insert(0, BENCHMARKS_DIR)
+    try:
+        import common
+    finally:
+        sys.path.remove(BENCHMARKS_DIR)
+    
+    if not os.path.isdir(results_dir):
+        print(f"No benchmark results in {results_dir}, skipping bench compare.")
+        return True, {}
+    
+    print("Comparing benchmark results with baselines...")
+    comparisons = {}
+    success = True
+    for results_file in sorted(os.listdir(results_dir)):
+        if not results_file.endswith(".json"):
+            continue
+        results = common.load_results(os.path.join(results_dir, results_file))
+        baseline = common.load_results(os.path.join(baselines_dir, results_file))
+        suite = results.get("suite", results_file[:-len(".json")])
+        if baseline is None:
+            print(f"No baseline for {suite}, skipping.")
+            continue
+        
+        print(f"\nBenchmark suite: {suite}")
+        rows = common.compare_to_baseline(results, baseline, threshold, alpha, metrics)
+        common.print_comparison(rows, threshold)
+        comparisons[suite] = rows
+        success = success and not any(row["regressed"] for row in rows) and not common.underpowered_metrics(rows)
+    
+    return success, comparisons
+
+def write_bench_table(f, comparisons, threshold):
+    """Write the benchmark comparison tables to an open index.html."""
+    f.write("<h2>Benchmark Comparison</h2>")
+    f.write(f"<p>Regression threshold: {threshold * 100:.0f}% (significant changes only)</p>")
+    for suite, rows in comparisons.items():
+        f.write(f"<h3>{html.escape(suite)}</h3>")
+        f.write('<table border="1" cellpadding="4" style="border-collapse: collapse;">')
+        f.write("<tr><th>Metric</th><th>Baseline</th><th>Current</th><th>Change</th>"
+                "<th>95% CI</th><th>p-value</th><th>Status</th></tr>")
+        for row in rows:
+            if row["regressed"]:
+                status, color = "REGRESSION", "red"
+            elif row["gated"] and row["underpowered"]:
+                status, color = "underpowered", "red"
+            elif row["significant"]:
+                worse = row["change"] > 0 if row["better"] == "lower" else row["change"] < 0
+                status, color = "changed", "orange" if worse else "green"
+            else:
+                status, color = "ok", "black"
+            if not row["gated"]:
+                status += " (not gated)"
+            f.write(f"<tr><td>{html.escape(row['metric'])}</td>"
+                    f"<td>{row['baseline']:.6g} {row['unit']}</td>"
+                    f"<td>{row['current']:.6g} {row['unit']}</td>"
+                    f"<td>{row['change'] * 100:+.1f}%</td>"
+                    f"<td>{row['ci_low'] * 100:+.1f}% .. {row['ci_high'] * 100:+.1f}%</td>"
+                    f"<td>{row['p_value']:.3f}</td>"
+                    f'<td style="color: {color};">{status}</td></tr>')
+        f.write("</table>")
+
 def main():
     """Main function to run all tests."""
     parser = argparse.ArgumentParser(description="Run tests for the PyLama ecosystem")
@@ -296,9 +376,16 @@ def main():
     parser.add_argument("--integration", action="store_true", help="Run integration tests")
     parser.add_argument("--loglama", action="store_true", help="Run LogLama integration tests")
     parser.add_argument("--ansible", action="store_true", help="Run Ansible tests")
+    parser.add_argument("--bench", action="store_true", help="Compare benchmark results with baselines (bench compare)")
     parser.add_argument("--all", action="store_true", help="Run all tests")
     parser.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
     parser.add_argument("--html-dir", default="test-reports", help="Directory for HTML reports")
+    parser.add_argument("--bench-results", default="bench-results", help="Directory with current benchmark JSON results")
+    parser.add_argument("--bench-baselines", default=BASELINES_DIR, help="Directory with accepted benchmark baselines")
+    parser.add_argument("--bench-threshold", type=float, default=0.1,
+                        help="Relative slowdown a significant change must exceed to fail the build (0.1 = 10%%)")
+    parser.add_argument("--bench-alpha", type=float, default=0.05, help="Significance level of the benchmark comparison")
+    parser.add_argument("--bench-metrics", help="Comma-separated patterns of metrics that can fail the build (default: all)")
     args = parser.parse_args()
     
     # Set verbosity
@@ -310,9 +397,15 @@ def main():
     
     # Track overall success
     overall_success = True
+    bench_comparisons = None
+    bench_metrics = [p.strip() for p in args.bench_metrics.split(",") if p.strip()] if args.bench_metrics else None
+    
+    def bench_compare():
+        return run_bench_compare(args.bench_results, args.bench_baselines,
+                                 args.bench_threshold, args.bench_alpha, bench_metrics)
     
     # Run tests
-    if args.all or not (args.components or args.makefiles or args.docker or args.integration or args.loglama or args.ansible):
+    if args.all or not (args.components or args.makefiles or args.docker or args.integration or args.loglama or args.ansible or args.bench):
         print("Running all tests...")
         start_time = time.time()
         
@@ -341,6 +434,10 @@ def main():
         success = run_ansible_tests(html_dir, verbosity)
         overall_success = overall_success and success
         
+        # Compare benchmark results
+        success, bench_comparisons = bench_compare()
+        overall_success = overall_success and success
+        
         end_time = time.time()
         print(f"All tests completed in {end_time - start_time:.2f} seconds")
     else:
@@ -368,6 +465,10 @@ def main():
         if args.ansible:
             success = run_ansible_tests(html_dir, verbosity)
             overall_success = overall_success and success
+        
+        if args.bench:
+            success, bench_comparisons = bench_compare()
+            overall_success = overall_success and success
     
     # Create index.html
     index_path = os.path.join(html_dir, "index.html")
@@ -386,6 +487,10 @@ def main():
         
         f.write("</ul>")
         
+        # Benchmark comparison
+        if bench_comparisons:
+            write_bench_table(f, bench_comparisons, args.bench_threshold)
+        
         # Overall result
         f.write("<h2>Overall Result</h2>")
         if overall_success:
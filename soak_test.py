@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PyLama Soak Test
+
+Runs the local (non-Docker) stack for a long time under a steady mixed
+workload and looks for slow leaks:
+
+- starts the stack with `start-pylama.sh start` (unless --no-start) and
+  stops it again at the end;
+- sends requests to APILama, SheLLama and the PyLLM API at a fixed rate;
+- every sample interval records RSS and open file descriptors of every
+  service with a PID file (using the /proc helpers of monitor_services.py)
+  and the latency percentiles of the requests completed in that interval;
+- reports leak slopes (bytes/hour, fds/hour) and latency drift per service
+  and exits with 1 when a slope or the drift exceeds its limit.
+
+Samples taken during the warm-up period are not used for the slopes, so
+start-up allocations and cache fills do not count as leaks.
+
+Usage:
+    python soak_test.py --duration 10m                   # CI
+    python soak_test.py --duration 8h --json-out soak.json  # nightly
+    python soak_test.py --no-start --services shellama --duration 1h
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import monitor_services
+from monitor_services import LatencyHistogram, parse_duration
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+START_SCRIPT = os.path.join(SCRIPT_DIR, "start-pylama.sh")
+
+# Service of the workload -> name of its PID file written by start-pylama.sh
+PID_NAMES = {
+    "apilama": "apilama",
+    "shellama": "shellama",
+    "pyllm": "getllm",
+}
+
+SCRATCH_DIR = "soak-scratch"
+SCRATCH_FILES = 20
+
+
+def default_url(service):
+    """Return the local URL of a workload service, honouring <NAME>_PORT"""
+    name = PID_NAMES[service]
+    port = os.environ.get(f"{name.upper()}_PORT", monitor_services.LOCAL_PORTS[name])
+    return f"http://127.0.0.1:{port}"
+
+
+def build_operations(services):
+    """
+    Return the weighted request mix for the selected services
+
+    Every operation is (service, name, weight, make_request) where
+    make_request(rng) returns (method, path, params, json).
+    """
+    def scratch_file(rng):
+        return f"{SCRATCH_DIR}/soak_{rng.randrange(SCRATCH_FILES):02d}.txt"
+
+    def content(rng):
+        return "soak test line\n" * rng.randint(1, 256)
+
+    operations = [
+        ("apilama", "health", 2, lambda rng: ("GET", "/api/health", None, None)),
+        ("apilama", "list_files", 2, lambda rng: ("GET", "/api/shellama/files",
+                                                  {"directory": ".", "pattern": "*"}, None)),
+        ("shellama", "health", 1, lambda rng: ("GET", "/health", None, None)),
+        ("shellama", "write_file", 2, lambda rng: ("POST", "/files", None,
+                                                   {"path": scratch_file(rng), "content": content(rng)})),
+        ("shellama", "read_file", 2, lambda rng: ("GET", f"/files/{scratch_file(rng)}", None, None)),
+        ("shellama", "list_files", 1, lambda rng: ("GET", "/files",
+                                                   {"directory": SCRATCH_DIR, "pattern": "*"}, None)),
+        ("shellama", "shell", 1, lambda rng: ("POST", "/shell", None,
+                                              {"command": "echo soak", "working_dir": "."})),
+        ("pyllm", "health", 1, lambda rng: ("GET", "/health", None, None)),
+        # Bypasses the response cache, and the random tag keeps concurrent
+        # queries from sharing one generation, so every query reaches the model
+        ("pyllm", "query", 1, lambda rng: ("POST", "/query", None,
+                                           {"prompt": f"Reply with the single word: pong ({rng.randrange(10**9)})",
+                                            "max_tokens": 16, "temperature": 0.0, "cache": False})),
+    ]
+    return [operation for operation in operations if operation[0] in services]
+
+
+class SoakRecorder:
+    """
+    Aggregates request outcomes per service for the current sample interval
+
+    Only histograms and counters are kept, so memory stays flat no matter
+    how long the soak runs.
+    """
+
+    def __init__(self, services):
+        self.lock = threading.Lock()
+        self.services = services
+        self.reset()
+
+    def reset(self):
+        self.windows = {service: {"latency": LatencyHistogram(), "requests": 0, "errors": 0}
+                        for service in self.services}
+
+    def record(self, service, latency, ok):
+        with self.lock:
+            window = self.windows[service]
+            window["requests"] += 1
+            if ok:
+                window["latency"].record(latency)
+            else:
+                window["errors"] += 1
+
+    def rotate(self):
+        """Return the finished interval and start a new one"""
+        with self.lock:
+            windows = self.windows
+            self.reset()
+        return windows
+
+
+def send(session, base_url, method, path, params, body, timeout):
+    """Send one request; returns True for a 2xx response"""
+    try:
+        response = session.request(method, base_url + path, params=params, json=body, timeout=timeout)
+        return 200 <= response.status_code < 300
+    except requests.RequestException:
+        return False
+
+
+def wait_for_services(urls, health_paths, timeout):
+    """Wait until every service answers its health check, or the timeout expires"""
+    deadline = time.monotonic() + timeout
+    pending = dict(urls)
+    while pending and time.monotonic() < deadline:
+        for service, url in list(pending.items()):
+            try:
+                if requests.get(url + health_paths[service], timeout=2).ok:
+                    del pending[service]
+            except requests.RequestException:
+                pass
+        if pending:
+            time.sleep(1)
+    return sorted(pending)
+
+
+def sample_resources(pid_dir):
+    """
+    Sample RSS and fds of every service with a PID file
+
+    Samples are keyed by the workload service name, like the latency
+    windows, so a service whose PID file has another name (pyllm writes
+    getllm.pid) ends up in a single report entry.
+    """
+    services = {pid_name: service for service, pid_name in PID_NAMES.items()}
+    children = monitor_services.process_children()
+    samples = {}
+    for target in monitor_services.discover_pid_services(pid_dir):
+        pid_name = target["name"].split("/", 1)[-1]
+        name = services.get(pid_name, pid_name)
+        sample = monitor_services.sample_process(name, target["pid_file"], children=children)
+        if sample:
+            samples[name] = {"rss": sample["rss"], "fds": sample["fds"]}
+    return samples
+
+
+def linear_slope(points):
+    """
+    Least-squares slope of (x, y) points
+
+    Returns None with fewer than two distinct x values.
+    """
+    points = [(x, y) for x, y in points if y is not None]
+    if len(points) < 2:
+        return None
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if var_x == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+
+
+def latency_drift(points):
+    """
+    Relative change of latency between the first and last quarter of a run
+
+    Compares the median of the per-interval values in each quarter, so a
+    single slow interval does not count as drift.
+    """
+    values = [y for _, y in points if y is not None]
+    if len(values) < 4:
+        return None
+    quarter = len(values) // 4
+    first = sorted(values[:quarter])[quarter // 2]
+    last = sorted(values[-quarter:])[quarter // 2]
+    return (last - first) / first if first else None
+
+
+def analyze(timeline, warmup, limits):
+    """
+    Compute leak slopes and latency drift per service
+
+    Args:
+        timeline (list): Interval samples as recorded by run_soak
+        warmup (float): Seconds at the start to ignore
+        limits (dict): max_rss_slope (bytes/h), max_fd_slope (fds/h) and
+            max_latency_drift (fraction)
+
+    Returns:
+        dict: Per-service report with a "violations" list
+    """
+    steady = [entry for entry in timeline if entry["elapsed"] >= warmup]
+    names = sorted({name for entry in steady for name in entry["processes"]} |
+                   {name for entry in steady for name in entry["latency"]})
+    report = {}
+    for name in names:
+        hours = lambda entry: entry["elapsed"] / 3600
+        rss = [(hours(e), e["processes"].get(name, {}).get("rss")) for e in steady]
+        fds = [(hours(e), e["processes"].get(name, {}).get("fds")) for e in steady]
+        p50 = [(hours(e), e["latency"].get(name, {}).get("p50")) for e in steady]
+        p95 = [(hours(e), e["latency"].get(name, {}).get("p95")) for e in steady]
+        requests_total = sum(e["latency"].get(name, {}).get("requests", 0) for e in timeline)
+        errors_total = sum(e["latency"].get(name, {}).get("errors", 0) for e in timeline)
+
+        entry = {
+            "samples": len(steady),
+            "rss_start": next((y for _, y in rss if y is not None), None),
+            "rss_end": next((y for _, y in reversed(rss) if y is not None), None),
+            "rss_slope": linear_slope(rss),
+            "fd_slope": linear_slope(fds),
+            "p50_slope": linear_slope(p50),
+            "p50_drift": latency_drift(p50),
+            "p95_drift": latency_drift(p95),
+            "requests": requests_total,
+            "errors": errors_total,
+            "violations": []
+        }
+        if entry["rss_slope"] is not None and entry["rss_slope"] > limits["max_rss_slope"]:
+            entry["violations"].append("rss")
+        if entry["fd_slope"] is not None and entry["fd_slope"] > limits["max_fd_slope"]:
+            entry["violations"].append("fds")
+        if entry["p50_drift"] is not None and entry["p50_drift"] > limits["max_latency_drift"]:
+            entry["violations"].append("latency")
+        report[name] = entry
+    return report
+
+
+def run_soak(urls, operations, rate, duration, sample_interval, pid_dir, timeout=30,
+             workers=32, seed=None, on_sample=None):
+    """
+    Drive the workload and sample resources until the duration has elapsed
+
+    Args:
+        urls (dict): Base URL per workload service
+        operations (list): Weighted request mix (see build_operations)
+        rate (float): Total request rate per second
+        duration (float): Length of the soak in seconds
+        sample_interval (float): Seconds between samples
+        pid_dir (str): Directory with the PID files of the stack
+        timeout (float): Request timeout in seconds
+        workers (int): Maximum number of outstanding requests
+        seed (int): Seed of the request mix
+        on_sample (callable): Called with every timeline entry
+
+    Returns:
+        list: Timeline of interval samples
+    """
+    rng = random.Random(seed)
+    recorder = SoakRecorder(sorted(urls))
+    in_flight = threading.BoundedSemaphore(workers)
+    local = threading.local()
+    weights = [operation[2] for operation in operations]
+    timeline = []
+
+    def task(service, request, scheduled):
+        try:
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+            method, path, params, body = request
+            ok = send(local.session, urls[service], method, path, params, body, timeout)
+            # Latency from the scheduled arrival, so a slow server is not hidden
+            recorder.record(service, time.perf_counter() - scheduled, ok)
+        finally:
+            in_flight.release()
+
+    def take_sample(elapsed):
+        windows = recorder.rotate()
+        latency = {}
+        for service, window in windows.items():
+            histogram = window["latency"]
+            latency[service] = {
+                "requests": window["requests"],
+                "errors": window["errors"],
+                "p50": histogram.percentile(50),
+                "p95": histogram.percentile(95)
+            }
+        entry = {"elapsed": elapsed, "processes": sample_resources(pid_dir), "latency": latency}
+        timeline.append(entry)
+        if on_sample:
+            on_sample(entry)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        start = time.perf_counter()
+        scheduled = start
+        next_sample = start
+        try:
+            while scheduled < start + duration:
+                now = time.perf_counter()
+                if now >= next_sample:
+                    take_sample(now - start)
+                    next_sample += sample_interval
+                delay = min(scheduled, next_sample) - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                if time.perf_counter() < scheduled:
+                    continue
+                service, _, _, make_request = rng.choices(operations, weights)[0]
+                if in_flight.acquire(blocking=False):
+                    executor.submit(task, service, make_request(rng), scheduled)
+                else:
+                    recorder.record(service, 0.0, False)
+                scheduled += rng.expovariate(rate)
+        except KeyboardInterrupt:
+            print("Interrupted, finishing the soak early...")
+    take_sample(time.perf_counter() - start)
+    return timeline
+
+
+def format_rate(value, unit):
+    if value is None:
+        return "n/a"
+    if unit == "bytes":
+        return f"{'-' if value < 0 else '+'}{monitor_services.format_bytes(abs(value))}/h"
+    return f"{value:+.2f} {unit}/h"
+
+
+def print_report(report, limits):
+    """Print the per-service soak report"""
+    print()
+    print(f"{'service':<12} {'rss start':>10} {'rss end':>10} {'rss slope':>12} {'fd slope':>12} "
+          f"{'p50 drift':>10} {'p95 drift':>10} {'requests':>9} {'errors':>7}  result")
+    print("-" * 110)
+    for name, entry in report.items():
+        rss_start = monitor_services.format_bytes(entry["rss_start"]) if entry["rss_start"] is not None else "n/a"
+        rss_end = monitor_services.format_bytes(entry["rss_end"]) if entry["rss_end"] is not None else "n/a"
+        p50 = f"{entry['p50_drift'] * 100:+.1f}%" if entry["p50_drift"] is not None else "n/a"
+        p95 = f"{entry['p95_drift'] * 100:+.1f}%" if entry["p95_drift"] is not None else "n/a"
+        result = "LEAK: " + ", ".join(entry["violations"]) if entry["violations"] else "ok"
+        print(f"{name:<12} {rss_start:>10} {rss_end:>10} {format_rate(entry['rss_slope'], 'bytes'):>12} "
+              f"{format_rate(entry['fd_slope'], 'fds'):>12} {p50:>10} {p95:>10} "
+              f"{entry['requests']:>9} {entry['errors']:>7}  {result}")
+    print(f"\nLimits: RSS {monitor_services.format_bytes(limits['max_rss_slope'])}/h, "
+          f"{limits['max_fd_slope']} fds/h, p50 latency drift {limits['max_latency_drift'] * 100:.0f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Soak-test the local PyLama stack")
+    parser.add_argument("--duration", default="10m", help="Length of the soak, e.g. 10m or 8h (default: 10m)")
+    parser.add_argument("--warmup", help="Initial period excluded from the slopes (default: 10%% of the duration, at least 1m)")
+    parser.add_argument("--sample-interval", default="30s", help="Time between resource samples (default: 30s)")
+    parser.add_argument("--rate", type=float, default=5.0, help="Total requests per second (default: 5)")
+    parser.add_argument("--workers", type=int, default=32, help="Maximum outstanding requests")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Request timeout in seconds")
+    parser.add_argument("--services", default="apilama,shellama,pyllm",
+                        help="Comma-separated services to drive: apilama, shellama, pyllm")
+    parser.add_argument("--apilama-url", help="APILama base URL (default: local port)")
+    parser.add_argument("--shellama-url", help="SheLLama base URL (default: local port)")
+    parser.add_argument("--pyllm-url", help="PyLLM API base URL (default: local getllm port)")
+    parser.add_argument("--no-start", action="store_true", help="Use an already running stack")
+    parser.add_argument("--keep-running", action="store_true", help="Do not stop the stack afterwards")
+    parser.add_argument("--stack-dir", default=os.getcwd(),
+                        help="Directory start-pylama.sh runs in; its logs/ holds the PID files")
+    parser.add_argument("--start-script", default=START_SCRIPT, help="Script used to start and stop the stack")
+    parser.add_argument("--startup-timeout", default="2m", help="How long to wait for the services to answer")
+    parser.add_argument("--max-rss-slope", type=float, default=20.0, help="RSS growth limit in MiB/hour (default: 20)")
+    parser.add_argument("--max-fd-slope", type=float, default=10.0, help="File descriptor growth limit per hour (default: 10)")
+    parser.add_argument("--max-latency-drift", type=float, default=0.5,
+                        help="Allowed p50 latency increase between the first and last quarter (default: 0.5 = 50%%)")
+    parser.add_argument("--seed", type=int, help="Seed of the request mix")
+    parser.add_argument("--json-out", help="Write the timeline and report to a JSON file")
+    args = parser.parse_args(argv)
+
+    try:
+        duration = parse_duration(args.duration)
+        sample_interval = parse_duration(args.sample_interval)
+        startup_timeout = parse_duration(args.startup_timeout)
+        warmup = parse_duration(args.warmup) if args.warmup else max(60.0, duration * 0.1)
+    except ValueError as e:
+        parser.error(str(e))
+    if warmup >= duration:
+        warmup = 0.0
+
+    services = [name.strip() for name in args.services.split(",") if name.strip()]
+    unknown = [name for name in services if name not in PID_NAMES]
+    if unknown:
+        parser.error(f"Unknown service(s): {', '.join(unknown)}")
+    urls = {service: (getattr(args, f"{service}_url") or default_url(service)).rstrip("/")
+            for service in services}
+    health_paths = {"apilama": "/api/health", "shellama": "/health", "pyllm": "/health"}
+    limits = {
+        "max_rss_slope": args.max_rss_slope * 1024 * 1024,
+        "max_fd_slope": args.max_fd_slope,
+        "max_latency_drift": args.max_latency_drift
+    }
+    pid_dir = os.path.join(args.stack_dir, "logs")
+
+    started = False
+    if not args.no_start:
+        print(f"Starting the stack with {args.start_script} start...")
+        result = subprocess.run(["bash", args.start_script, "start"], cwd=args.stack_dir)
+        if result.returncode != 0:
+            print("Failed to start the stack")
+            return 2
+        started = True
+
+    try:
+        missing = wait_for_services(urls, health_paths, startup_timeout)
+        if missing:
+            print(f"Services not answering after {args.startup_timeout}: {', '.join(missing)}")
+            return 2
+        if "shellama" in urls:
+            requests.post(urls["shellama"] + "/directories", json={"path": SCRATCH_DIR}, timeout=args.timeout)
+
+        print(f"Soaking {', '.join(services)} at {args.rate:g} req/s for {args.duration} "
+              f"(warm-up {warmup:.0f}s, sampling every {args.sample_interval})")
+
+        def on_sample(entry):
+            parts = []
+            for name, sample in sorted(entry["processes"].items()):
+                parts.append(f"{name} {monitor_services.format_bytes(sample['rss'])}/{sample['fds']}fd")
+            requests_done = sum(w["requests"] for w in entry["latency"].values())
+            errors = sum(w["errors"] for w in entry["latency"].values())
+            print(f"[{entry['elapsed'] / 60:7.1f}m] {requests_done} requests, {errors} errors  " + "  ".join(parts))
+
+        timeline = run_soak(urls, build_operations(services), args.rate, duration, sample_interval,
+                            pid_dir, args.timeout, args.workers, args.seed, on_sample)
+        if "shellama" in urls:
+            try:
+                requests.delete(f"{urls['shellama']}/directories/{SCRATCH_DIR}",
+                                params={"recursive": "true"}, timeout=args.timeout)
+            except requests.RequestException:
+                pass
+    finally:
+        if started and not args.keep_running:
+            print("Stopping the stack...")
+            subprocess.run(["bash", args.start_script, "stop"], cwd=args.stack_dir)
+
+    report = analyze(timeline, warmup, limits)
+    print_report(report, limits)
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({"duration": duration, "warmup": warmup, "rate": args.rate, "limits": limits,
+                       "timeline": timeline, "report": report}, f, indent=2)
+        print(f"Timeline and report written to {args.json_out}")
+
+    return 1 if any(entry["violations"] for entry in report.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,6 +13,9 @@ import pytest
 from getllm.models import ModelManager
 from getllm.models.base import ModelMetadata, ModelSource, ModelType
 
+from ollama_standin import OllamaStandIn
+from hf_hub_standin import HubStandIn
+
 
 @pytest.fixture(scope="session")
 def temp_cache_dir() -> Generator[str, None, None]:
@@ -57,3 +60,16 @@ def sample_model_metadata() -> ModelMetadata:
 def model_manager(temp_cache_dir: str) -> ModelManager:
     """Create a ModelManager instance with a temporary cache directory."""
     return ModelManager(cache_dir=temp_cache_dir)
+
+@pytest.fixture
+def ollama_standin() -> Generator[OllamaStandIn, None, None]:
+    """Start a local Ollama stand-in with two installed models."""
+    with OllamaStandIn(models=["llama2:7b", "mistral:latest"], seed=0) as server:
+        yield server
+
+@pytest.fixture
+def hub_standin() -> Generator[HubStandIn, None, None]:
+    """Start a local Hugging Face Hub stand-in and redirect Hub requests to it."""
+    with HubStandIn(catalog_size=50, file_size=64 * 1024, seed=0) as server:
+        with server.redirect():
+            yield server
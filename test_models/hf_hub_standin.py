@@ -0,0 +1,395 @@
+"""
+Local stand-in for the Hugging Face Hub HTTP API.
+
+Implements the parts of the Hub used by getllm's HuggingFaceModelManager so
+catalog fetch, search and install throughput can be measured without network
+access:
+
+    GET       /api/models?search=&author=&filter=&limit=&full=&cursor=
+              paginated listing with a Link: <...>; rel="next" header
+    GET       /api/models/<repo_id>
+              model info including "siblings" with file sizes
+    GET|HEAD  /<repo_id>/resolve/<revision>/<filename>
+              file download with Range support
+
+The catalog is synthetic and generated lazily from the model index, so
+catalogs of hundreds of thousands of models cost no memory:
+
+    with HubStandIn(catalog_size=200000, file_size=10 * 1024 * 1024) as hub:
+        with hub.redirect():
+            manager = HuggingFaceModelManager(cache_dir=tmp)
+            manager.list_models()
+
+redirect() rewrites requests made with the requests library to
+https://huggingface.co so code with a hardcoded Hub URL talks to the
+stand-in instead.
+"""
+
+import os
+import re
+import json
+import time
+import base64
+import random
+import hashlib
+import threading
+import contextlib
+from collections import Counter
+from urllib.parse import urlencode, urlparse, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+HUB_URL = "https://huggingface.co"
+AUTHORS = ["acme", "example-org", "research-lab", "tiny-models", "community"]
+TASKS = [
+    ("text-generation", "transformers"),
+    ("text-classification", "transformers"),
+    ("fill-mask", "transformers"),
+    ("sentence-similarity", "sentence-transformers"),
+    ("automatic-speech-recognition", "transformers"),
+]
+MODEL_NAME = re.compile(r"^(?P<author>[\w.-]+)/model-(?P<index>\d{6,})$")
+RESOLVE_PATH = re.compile(r"^/(?P<repo_id>[^/]+/[^/]+)/resolve/(?P<revision>[^/]+)/(?P<filename>.+)$")
+RANGE_HEADER = re.compile(r"^bytes=(\d*)-(\d*)$")
+CHUNK_SIZE = 64 * 1024
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+
+def _encode_cursor(index):
+    return base64.urlsafe_b64encode(str(index).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return int(base64.urlsafe_b64decode(padded.encode()).decode())
+
+
+class HubStandIn:
+    """
+    Threaded HTTP server imitating the Hugging Face Hub
+
+    Args:
+        catalog_size (int): Number of synthetic models
+        file_size (int): Size in bytes of each model's weights file
+        latency (float): Seconds to wait before answering any request
+        bytes_per_second (float): Download bandwidth per request; 0 means
+            unlimited
+        error_rate (float or dict): Probability of answering with HTTP 500,
+            either for all requests or per route ("models", "model_info",
+            "resolve")
+        page_size (int): Page size of /api/models when no limit is given
+        seed (int): Seed for error injection
+        host (str): Interface to bind to
+        port (int): Port to bind to; 0 picks a free port
+    """
+
+    def __init__(self, catalog_size=1000, file_size=1024 * 1024, latency=0.0,
+                 bytes_per_second=0.0, error_rate=0.0, page_size=DEFAULT_PAGE_SIZE,
+                 seed=None, host="127.0.0.1", port=0):
+        self.catalog_size = catalog_size
+        self.file_size = file_size
+        self.latency = latency
+        self.bytes_per_second = bytes_per_second
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.hits = Counter()
+        self.server = ThreadingHTTPServer((host, port), _HubHandler)
+        self.server.daemon_threads = True
+        self.server.standin = self
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve requests in a background thread"""
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server and close its socket"""
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @contextlib.contextmanager
+    def redirect(self):
+        """
+        Send requests-library calls to https://huggingface.co to this server
+
+        Also sets HF_ENDPOINT for libraries that honour it.
+        """
+        original = requests.sessions.Session.request
+        base_url = self.base_url
+
+        def request(session, method, url, *args, **kwargs):
+            if isinstance(url, str) and url.startswith(HUB_URL):
+                url = base_url + url[len(HUB_URL):]
+            return original(session, method, url, *args, **kwargs)
+
+        previous_endpoint = os.environ.get("HF_ENDPOINT")
+        os.environ["HF_ENDPOINT"] = base_url
+        requests.sessions.Session.request = request
+        try:
+            yield self
+        finally:
+            requests.sessions.Session.request = original
+            if previous_endpoint is None:
+                os.environ.pop("HF_ENDPOINT", None)
+            else:
+                os.environ["HF_ENDPOINT"] = previous_endpoint
+
+    def should_fail(self, route):
+        """Decide whether a request to route gets an injected error"""
+        rate = self.error_rate.get(route, 0.0) if isinstance(self.error_rate, dict) else self.error_rate
+        if not rate:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+    def repo_id(self, index):
+        """Return the id of the model at a catalog index"""
+        return f"{AUTHORS[index % len(AUTHORS)]}/model-{index:06d}"
+
+    def model_index(self, repo_id):
+        """Return the catalog index of a model id, or None if it does not exist"""
+        match = MODEL_NAME.match(repo_id)
+        if not match:
+            return None
+        index = int(match.group("index"))
+        if index >= self.catalog_size or self.repo_id(index) != repo_id:
+            return None
+        return index
+
+    def siblings(self, index):
+        """Return the files of a model as (filename, size) pairs"""
+        return [
+            ("config.json", len(self.config_bytes(index))),
+            ("tokenizer.json", 2048),
+            ("model.safetensors", self.file_size),
+        ]
+
+    def config(self, index):
+        task, _ = TASKS[index % len(TASKS)]
+        return {
+            "architectures": ["LlamaForCausalLM" if task == "text-generation" else "BertModel"],
+            "model_type": "llama" if task == "text-generation" else "bert",
+            "num_parameters": (index % 70 + 1) * 100_000_000
+        }
+
+    def config_bytes(self, index):
+        return json.dumps(self.config(index), indent=2).encode()
+
+    def model_entry(self, index, full=False):
+        """Return a model as listed by /api/models"""
+        repo_id = self.repo_id(index)
+        task, library = TASKS[index % len(TASKS)]
+        entry = {
+            "_id": hashlib.md5(repo_id.encode()).hexdigest()[:24],
+            "id": repo_id,
+            "modelId": repo_id,
+            "author": repo_id.split("/")[0],
+            "downloads": (self.catalog_size - index) * 7,
+            "likes": (self.catalog_size - index) // 10,
+            "private": False,
+            "pipeline_tag": task,
+            "library_name": library,
+            "tags": [library, task, "pytorch", "safetensors"],
+            "lastModified": "2024-01-01T00:00:00.000Z"
+        }
+        if full:
+            entry["siblings"] = [{"rfilename": name} for name, _ in self.siblings(index)]
+        return entry
+
+    def model_info(self, index):
+        """Return a model as described by /api/models/<repo_id>"""
+        info = self.model_entry(index)
+        info.update({
+            "sha": hashlib.sha1(info["id"].encode()).hexdigest(),
+            "config": self.config(index),
+            "cardData": {"description": f"Synthetic model number {index}", "license": "apache-2.0"},
+            "siblings": [{"rfilename": name, "size": size} for name, size in self.siblings(index)]
+        })
+        return info
+
+    def file_block(self, repo_id, filename):
+        """Return the repeating block a generated file is made of"""
+        seed = hashlib.sha256(f"{repo_id}/{filename}".encode()).digest()
+        return (seed * (CHUNK_SIZE // len(seed) + 1))[:CHUNK_SIZE]
+
+    def read_file(self, repo_id, filename, index, start, end):
+        """Yield the bytes of a file between start and end (inclusive)"""
+        if filename == "config.json":
+            yield self.config_bytes(index)[start:end + 1]
+            return
+        block = self.file_block(repo_id, filename)
+        position = start
+        while position <= end:
+            offset = position % CHUNK_SIZE
+            length = min(CHUNK_SIZE - offset, end - position + 1)
+            yield block[offset:offset + length]
+            position += length
+
+
+class _HubHandler(BaseHTTPRequestHandler):
+    """Request handler; state lives on server.standin"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def standin(self):
+        return self.server.standin
+
+    def send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def dispatch(self):
+        parsed = urlparse(self.path)
+        path = unquote(parsed.path)
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        standin = self.standin
+
+        if path == "/api/models":
+            route, handler = "models", lambda: self.handle_models(query)
+        elif path.startswith("/api/models/"):
+            repo_id = path[len("/api/models/"):].rstrip("/")
+            route, handler = "model_info", lambda: self.handle_model_info(repo_id)
+        elif RESOLVE_PATH.match(path):
+            match = RESOLVE_PATH.match(path)
+            route, handler = "resolve", lambda: self.handle_resolve(
+                match.group("repo_id"), match.group("filename"))
+        else:
+            route, handler = None, None
+
+        with standin.lock:
+            standin.hits[route or path] += 1
+        if standin.latency:
+            time.sleep(standin.latency)
+
+        if handler is None or (route != "resolve" and self.command == "HEAD"):
+            self.send_json({"error": "Not Found"}, 404)
+        elif standin.should_fail(route):
+            self.send_json({"error": "Internal Error - We're working hard to fix this as soon as possible!"}, 500)
+        else:
+            handler()
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_HEAD(self):
+        self.dispatch()
+
+    def handle_models(self, query):
+        standin = self.standin
+        try:
+            limit = min(int(query.get("limit", standin.page_size)), MAX_PAGE_SIZE)
+            start = _decode_cursor(query["cursor"]) if "cursor" in query else 0
+        except ValueError:
+            self.send_json({"error": "Invalid limit or cursor"}, 400)
+            return
+        search = query.get("search", "").lower()
+        author = query.get("author")
+        tag = query.get("filter")
+        full = query.get("full", "").lower() in ("true", "1")
+
+        page = []
+        index = start
+        while index < standin.catalog_size and len(page) < limit:
+            repo_id = standin.repo_id(index)
+            if (search in repo_id.lower()
+                    and (not author or repo_id.startswith(author + "/"))):
+                entry = standin.model_entry(index, full=full)
+                if not tag or tag in entry["tags"]:
+                    page.append(entry)
+            index += 1
+
+        headers = {}
+        if index < standin.catalog_size:
+            next_query = dict(query, cursor=_encode_cursor(index), limit=str(limit))
+            host = self.headers.get("Host") or f"127.0.0.1:{standin.server.server_port}"
+            headers["Link"] = f'<http://{host}/api/models?{urlencode(next_query)}>; rel="next"'
+        self.send_json(page, headers=headers)
+
+    def handle_model_info(self, repo_id):
+        index = self.standin.model_index(repo_id)
+        if index is None:
+            self.send_json({"error": "Repository not found"}, 404)
+            return
+        self.send_json(self.standin.model_info(index))
+
+    def handle_resolve(self, repo_id, filename):
+        standin = self.standin
+        index = standin.model_index(repo_id)
+        sizes = dict(standin.siblings(index)) if index is not None else {}
+        if filename not in sizes:
+            self.send_json({"error": "Entry not found"}, 404,
+                           headers={"X-Error-Code": "EntryNotFound"})
+            return
+
+        size = sizes[filename]
+        start, end, status = 0, size - 1, 200
+        range_header = self.headers.get("Range")
+        if range_header:
+            match = RANGE_HEADER.match(range_header.strip())
+            if not match or not (match.group(1) or match.group(2)):
+                self.send_json({"error": "Invalid range"}, 416,
+                               headers={"Content-Range": f"bytes */{size}"})
+                return
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            if start >= size or start > end:
+                self.send_json({"error": "Range not satisfiable"}, 416,
+                               headers={"Content-Range": f"bytes */{size}"})
+                return
+            status = 206
+
+        etag = hashlib.sha256(f"{repo_id}/{filename}/{size}".encode()).hexdigest()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{etag}"')
+        self.send_header("X-Repo-Commit", standin.model_info(index)["sha"])
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+
+        started = time.perf_counter()
+        sent = 0
+        for chunk in standin.read_file(repo_id, filename, index, start, end):
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            if standin.bytes_per_second:
+                ahead = sent / standin.bytes_per_second - (time.perf_counter() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
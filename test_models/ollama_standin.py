@@ -0,0 +1,339 @@
+"""
+Local stand-in for the Ollama HTTP API.
+
+Implements the endpoints used by getllm's OllamaModelManager so tests and
+performance measurements can talk real HTTP without an Ollama installation:
+
+    GET    /api/version
+    GET    /api/tags
+    GET|POST /api/show       {"name": ...}
+    POST   /api/pull         {"name": ..., "stream": true}   NDJSON progress
+    DELETE /api/delete       {"name": ...}
+    POST   /api/generate     {"model": ..., "prompt": ..., "stream": true}
+
+Latency, token rate, error rate and the size of the model catalog can be
+injected, and may be changed while the server is running:
+
+    with OllamaStandIn(catalog_size=10000, latency=0.05, tokens_per_second=40) as ollama:
+        manager = OllamaModelManager(base_url=ollama.base_url)
+        ...
+"""
+
+import json
+import time
+import random
+import hashlib
+import datetime
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+VERSION = "0.1.32-standin"
+FAMILIES = ["llama", "mistral", "phi", "gemma", "qwen", "codellama"]
+PARAMETER_SIZES = ["1B", "3B", "7B", "13B", "34B", "70B"]
+WORDS = ["def", "return", "value", "the", "model", "result", "print", "data", "for", "in"]
+
+
+def make_model(name, index=0):
+    """Return the catalog entry of a model, in the format of /api/tags"""
+    digest = hashlib.sha256(name.encode()).hexdigest()
+    family = FAMILIES[index % len(FAMILIES)]
+    parameter_size = PARAMETER_SIZES[index % len(PARAMETER_SIZES)]
+    return {
+        "name": name,
+        "model": name,
+        "modified_at": "2024-01-01T00:00:00Z",
+        "size": int(float(parameter_size[:-1]) * 570_000_000),
+        "digest": digest,
+        "details": {
+            "format": "gguf",
+            "family": family,
+            "families": [family],
+            "parameter_size": parameter_size,
+            "quantization_level": "Q4_0"
+        }
+    }
+
+
+def synthetic_catalog(count):
+    """Generate a catalog of count models named "<family>-<n>:<size>" """
+    catalog = {}
+    for i in range(count):
+        family = FAMILIES[i % len(FAMILIES)]
+        name = f"{family}-{i:06d}:{PARAMETER_SIZES[i % len(PARAMETER_SIZES)].lower()}"
+        catalog[name] = make_model(name, i)
+    return catalog
+
+
+def _nanoseconds(seconds):
+    return int(seconds * 1_000_000_000)
+
+
+class OllamaStandIn:
+    """
+    Threaded HTTP server imitating Ollama
+
+    Args:
+        models (list): Names of installed models
+        catalog_size (int): Number of additional synthetic models to install
+        latency (float): Seconds to wait before answering any request
+        tokens_per_second (float): Generation speed of /api/generate; 0 means
+            tokens are produced without delay
+        error_rate (float or dict): Probability of answering with HTTP 500,
+            either for all endpoints or per path, e.g. {"/api/generate": 0.1}
+        response_tokens (int): Tokens generated when num_predict is not given
+        pull_chunks (int): Progress messages streamed by /api/pull
+        seed (int): Seed for error injection and generated text
+        host (str): Interface to bind to
+        port (int): Port to bind to; 0 picks a free port
+    """
+
+    def __init__(self, models=None, catalog_size=0, latency=0.0, tokens_per_second=0.0,
+                 error_rate=0.0, response_tokens=32, pull_chunks=5, seed=None,
+                 host="127.0.0.1", port=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.response_tokens = response_tokens
+        self.pull_chunks = pull_chunks
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.hits = Counter()
+        self.models = synthetic_catalog(catalog_size)
+        for i, name in enumerate(models or []):
+            self.models[name] = make_model(name, i)
+        self.server = ThreadingHTTPServer((host, port), _OllamaHandler)
+        self.server.daemon_threads = True
+        self.server.standin = self
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve requests in a background thread"""
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server and close its socket"""
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def should_fail(self, path):
+        """Decide whether a request to path gets an injected error"""
+        rate = self.error_rate.get(path, 0.0) if isinstance(self.error_rate, dict) else self.error_rate
+        if not rate:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+    def generate_tokens(self, count):
+        """Return count deterministic pseudo-random tokens"""
+        with self.lock:
+            return [self.random.choice(WORDS) + " " for _ in range(count)]
+
+
+class _OllamaHandler(BaseHTTPRequestHandler):
+    """Request handler; state lives on server.standin"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def standin(self):
+        return self.server.standin
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return None
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def send_line(self, payload):
+        data = json.dumps(payload).encode() + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def dispatch(self, method):
+        path = self.path.split("?", 1)[0]
+        body = self.read_json()
+        standin = self.standin
+        with standin.lock:
+            standin.hits[path] += 1
+        if standin.latency:
+            time.sleep(standin.latency)
+
+        route = ROUTES.get((method, path))
+        if route is None:
+            self.send_json({"error": "not found"}, 404)
+        elif body is None:
+            self.send_json({"error": "invalid JSON body"}, 400)
+        elif standin.should_fail(path):
+            self.send_json({"error": "injected failure"}, 500)
+        else:
+            route(self, body)
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def handle_version(self, body):
+        self.send_json({"version": VERSION})
+
+    def handle_tags(self, body):
+        with self.standin.lock:
+            models = list(self.standin.models.values())
+        self.send_json({"models": models})
+
+    def handle_show(self, body):
+        name = body.get("name") or body.get("model")
+        model = self.standin.models.get(name)
+        if model is None:
+            self.send_json({"error": f"model '{name}' not found"}, 404)
+            return
+        self.send_json({
+            "name": name.split(":")[0],
+            "model": name,
+            "modelfile": f"FROM {name}",
+            "parameters": "stop <|end|>",
+            "template": "{{ .Prompt }}",
+            "details": model["details"],
+            "size": model["size"],
+            "digest": model["digest"]
+        })
+
+    def handle_pull(self, body):
+        name = body.get("name") or body.get("model")
+        if not name:
+            self.send_json({"error": "missing name"}, 400)
+            return
+        model = make_model(name, len(self.standin.models))
+        total = model["size"]
+        chunks = max(1, self.standin.pull_chunks)
+        progress = [{"status": "pulling manifest"}]
+        for i in range(1, chunks + 1):
+            progress.append({
+                "status": f"pulling {model['digest'][:12]}",
+                "digest": f"sha256:{model['digest']}",
+                "total": total,
+                "completed": total * i // chunks
+            })
+        progress += [{"status": "verifying sha256 digest"},
+                     {"status": "writing manifest"},
+                     {"status": "success"}]
+        with self.standin.lock:
+            self.standin.models[name] = model
+
+        if body.get("stream", True) is False:
+            self.send_json(progress[-1])
+            return
+        self.start_stream()
+        for message in progress:
+            self.send_line(message)
+        self.end_stream()
+
+    def handle_delete(self, body):
+        name = body.get("name") or body.get("model")
+        with self.standin.lock:
+            removed = self.standin.models.pop(name, None)
+        if removed is None:
+            self.send_json({"error": f"model '{name}' not found"}, 404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def handle_generate(self, body):
+        name = body.get("model")
+        if name not in self.standin.models:
+            self.send_json({"error": f"model '{name}' not found, try pulling it first"}, 404)
+            return
+        options = body.get("options") or {}
+        count = int(options.get("num_predict") or self.standin.response_tokens)
+        tokens = self.standin.generate_tokens(count)
+        prompt_tokens = len(str(body.get("prompt", "")).split())
+        delay = 1.0 / self.standin.tokens_per_second if self.standin.tokens_per_second else 0.0
+        start = time.perf_counter()
+
+        def summary(response=""):
+            elapsed = time.perf_counter() - start
+            return {
+                "model": name,
+                "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "response": response,
+                "done": True,
+                "total_duration": _nanoseconds(elapsed + self.standin.latency),
+                "load_duration": 0,
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": 0,
+                "eval_count": count,
+                "eval_duration": _nanoseconds(elapsed)
+            }
+
+        if body.get("stream", True) is False:
+            time.sleep(delay * count)
+            self.send_json(summary("".join(tokens)))
+            return
+        self.start_stream()
+        for token in tokens:
+            if delay:
+                time.sleep(delay)
+            self.send_line({
+                "model": name,
+                "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "response": token,
+                "done": False
+            })
+        self.send_line(summary())
+        self.end_stream()
+
+
+ROUTES = {
+    ("GET", "/api/version"): _OllamaHandler.handle_version,
+    ("GET", "/api/tags"): _OllamaHandler.handle_tags,
+    ("GET", "/api/show"): _OllamaHandler.handle_show,
+    ("POST", "/api/show"): _OllamaHandler.handle_show,
+    ("POST", "/api/pull"): _OllamaHandler.handle_pull,
+    ("DELETE", "/api/delete"): _OllamaHandler.handle_delete,
+    ("POST", "/api/generate"): _OllamaHandler.handle_generate,
+}
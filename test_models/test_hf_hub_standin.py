@@ -0,0 +1,114 @@
+"""
+Tests for the Hugging Face model manager against a local Hub stand-in server.
+"""
+
+import pytest
+import requests
+
+from getllm.models.huggingface.manager import HuggingFaceModelManager
+from getllm.exceptions import ModelNotFoundError
+
+from hf_hub_standin import HubStandIn
+
+
+@pytest.fixture
+def standin_manager(hub_standin, temp_cache_dir):
+    """Create a HuggingFaceModelManager whose Hub requests go to the stand-in."""
+    return HuggingFaceModelManager(cache_dir=temp_cache_dir)
+
+
+def test_fetch_model_info(standin_manager, hub_standin):
+    """Test fetching model info over real HTTP."""
+    model_info = standin_manager._fetch_model_info("acme/model-000000")
+    
+    assert model_info["modelId"] == "acme/model-000000"
+    assert {s["rfilename"] for s in model_info["siblings"]} == {
+        "config.json", "tokenizer.json", "model.safetensors"
+    }
+    assert hub_standin.hits["model_info"] == 1
+
+
+def test_fetch_model_info_not_found(standin_manager):
+    """Test fetching info for a model that is not in the catalog."""
+    with pytest.raises(ModelNotFoundError):
+        standin_manager._fetch_model_info("acme/model-999999")
+
+
+def test_list_models(standin_manager):
+    """Test listing models from the stand-in catalog."""
+    models = standin_manager.list_models()
+    
+    assert len(models) > 0
+    assert all("/model-" in m.id for m in models)
+
+
+def test_models_pagination(hub_standin):
+    """Test following Link headers through the whole catalog."""
+    url = f"{hub_standin.base_url}/api/models?limit=7"
+    ids = []
+    while url:
+        response = requests.get(url)
+        ids.extend(model["id"] for model in response.json())
+        url = response.links.get("next", {}).get("url")
+    
+    assert len(ids) == 50
+    assert len(set(ids)) == 50
+
+
+def test_models_search(hub_standin):
+    """Test the search and author filters of /api/models."""
+    response = requests.get(
+        f"{hub_standin.base_url}/api/models",
+        params={"search": "model-00001", "author": "acme"}
+    )
+    
+    assert [m["id"] for m in response.json()] == ["acme/model-000010", "acme/model-000015"]
+
+
+def test_large_catalog_first_page():
+    """Test that large catalogs are generated lazily."""
+    with HubStandIn(catalog_size=200000) as hub:
+        response = requests.get(f"{hub.base_url}/api/models", params={"limit": 100})
+        info = requests.get(f"{hub.base_url}/api/models/community/model-199999")
+    
+    assert len(response.json()) == 100
+    assert 'rel="next"' in response.headers["Link"]
+    assert info.status_code == 200
+
+
+def test_file_download_with_range(hub_standin):
+    """Test full and partial downloads of a model file."""
+    url = f"{hub_standin.base_url}/acme/model-000000/resolve/main/model.safetensors"
+    full = requests.get(url)
+    partial = requests.get(url, headers={"Range": "bytes=1000-1999"})
+    suffix = requests.get(url, headers={"Range": "bytes=-100"})
+    
+    assert full.status_code == 200
+    assert len(full.content) == 64 * 1024
+    assert partial.status_code == 206
+    assert partial.headers["Content-Range"] == f"bytes 1000-1999/{64 * 1024}"
+    assert partial.content == full.content[1000:2000]
+    assert suffix.content == full.content[-100:]
+
+
+def test_file_download_invalid_range(hub_standin):
+    """Test a range beyond the end of the file."""
+    url = f"{hub_standin.base_url}/acme/model-000000/resolve/main/model.safetensors"
+    response = requests.get(url, headers={"Range": "bytes=99999999-"})
+    
+    assert response.status_code == 416
+
+
+def test_redirect_rewrites_hub_url(hub_standin):
+    """Test that requests to huggingface.co reach the stand-in."""
+    response = requests.get("https://huggingface.co/api/models/acme/model-000005")
+    
+    assert response.json()["id"] == "acme/model-000005"
+
+
+def test_injected_errors(hub_standin):
+    """Test per-route error injection."""
+    hub_standin.error_rate = {"model_info": 1.0}
+    
+    assert requests.get(f"{hub_standin.base_url}/api/models/acme/model-000000").status_code == 500
+    assert requests.get(f"{hub_standin.base_url}/api/models").status_code == 200
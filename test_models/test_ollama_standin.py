@@ -0,0 +1,130 @@
+"""
+Tests for the Ollama model manager against a local Ollama stand-in server.
+"""
+
+import json
+import time
+
+import pytest
+import requests
+
+from getllm.models.ollama.manager import OllamaModelManager
+from getllm.exceptions import ModelNotFoundError
+
+from ollama_standin import OllamaStandIn
+
+
+@pytest.fixture
+def standin_manager(ollama_standin, temp_cache_dir):
+    """Create an OllamaModelManager talking to the stand-in server."""
+    return OllamaModelManager(base_url=ollama_standin.base_url, cache_dir=temp_cache_dir)
+
+
+def test_check_server_running(standin_manager, ollama_standin):
+    """Test detecting a running server over real HTTP."""
+    assert standin_manager.check_server_running() is True
+    assert ollama_standin.hits["/api/version"] == 1
+
+
+def test_check_server_running_stopped(temp_cache_dir):
+    """Test detecting a server that is no longer listening."""
+    server = OllamaStandIn().start()
+    base_url = server.base_url
+    server.stop()
+    
+    manager = OllamaModelManager(base_url=base_url, cache_dir=temp_cache_dir)
+    assert manager.check_server_running() is False
+
+
+def test_fetch_model_info(standin_manager):
+    """Test fetching model info from /api/show."""
+    model_info = standin_manager._fetch_model_info("llama2:7b")
+    
+    assert model_info["model"] == "llama2:7b"
+    assert "parameter_size" in model_info["details"]
+
+
+def test_fetch_model_info_not_found(standin_manager):
+    """Test fetching info for a model the server does not have."""
+    with pytest.raises(ModelNotFoundError):
+        standin_manager._fetch_model_info("nonexistent-model")
+
+
+def test_list_models(standin_manager):
+    """Test listing the models installed on the server."""
+    models = standin_manager.list_models()
+    
+    assert sorted(m.id for m in models) == ["llama2:7b", "mistral:latest"]
+
+
+def test_list_models_large_catalog(temp_cache_dir):
+    """Test listing a catalog of several thousand models."""
+    with OllamaStandIn(catalog_size=5000) as server:
+        manager = OllamaModelManager(base_url=server.base_url, cache_dir=temp_cache_dir)
+        models = manager.list_models()
+    
+    assert len(models) == 5000
+
+
+def test_install_and_uninstall_model(standin_manager, ollama_standin):
+    """Test pulling a model with streamed progress and deleting it again."""
+    assert standin_manager.install_model("phi:latest") is True
+    assert "phi:latest" in ollama_standin.models
+    assert "phi:latest" in standin_manager._models_cache
+    
+    assert standin_manager.uninstall_model("phi:latest") is True
+    assert "phi:latest" not in ollama_standin.models
+
+
+def test_injected_errors(standin_manager, ollama_standin):
+    """Test that injected server errors surface as a stopped server."""
+    ollama_standin.error_rate = {"/api/version": 1.0}
+    assert standin_manager.check_server_running() is False
+    
+    ollama_standin.error_rate = 0.0
+    assert standin_manager.check_server_running() is True
+
+
+def test_pull_streams_progress(ollama_standin):
+    """Test the NDJSON progress stream of /api/pull."""
+    response = requests.post(
+        f"{ollama_standin.base_url}/api/pull",
+        json={"name": "gemma:2b"},
+        stream=True
+    )
+    messages = [json.loads(line) for line in response.iter_lines() if line]
+    
+    assert messages[0]["status"] == "pulling manifest"
+    assert messages[-1]["status"] == "success"
+    completed = [m["completed"] for m in messages if "completed" in m]
+    assert completed == sorted(completed)
+    assert completed[-1] == messages[1]["total"]
+
+
+def test_generate_token_rate(ollama_standin):
+    """Test that /api/generate streams tokens at the configured rate."""
+    ollama_standin.tokens_per_second = 100
+    
+    start = time.perf_counter()
+    response = requests.post(
+        f"{ollama_standin.base_url}/api/generate",
+        json={"model": "llama2:7b", "prompt": "Hello", "options": {"num_predict": 20}},
+        stream=True
+    )
+    messages = [json.loads(line) for line in response.iter_lines() if line]
+    elapsed = time.perf_counter() - start
+    
+    assert len(messages) == 21
+    assert messages[-1]["done"] is True
+    assert messages[-1]["eval_count"] == 20
+    assert elapsed >= 0.19
+
+
+def test_latency_injection(ollama_standin):
+    """Test that injected latency delays every response."""
+    ollama_standin.latency = 0.1
+    
+    start = time.perf_counter()
+    requests.get(f"{ollama_standin.base_url}/api/tags")
+    
+    assert time.perf_counter() - start >= 0.1
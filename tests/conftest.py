@@ -0,0 +1,43 @@
+"""
+Pytest configuration and fixtures for the PyLLM API, monitor and benchmark tests.
+"""
+
+import sys
+from pathlib import Path
+from typing import Generator
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from load_test_pyllm import StubModelManager, load_api, start_stub_server
+
+
+@pytest.fixture(scope="session")
+def pyllm_module():
+    """Load the PyLLM API module once, for tests of its pure functions."""
+    return load_api()
+
+
+@pytest.fixture
+def pyllm_api():
+    """Load a fresh PyLLM API module with a stub ModelManager that answers at once."""
+    api = load_api()
+    api.model_manager = StubModelManager()
+    api.model_manager.latency = 0.0
+    api.model_manager.tokens_per_second = 10000.0
+    return api
+
+
+@pytest.fixture
+def pyllm_server() -> Generator[str, None, None]:
+    """Start the PyLLM API with the stub ModelManager and return its base URL."""
+    base_url, server = start_stub_server(latency=0.01, tokens_per_second=5000.0)
+    yield base_url
+    server.should_exit = True
+
+
+@pytest.fixture
+def pyllm_server_api(pyllm_server):
+    """Return the API module served by pyllm_server."""
+    return sys.modules["pyllm_loadtest.api"]
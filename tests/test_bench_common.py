@@ -0,0 +1,60 @@
+"""
+Tests for the baseline comparison of benchmarks/common.py.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+import common
+
+
+def make_results(samples):
+    results = common.new_results("test")
+    common.add_metric(results, "op", samples)
+    return results
+
+
+@pytest.mark.parametrize("n, expected", [(3, 0.1), (4, 2 / 70), (5, 2 / 252)])
+def test_min_p_value(n, expected):
+    """Test the smallest p-value against the exact test of fully separated samples."""
+    assert common.min_p_value(n, n) == pytest.approx(expected)
+    _, p_value = common.mann_whitney_u(list(range(n)), list(range(100, 100 + n)))
+    assert p_value == pytest.approx(expected)
+
+
+def test_three_samples_are_underpowered():
+    """Test that a 3-sample comparison is flagged instead of silently passing."""
+    rows = common.compare_to_baseline(make_results([2.0, 2.1, 2.2]), make_results([1.0, 1.1, 1.2]))
+    
+    assert rows[0]["underpowered"] is True
+    assert rows[0]["regressed"] is False
+    assert common.underpowered_metrics(rows) == ["op"]
+
+
+def test_five_samples_detect_regression():
+    """Test that MIN_SAMPLES samples per side can report a clear regression."""
+    baseline = make_results([1.0, 1.02, 1.01, 0.99, 1.03])
+    current = make_results([2.0, 2.02, 2.01, 1.99, 2.03])
+    rows = common.compare_to_baseline(current, baseline)
+    
+    assert rows[0]["underpowered"] is False
+    assert rows[0]["regressed"] is True
+    assert common.underpowered_metrics(rows) == []
+
+
+def test_underpowered_ungated_metric_is_not_reported():
+    """Test that metrics excluded from the gate do not fail for their sample count."""
+    rows = common.compare_to_baseline(make_results([1.0] * 3), make_results([1.0] * 3), metrics=["other"])
+    
+    assert rows[0]["underpowered"] is True
+    assert common.underpowered_metrics(rows) == []
+
+
+def test_quick_mode_repeats_enough():
+    """Test that the CI smoke mode of the SheLLama benchmark can detect regressions."""
+    import bench_shellama
+    
+    assert bench_shellama.QUICK["repeat"] >= common.MIN_SAMPLES
@@ -0,0 +1,405 @@
+"""
+Tests for the latency histograms, status store, metrics and probe scheduling
+of monitor_services.py.
+"""
+
+import math
+import random
+import re
+
+import pytest
+
+import monitor_services
+from monitor_services import (METRICS_BUCKETS, RECOVERY_CHECKS, SCHEDULE_JITTER, STORE_RETENTION, STORE_ROLLUPS,
+                              AdaptiveScheduler, LatencyHistogram, MonitorMetrics, RollingHistogram, StatusStore)
+
+
+def test_bucket_index_and_bound_round_trip():
+    """Test that every bucket covers exactly the values between its bounds."""
+    previous = 0
+    for index in range(900):
+        upper = round(LatencyHistogram.bucket_upper_bound(index) * 1000000)
+        assert upper > previous
+        assert LatencyHistogram.bucket_index((previous + 0.5) / 1000000) == index
+        assert LatencyHistogram.bucket_index((upper - 0.5) / 1000000) == index
+        assert LatencyHistogram.bucket_index(LatencyHistogram.bucket_upper_bound(index)) == index
+        if index >= 10:
+            assert (upper - previous) / upper <= 0.1
+        previous = upper
+
+
+def test_bucket_index_of_random_latencies():
+    """Test that latencies fall between the bounds of their bucket."""
+    rng = random.Random(0)
+    for _ in range(10000):
+        seconds = 10 ** rng.uniform(-6, 3)
+        index = LatencyHistogram.bucket_index(seconds)
+        lower = LatencyHistogram.bucket_upper_bound(index - 1) if index else 0.0
+        assert lower - 1e-9 < seconds <= LatencyHistogram.bucket_upper_bound(index) + 1e-9
+    assert LatencyHistogram.bucket_index(-1.0) == 0
+
+
+def test_percentiles_within_bucket_precision():
+    """Test percentiles against the exact order statistics of the samples."""
+    rng = random.Random(1)
+    samples = [rng.lognormvariate(-3, 1.5) for _ in range(5000)]
+    histogram = LatencyHistogram()
+    for seconds in samples:
+        histogram.record(seconds)
+    ordered = sorted(samples)
+
+    for q in (1, 50, 90, 99, 99.9, 100):
+        exact = ordered[max(1, math.ceil(len(ordered) * q / 100)) - 1]
+        assert exact <= histogram.percentile(q) <= exact * 1.1 + 1e-6
+    assert histogram.percentile(100) == max(samples)
+    assert LatencyHistogram().percentile(50) is None
+
+
+def test_histogram_merge_and_serialization():
+    """Test that merged and reloaded histograms equal one built from all samples."""
+    rng = random.Random(2)
+    samples = [rng.uniform(0, 2) for _ in range(1000)]
+    first, second, both = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    for i, seconds in enumerate(samples):
+        (first if i % 2 else second).record(seconds)
+        both.record(seconds)
+    first.merge(LatencyHistogram.from_dict(second.to_dict()))
+
+    assert first.to_dict() == both.to_dict()
+
+
+def test_rolling_histogram_window():
+    """Test that slots leave the window and reloaded windows keep the live ones."""
+    rolling = RollingHistogram(window=60, slots=6)
+    for t in range(0, 120, 5):
+        rolling.record(float(t), now=1000 + t)
+
+    snapshot = rolling.snapshot(now=1120)
+    assert snapshot.total == 12
+    assert snapshot.max == 115.0
+    assert len(rolling.slots) == 6
+    assert rolling.snapshot(now=1129.9).total == 12
+    assert rolling.snapshot(now=1130).total == 10
+
+    reloaded = RollingHistogram(window=60, slots=6)
+    reloaded.load(rolling.to_dict(), now=1150)
+    assert reloaded.snapshot(now=1150).total == 6
+    assert rolling.snapshot(now=1300).total == 0
+
+
+def make_result(name, status="healthy", response_time=0.01):
+    return {
+        "name": name,
+        "status": status,
+        "code": {"healthy": 200, "degraded": 500}.get(status),
+        "response_time": response_time,
+        "version": "1.0",
+        "error": None if status == "healthy" else status
+    }
+
+
+def brute_force_query(written, service, since, now):
+    """Summarize the raw samples of a service the way StatusStore.query should."""
+    histogram = LatencyHistogram()
+    samples = up = 0
+    for ts, result in written:
+        if result["name"] != service or not now - since <= ts <= now:
+            continue
+        samples += 1
+        up += result["code"] == 200
+        if result["status"] != "offline":
+            histogram.record(result["response_time"])
+    return {
+        "service": service,
+        "since": since,
+        "samples": samples,
+        "uptime": 100.0 * up / samples if samples else None,
+        "p50": histogram.percentile(50),
+        "p95": histogram.percentile(95),
+        "p99": histogram.percentile(99),
+        "max": histogram.max if histogram.total else None
+    }
+
+
+@pytest.fixture(scope="module")
+def filled_store(tmp_path_factory):
+    """A status store with 27 hours of unaligned samples of two services."""
+    rng = random.Random(3)
+    store = StatusStore(str(tmp_path_factory.mktemp("store") / "status.db"))
+    written = []
+    ts = 1700000000 + 13.5
+    for _ in range(27 * 80):
+        results = []
+        for name in ("api", "ui"):
+            status = rng.choices(["healthy", "degraded", "offline"], [90, 5, 5])[0]
+            results.append(make_result(name, status, rng.lognormvariate(-4, 1)))
+        store.write(results, now=ts)
+        written.extend((ts, result) for result in results)
+        ts += 45
+    yield store, written, ts - 45
+    store.close()
+
+
+@pytest.mark.parametrize("since", [1, 30, 90, 3600, 6 * 3600, 86400, 86400 + 1, 25 * 3600 + 7, 27 * 3600])
+@pytest.mark.parametrize("delay", [0, 10])
+def test_query_matches_raw_samples(filled_store, since, delay):
+    """Test that queries answered from rollups equal a brute-force pass over the samples."""
+    store, written, last = filled_store
+
+    for service in ("api", "ui"):
+        expected = brute_force_query(written, service, since, last + delay)
+        assert store.query(service, since, now=last + delay) == expected
+
+
+def test_rollup_watermarks(filled_store):
+    """Test that only complete periods are rolled up and none are counted twice."""
+    store, written, last = filled_store
+
+    assert store._watermark("rollup_1m") == last // 60 * 60
+    assert store._watermark("rollup_1h") == last // 3600 * 3600
+    for table, (width, _) in STORE_ROLLUPS.items():
+        end = store._watermark(table)
+        rolled = store.conn.execute(f"SELECT SUM(samples), MAX(bucket) FROM {table}").fetchone()
+        assert rolled[0] == sum(1 for ts, _ in written if ts < end)
+        assert rolled[1] == end - width
+
+
+def test_rollup_boundary(tmp_path):
+    """Test that a sample at the start of a minute is rolled up with that minute."""
+    store = StatusStore(str(tmp_path / "status.db"))
+    for ts in (600.0, 659.9, 660.0):
+        store.write([make_result("api")], now=ts)
+
+    rows = store.conn.execute("SELECT bucket, samples FROM rollup_1m").fetchall()
+    assert rows == [(600, 2)]
+    assert store.query("api", 60, now=660.0)["samples"] == 3
+    assert store.query("api", 59.95, now=660.0)["samples"] == 2
+
+    store.write([make_result("api")], now=720.0)
+    rows = store.conn.execute("SELECT bucket, samples FROM rollup_1m ORDER BY bucket").fetchall()
+    assert rows == [(600, 2), (660, 1)]
+    store.close()
+
+
+def test_retention_boundaries(tmp_path):
+    """Test that every tier expires at its own retention and rollups outlive samples."""
+    store = StatusStore(str(tmp_path / "status.db"))
+    first = 3600.0 * 1000
+    store.write([make_result("api")], now=first)
+    store.write([make_result("api")], now=first + 3600)
+
+    def count(table):
+        return store.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    store.downsample(now=first + STORE_RETENTION["samples"])
+    assert count("samples") == 2
+    store.downsample(now=first + STORE_RETENTION["samples"] + 1)
+    assert count("samples") == 1
+    assert count("rollup_1m") == 2
+    assert store.query("api", 3 * 86400, now=first + 3 * 86400)["samples"] == 2
+
+    store.downsample(now=first + STORE_RETENTION["rollup_1m"])
+    assert count("samples") == 0
+    assert count("rollup_1m") == 2
+    store.downsample(now=first + STORE_RETENTION["rollup_1m"] + 1)
+    assert count("rollup_1m") == 1
+    assert count("rollup_1h") == 2
+
+    store.downsample(now=first + STORE_RETENTION["rollup_1h"] + 1)
+    assert count("rollup_1h") == 1
+    store.close()
+
+
+SAMPLE_LINE = re.compile(r'([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})? (\S+)')
+
+
+def parse_openmetrics(text):
+    """Parse OpenMetrics text into metric types and (name, labels, value) samples."""
+    assert text.endswith("\n# EOF\n")
+    types, samples = {}, []
+    for line in text[:-len("# EOF\n")].splitlines():
+        if line.startswith("# TYPE "):
+            _, _, family, kind = line.split(" ")
+            assert family not in types
+            types[family] = kind
+        elif not line.startswith("# "):
+            match = SAMPLE_LINE.fullmatch(line)
+            assert match, line
+            name, labels, value = match.groups()
+            labels = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', labels or ""))
+            samples.append((name, labels, float(value)))
+    return types, samples
+
+
+def test_openmetrics_output_shape():
+    """Test the families, suffixes and histogram series of the rendered metrics."""
+    rng = random.Random(4)
+    metrics = MonitorMetrics()
+    latencies = []
+    statuses = []
+    for _ in range(200):
+        latency = rng.lognormvariate(-4, 1.5)
+        status = rng.choices(["healthy", "degraded", "offline"], [90, 5, 5])[0]
+        metrics.observe_cycle([make_result("api", status, latency), make_result('we"b', "healthy", 0.2)], 0.3)
+        statuses.append(status)
+        if status != "offline":
+            latencies.append(latency)
+    metrics.set_state("api", "recovering")
+
+    types, samples = parse_openmetrics(metrics.render())
+
+    suffixes = {"counter": {"_total"}, "gauge": {""}, "stateset": {""}, "histogram": {"_bucket", "_count", "_sum"}}
+    for name, _, _ in samples:
+        family = re.sub(r"_(total|bucket|count|sum)$", "", name)
+        if family not in types:
+            family = name
+        assert name[len(family):] in suffixes[types[family]], name
+
+    buckets = [(labels["le"], value) for name, labels, value in samples
+               if name == "monitor_probe_latency_seconds_bucket" and labels["service"] == "api"]
+    assert [le for le, _ in buckets] == [repr(float(bound)) for bound in METRICS_BUCKETS] + ["+Inf"]
+    for (_, count), bound in zip(buckets, METRICS_BUCKETS):
+        assert count == sum(1 for latency in latencies if latency <= bound)
+    values = {(name, labels.get("service")): value for name, labels, value in samples}
+    assert buckets[-1][1] == values[("monitor_probe_latency_seconds_count", "api")] == len(latencies)
+    assert values[("monitor_probe_latency_seconds_sum", "api")] == pytest.approx(sum(latencies))
+    assert values[("monitor_probes_total", 'we\\"b')] == 200
+    assert values[("monitor_probe_cycle_duration_seconds_count", None)] == 200
+
+    states = {labels["monitor_service_state"]: value for name, labels, value in samples
+              if name == "monitor_service_state"}
+    assert states == {"healthy": 0, "degraded": 0, "offline": 0, "recovering": 1}
+    errors = {labels["code"]: value for name, labels, value in samples if name == "monitor_probe_errors_total"}
+    assert errors == {"500": statuses.count("degraded"), "connection": statuses.count("offline")}
+
+
+def schedule(scheduler, name, status, now):
+    """Update the scheduler with a check result and return the transition and delay."""
+    transition = scheduler.update(name, make_result(name, status), now=now)
+    return transition, scheduler.entries[name]["next"] - now
+
+
+def assert_jittered(delay, expected):
+    assert expected * (1 - SCHEDULE_JITTER) <= delay <= expected * (1 + SCHEDULE_JITTER)
+
+
+def test_offline_backoff_is_capped():
+    """Test that offline checks back off exponentially up to max_backoff."""
+    random.seed(5)
+    scheduler = AdaptiveScheduler([{"name": "api"}], interval=60, fast_interval=5, max_backoff=300, now=0)
+
+    now = 0.0
+    previous = "unknown"
+    for expected in (5, 10, 20, 40, 80, 160, 300, 300):
+        transition, delay = schedule(scheduler, "api", "offline", now)
+        assert transition == (previous, "offline")
+        assert_jittered(delay, expected)
+        previous = "offline"
+        now += delay
+
+    transition, delay = schedule(scheduler, "api", "degraded", now)
+    assert transition == ("offline", "degraded")
+    assert_jittered(delay, 5)
+    transition, delay = schedule(scheduler, "api", "offline", now)
+    assert_jittered(delay, 5)
+
+
+def test_recovery_returns_to_interval():
+    """Test that a recovered service is checked fast for RECOVERY_CHECKS successes."""
+    random.seed(6)
+    scheduler = AdaptiveScheduler([{"name": "api"}], interval=60, fast_interval=5, now=0)
+
+    assert schedule(scheduler, "api", "healthy", 0)[0] == ("unknown", "healthy")
+    assert schedule(scheduler, "api", "degraded", 60)[0] == ("healthy", "degraded")
+    states = []
+    for i in range(RECOVERY_CHECKS + 1):
+        (_, state), delay = schedule(scheduler, "api", "healthy", 65 + i * 5)
+        states.append(state)
+        assert_jittered(delay, 5 if state == "recovering" else 60)
+    assert states == ["recovering"] * (RECOVERY_CHECKS - 1) + ["healthy", "healthy"]
+
+    schedule(scheduler, "api", "offline", 200)
+    assert schedule(scheduler, "api", "healthy", 205)[0] == ("offline", "recovering")
+    assert schedule(scheduler, "api", "degraded", 210)[0] == ("recovering", "degraded")
+    assert schedule(scheduler, "api", "healthy", 215)[0] == ("degraded", "recovering")
+
+
+def test_jitter_bounds_and_spread():
+    """Test that delays spread over the whole jitter range and start offsets over the spread."""
+    random.seed(7)
+    targets = [{"name": f"service-{i}"} for i in range(200)]
+    scheduler = AdaptiveScheduler(targets, interval=60, fast_interval=120, spread=30, now=1000)
+
+    offsets = [entry["next"] - 1000 for entry in scheduler.entries.values()]
+    assert all(0 <= offset < 30 for offset in offsets)
+    assert max(offsets) - min(offsets) > 25
+    assert scheduler.fast_interval == 60
+    assert scheduler.max_backoff == 60
+    assert len(scheduler.due(targets, now=1015)) < len(targets) == len(scheduler.due(targets, now=1030))
+
+    delays = [schedule(scheduler, target["name"], "healthy", 1000)[1] for target in targets]
+    for delay in delays:
+        assert_jittered(delay, 60)
+    assert min(delays) < 60 * (1 - SCHEDULE_JITTER / 2) and max(delays) > 60 * (1 + SCHEDULE_JITTER / 2)
+    assert scheduler.next_due() == 1000 + min(delays)
+
+
+def test_openmetrics_buckets_include_their_bound():
+    """Test that a latency exactly on a bucket bound is counted in that bucket."""
+    metrics = MonitorMetrics()
+    for bound in METRICS_BUCKETS:
+        metrics.observe_cycle([make_result("api", "healthy", bound)], bound)
+
+    _, samples = parse_openmetrics(metrics.render())
+
+    for metric in ("monitor_probe_latency_seconds_bucket", "monitor_probe_cycle_duration_seconds_bucket"):
+        counts = [value for name, labels, value in samples if name == metric]
+        assert counts == list(range(1, len(METRICS_BUCKETS) + 1)) + [len(METRICS_BUCKETS)]
+
+
+def make_proc(root, processes):
+    """Create a fake procfs with processes given as {pid: (ppid, rss_kb)}."""
+    for pid, (ppid, rss_kb) in processes.items():
+        fields = ["S", str(ppid)] + ["0"] * 18
+        fields[11], fields[12], fields[17] = "5", "7", "2"
+        (root / str(pid) / "fd").mkdir(parents=True)
+        (root / str(pid) / "fd" / "0").touch()
+        (root / str(pid) / "stat").write_text(f"{pid} (svc name) " + " ".join(fields) + "\n")
+        (root / str(pid) / "status").write_text(f"VmRSS:\t{rss_kb} kB\nvoluntary_ctxt_switches:\t3\n")
+
+
+def test_process_sampling_scans_proc_once(tmp_path, monkeypatch):
+    """Test that a cycle scans procfs once and still samples each process tree."""
+    proc = tmp_path / "proc"
+    make_proc(proc, {1: (0, 10), 100: (1, 1000), 101: (100, 500), 102: (101, 250), 200: (1, 2000)})
+    targets, results = [], []
+    for name, pid in (("api", 100), ("ui", 200), ("gone", 300)):
+        (tmp_path / f"{name}.pid").write_text(str(pid))
+        targets.append({"name": name, "pid_file": str(tmp_path / f"{name}.pid")})
+        results.append(make_result(name))
+    targets.append({"name": "remote"})
+    results.append(make_result("remote"))
+
+    scans = []
+    process_children, sample_process = monitor_services.process_children, monitor_services.sample_process
+
+    def scan_fake_proc(root=str(proc)):
+        scans.append(root)
+        return process_children(root)
+
+    def sample_fake_proc(name, pid_file, children=None):
+        return sample_process(name, pid_file, proc=str(proc), children=children)
+
+    monkeypatch.setattr(monitor_services, "process_children", scan_fake_proc)
+    monkeypatch.setattr(monitor_services, "sample_process", sample_fake_proc)
+    monitor_services.sample_processes(targets, results)
+
+    assert len(scans) == 1
+    assert results[0]["process"]["processes"] == 3
+    assert results[0]["process"]["rss"] == 1750 * 1024
+    assert results[0]["process"]["threads"] == 6
+    assert results[0]["process"]["fds"] == 3
+    assert results[1]["process"]["processes"] == 1
+    assert results[2]["process"] is None
+    assert "process" not in results[3]
+    assert monitor_services.process_tree(100, str(proc)) == [100, 101, 102]
@@ -0,0 +1,201 @@
+"""
+Tests for the request handling of the PyLLM API (docker/pyllm_api_fix.py)
+against the stub ModelManager of load_test_pyllm.
+"""
+
+import json
+import time
+import threading
+
+import requests
+
+from load_test_pyllm import StubModelManager, free_port, load_api
+
+
+def test_invalid_stream_format_is_rejected_before_generation(pyllm_server, pyllm_server_api):
+    """Test that an unknown stream_format leaves no flight or cache entry behind."""
+    payload = {"prompt": "hello", "temperature": 0.0, "stream": True, "stream_format": "xml"}
+    response = requests.post(f"{pyllm_server}/query", json=payload)
+    assert response.status_code == 400
+    
+    stats = requests.get(f"{pyllm_server}/stats").json()
+    assert stats["single_flight"]["flights"] == 0
+    assert stats["single_flight"]["in_flight"] == 0
+    assert stats["cache"]["misses"] == 0
+    
+    response = requests.post(f"{pyllm_server}/query", json={**payload, "stream_format": "ndjson"})
+    assert response.status_code == 200
+    stats = requests.get(f"{pyllm_server}/stats").json()
+    assert stats["single_flight"]["coalesced"] == 0
+    assert stats["single_flight"]["in_flight"] == 0
+
+
+def test_invalid_stream_format_fix_code(pyllm_server):
+    """Test that /fix-code validates stream_format before generating."""
+    payload = {"code": "x = 1\n", "error_message": "wrong", "is_logic_error": True,
+               "stream": True, "stream_format": "xml"}
+    response = requests.post(f"{pyllm_server}/fix-code", json=payload)
+    assert response.status_code == 400
+    
+    stats = requests.get(f"{pyllm_server}/stats").json()
+    assert stats["single_flight"]["flights"] == 0
+    assert stats["cache"]["misses"] == 0
+
+
+def test_fix_code_diff_that_does_not_apply(pyllm_server, monkeypatch):
+    """Test that a diff answer that does not match the code gives HTTP 422."""
+    monkeypatch.setattr(StubModelManager, "generate",
+                        lambda self, prompt, max_tokens: "```diff\n@@ -1 +1 @@\n-missing\n+x\n```")
+    payload = {"code": "x = 1\n", "error_message": "wrong", "is_logic_error": True, "response_format": "diff"}
+    
+    assert requests.post(f"{pyllm_server}/fix-code", json=payload).status_code == 422
+    assert requests.post(f"{pyllm_server}/fix-code", json={**payload, "strategy": "race"}).status_code == 422
+    
+    lines = requests.post(f"{pyllm_server}/fix-code",
+                          json={**payload, "stream": True, "stream_format": "ndjson"}).text.splitlines()
+    assert json.loads(lines[-1]) == {"type": "error", "detail": "Hunk 1 does not match the code"}
+
+
+def test_fix_code_diff(pyllm_server, monkeypatch):
+    """Test the patch and fixed code of a diff answer."""
+    monkeypatch.setattr(StubModelManager, "generate",
+                        lambda self, prompt, max_tokens: "```diff\n@@ -1 +1 @@\n-x = 1\n+x = 2\n```")
+    payload = {"code": "x = 1\n", "error_message": "wrong", "is_logic_error": True,
+               "response_format": "diff", "include_code": True}
+    
+    result = requests.post(f"{pyllm_server}/fix-code", json=payload).json()
+    assert result == {"patch": "--- a/code.py\n+++ b/code.py\n@@ -1 +1 @@\n-x = 1\n+x = 2\n",
+                      "compiled": True, "fixed_code": "x = 2\n", "source": "model"}
+
+
+def parse_sse(text):
+    """Return (event, data) of every Server-Sent Event of a response body."""
+    events = []
+    for block in text.split("\n\n"):
+        if block:
+            event, data = block.split("\n")
+            assert event.startswith("event: ") and data.startswith("data: ")
+            events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_query_stream_sse(pyllm_server):
+    """Test the framing of a Server-Sent Events stream and its done event."""
+    response = requests.post(f"{pyllm_server}/query", json={"prompt": "say something long", "max_tokens": 20,
+                                                           "stream": True, "cache": False})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.headers["x-cache"] == "BYPASS"
+    
+    events = parse_sse(response.text)
+    assert [event for event, _ in events[:-1]] == ["chunk"] * (len(events) - 1)
+    assert len(events) > 2
+    event, done = events[-1]
+    assert event == "done"
+    text = "".join(data["text"] for _, data in events[:-1])
+    assert done["timings"]["output_chars"] == len(text)
+    assert set(done["timings"]) == {"queue_wait", "time_to_first_chunk", "total", "output_chars"}
+
+
+def test_query_stream_ndjson(pyllm_server):
+    """Test the framing of an NDJSON stream and that it matches the complete response."""
+    payload = {"prompt": "say something long", "max_tokens": 20, "cache": False}
+    response = requests.post(f"{pyllm_server}/query", json={**payload, "stream": True, "stream_format": "ndjson"})
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert response.text.endswith("\n")
+    
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [event["type"] for event in events] == ["chunk"] * (len(events) - 1) + ["done"]
+    text = "".join(event["text"] for event in events[:-1])
+    assert text == requests.post(f"{pyllm_server}/query", json=payload).json()["response"]
+
+
+def test_query_stream_client_disconnect(pyllm_server, monkeypatch):
+    """Test that a client disconnect closes the backend iterator."""
+    state = {"sent": 0, "closed": threading.Event()}
+    
+    def query_model_stream(self, prompt, model="llama3", max_tokens=1000, temperature=0.7):
+        try:
+            for i in range(500):
+                time.sleep(0.01)
+                state["sent"] += 1
+                yield f"t{i} "
+        finally:
+            state["closed"].set()
+    
+    monkeypatch.setattr(StubModelManager, "query_model_stream", query_model_stream)
+    response = requests.post(f"{pyllm_server}/query", stream=True,
+                             json={"prompt": "p", "stream": True, "stream_format": "ndjson", "cache": False})
+    lines = response.iter_lines()
+    assert json.loads(next(lines))["type"] == "chunk"
+    response.close()
+    
+    assert state["closed"].wait(5)
+    assert state["sent"] < 500
+
+
+class SlowWarmUpManager(StubModelManager):
+    """Stub ModelManager whose generations take long enough to observe the warm-up."""
+    
+    instances = 0
+    warm_up_calls = []
+    
+    def __init__(self):
+        SlowWarmUpManager.instances += 1
+        time.sleep(0.05)
+    
+    def query_model(self, prompt, model="llama3", max_tokens=1000, temperature=0.7):
+        self.warm_up_calls.append((prompt, model, max_tokens))
+        if model == "broken":
+            raise RuntimeError("model not found")
+        time.sleep(0.5)
+        return "hi"
+
+
+def test_ready_after_warm_up():
+    """Test that /ready answers 503 until the models are warmed up, and /health at once."""
+    import uvicorn
+    
+    SlowWarmUpManager.instances = 0
+    SlowWarmUpManager.warm_up_calls = []
+    api = load_api(SlowWarmUpManager)
+    api.PRELOAD_MODELS = ["llama3", "broken"]
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 10
+        while not server.started and time.time() < deadline:
+            time.sleep(0.01)
+        
+        response = requests.get(f"{base_url}/ready")
+        assert response.status_code == 503
+        assert response.json()["status"] == "warming_up"
+        assert requests.get(f"{base_url}/health").status_code == 200
+        
+        while requests.get(f"{base_url}/ready").status_code == 503 and time.time() < deadline:
+            time.sleep(0.05)
+        result = requests.get(f"{base_url}/ready").json()
+        assert result["status"] == "ready"
+        assert result["models"] == {"llama3": "ok", "broken": "model not found"}
+        assert result["warmup_seconds"] >= 0.5
+        
+        requests.post(f"{base_url}/query", json={"prompt": "x"})
+        assert SlowWarmUpManager.instances == 1
+        assert [call[1:] for call in SlowWarmUpManager.warm_up_calls[:2]] == [("llama3", 1), ("broken", 1)]
+        assert api.model_manager is not None
+    finally:
+        server.should_exit = True
+
+
+def test_get_model_manager_builds_once():
+    """Test that concurrent first uses build a single model manager."""
+    api = load_api(SlowWarmUpManager)
+    SlowWarmUpManager.instances = 0
+    threads = [threading.Thread(target=api.get_model_manager) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert SlowWarmUpManager.instances == 1
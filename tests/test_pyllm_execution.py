@@ -0,0 +1,305 @@
+"""
+Tests for how the PyLLM API (docker/pyllm_api_fix.py) runs backend calls:
+concurrency limits, streaming, batching and the race strategy. Coroutines
+are driven with asyncio.run against the stub ModelManager of load_test_pyllm.
+"""
+
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+
+
+class ConcurrencyProbe:
+    """Blocking backend call that records how many calls overlap."""
+    
+    def __init__(self, duration=0.05):
+        self.duration = duration
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+    
+    @contextmanager
+    def running(self):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active -= 1
+    
+    def __call__(self, value, *args):
+        with self.running():
+            time.sleep(self.duration)
+        return value
+
+
+def test_model_semaphore_limits(pyllm_api):
+    """Test the default and per-model limits of concurrent backend calls."""
+    pyllm_api.MODEL_CONCURRENCY = 3
+    pyllm_api.MODEL_LIMITS = {"small": 1}
+    limited, default = ConcurrencyProbe(), ConcurrencyProbe()
+    
+    async def run():
+        calls = [pyllm_api.run_model_call("small", limited, i) for i in range(4)]
+        calls += [pyllm_api.run_model_call("llama3", default, i) for i in range(8)]
+        return await asyncio.gather(*calls)
+    
+    assert asyncio.run(run()) == list(range(4)) + list(range(8))
+    assert limited.peak == 1
+    assert default.peak == 3
+
+
+def test_run_model_call_keeps_event_loop_free(pyllm_api):
+    """Test that blocking calls run in the backend pool and record their queue wait."""
+    pyllm_api.MODEL_LIMITS = {"small": 1}
+    probe = ConcurrencyProbe(duration=0.1)
+    timings = [{}, {}]
+    
+    async def run():
+        ticks = 0
+        calls = asyncio.gather(*[pyllm_api.run_model_call("small", probe, i, timings=timings[i]) for i in range(2)])
+        while not calls.done():
+            ticks += 1
+            await asyncio.sleep(0.01)
+        return ticks
+    
+    assert asyncio.run(run()) >= 10
+    waits = sorted(t["queue_wait"] for t in timings)
+    assert waits[0] < 0.05
+    assert waits[1] >= 0.09
+
+
+def test_cancelled_call_keeps_its_slot(pyllm_api):
+    """Test that a cancelled call holds its model slot until the backend returns."""
+    pyllm_api.MODEL_LIMITS = {"m": 1}
+    probe = ConcurrencyProbe(duration=0.2)
+    
+    async def run():
+        cancelled = asyncio.ensure_future(pyllm_api.run_model_call("m", probe, 1))
+        await asyncio.sleep(0.05)
+        cancelled.cancel()
+        timings = {}
+        result = await pyllm_api.run_model_call("m", probe, 2, timings=timings)
+        return cancelled.cancelled(), result, timings["queue_wait"]
+    
+    cancelled, result, queue_wait = asyncio.run(run())
+    assert cancelled
+    assert result == 2
+    assert queue_wait >= 0.1
+    assert probe.peak == 1
+
+
+def test_cancelled_flight_keeps_its_slot(pyllm_api):
+    """Test that a flight cancelled by its last waiter holds its slot until the backend returns."""
+    pyllm_api.MODEL_LIMITS = {"llama3": 1}
+    probe = ConcurrencyProbe(duration=0.2)
+    pyllm_api.model_manager.query_model = probe
+    
+    async def run():
+        waiter = asyncio.ensure_future(pyllm_api.generate("query", "llama3", "a", 10, 0.0, (False, False)))
+        await asyncio.sleep(0.05)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        return await pyllm_api.generate("query", "llama3", "b", 10, 0.0, (False, False))
+    
+    assert asyncio.run(run()) == ("b", "BYPASS")
+    assert pyllm_api.single_flight.stats()["cancelled"] == 1
+    assert probe.peak == 1
+
+
+class RecordingStream:
+    """query_model_stream of a backend that records how far it got and whether it was closed."""
+    
+    def __init__(self, chunks=200, delay=0.01):
+        self.chunks = chunks
+        self.delay = delay
+        self.sent = 0
+        self.closed = threading.Event()
+    
+    def __call__(self, prompt, model="llama3", max_tokens=1000, temperature=0.7):
+        try:
+            for i in range(self.chunks):
+                time.sleep(self.delay)
+                self.sent += 1
+                yield f"t{i} "
+        finally:
+            self.closed.set()
+
+
+def test_stream_model_closes_backend_iterator(pyllm_api):
+    """Test that closing the stream early stops the backend and frees its slot."""
+    stream = RecordingStream()
+    pyllm_api.model_manager.query_model_stream = stream
+    pyllm_api.MODEL_LIMITS = {"llama3": 1}
+    
+    async def run():
+        received = []
+        chunks = pyllm_api.stream_model("llama3", "prompt", 100, 0.0)
+        async for chunk in chunks:
+            received.append(chunk)
+            if len(received) == 3:
+                break
+        await chunks.aclose()
+        return received, pyllm_api.get_model_semaphore("llama3").locked()
+    
+    received, locked = asyncio.run(run())
+    assert received == ["t0 ", "t1 ", "t2 "]
+    assert stream.closed.is_set()
+    assert stream.sent < 10
+    assert not locked
+
+
+class RecordingBatches:
+    """query_model_batch of a backend that records the prompts of every batch."""
+    
+    def __init__(self):
+        self.batches = []
+    
+    def __call__(self, prompts, model="llama3", max_tokens=1000, temperature=0.7):
+        self.batches.append(list(prompts))
+        return [f"answer to {prompt}" for prompt in prompts]
+
+
+def test_batcher_groups_concurrent_requests(pyllm_api):
+    """Test that requests within the window share a batch and full batches go at once."""
+    backend = RecordingBatches()
+    pyllm_api.model_manager.query_model_batch = backend
+    batcher = pyllm_api.MicroBatcher(window=0.05, max_batch=3)
+    
+    async def run():
+        return await asyncio.gather(*[batcher.submit("llama3", f"p{i}", 10, 0.0) for i in range(5)])
+    
+    assert asyncio.run(run()) == [f"answer to p{i}" for i in range(5)]
+    assert backend.batches == [["p0", "p1", "p2"], ["p3", "p4"]]
+    stats = batcher.stats()
+    assert stats["batches"] == 2
+    assert stats["batch_size"]["histogram"] == {"2": 1, "3": 1}
+
+
+def test_batcher_separates_sampling_parameters(pyllm_api):
+    """Test that only requests with the same model and parameters are batched together."""
+    backend = RecordingBatches()
+    pyllm_api.model_manager.query_model_batch = backend
+    batcher = pyllm_api.MicroBatcher(window=0.02, max_batch=8)
+    
+    async def run():
+        return await asyncio.gather(batcher.submit("llama3", "a", 10, 0.0), batcher.submit("llama3", "b", 20, 0.0),
+                                    batcher.submit("llama3", "c", 10, 0.0))
+    
+    asyncio.run(run())
+    assert sorted(backend.batches) == [["a", "c"], ["b"]]
+
+
+def test_batcher_drops_cancelled_requests(pyllm_api):
+    """Test that requests cancelled before the flush are not sent to the backend."""
+    backend = RecordingBatches()
+    pyllm_api.model_manager.query_model_batch = backend
+    batcher = pyllm_api.MicroBatcher(window=0.05, max_batch=8)
+    
+    async def run():
+        tasks = [asyncio.ensure_future(batcher.submit("llama3", f"p{i}", 10, 0.0)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        tasks[1].cancel()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+    
+    results = asyncio.run(run())
+    assert results[0] == "answer to p0" and results[2] == "answer to p2"
+    assert isinstance(results[1], asyncio.CancelledError)
+    assert backend.batches == [["p0", "p2"]]
+
+
+def test_batcher_backend_error(pyllm_api):
+    """Test that a failed or short batch fails each of its requests."""
+    pyllm_api.model_manager.query_model_batch = lambda prompts, *args: prompts[:1]
+    batcher = pyllm_api.MicroBatcher(window=0.01, max_batch=8)
+    
+    async def run():
+        return await asyncio.gather(*[batcher.submit("llama3", f"p{i}", 10, 0.0) for i in range(2)],
+                                    return_exceptions=True)
+    
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(run()))
+
+
+def test_batcher_without_batch_backend(pyllm_api):
+    """Test that backends without query_model_batch get one call per request."""
+    batcher = pyllm_api.MicroBatcher(window=0.01, max_batch=8)
+    
+    async def run():
+        return await asyncio.gather(*[batcher.submit("llama3", f"p{i}", 10, 0.0) for i in range(3)])
+    
+    assert len(asyncio.run(run())) == 3
+    assert batcher.stats()["single_calls"] == 3
+    assert batcher.stats()["batches"] == 0
+
+
+def test_race_fixes_cancels_losing_attempts(pyllm_api):
+    """Test that the first fix that compiles wins and the other generations stop."""
+    streams = {"slow 1": RecordingStream(chunks=300), "slow 3": RecordingStream(chunks=300)}
+    
+    def query_model_stream(prompt, model="llama3", max_tokens=1000, temperature=0.7):
+        if prompt in streams:
+            yield "```python\n"
+            yield from streams[prompt](prompt)
+        else:
+            time.sleep(0.05)
+            yield "```python\nx = 1\n```\nDone."
+    
+    pyllm_api.model_manager.query_model_stream = query_model_stream
+    prompts = {1: "slow 1", 2: "fast 2", 3: "slow 3"}
+    
+    async def run():
+        start = time.perf_counter()
+        result = await pyllm_api.race_fixes(prompts, (False, False))
+        elapsed = time.perf_counter() - start
+        stopped = await asyncio.to_thread(lambda: all(s.closed.wait(2) for s in streams.values()))
+        return result, elapsed, stopped
+    
+    result, elapsed, stopped = asyncio.run(run())
+    assert result["attempt"] == 2
+    assert result["fixed_code"] == "x = 1"
+    assert result["compiled"] is True
+    assert elapsed < 1.0
+    assert stopped
+    assert all(stream.sent < 300 for stream in streams.values())
+    assert pyllm_api.single_flight.stats()["in_flight"] == 0
+
+
+def test_race_fixes_without_compiling_fix(pyllm_api):
+    """Test that the lowest attempt is returned when no fix compiles."""
+    pyllm_api.model_manager.query_model_stream = lambda prompt, *args: iter([f"```python\ndef {prompt}(:\n```"])
+    
+    result = asyncio.run(pyllm_api.race_fixes({1: "a", 2: "b", 3: "c"}, (False, False)))
+    assert result["attempt"] == 1
+    assert result["compiled"] is False
+    assert result["fixed_code"] == "def a(:"
+
+
+def test_race_losers_keep_slots_without_streaming(pyllm_api):
+    """Test that losing attempts of a non-streaming backend hold their slots until they return."""
+    pyllm_api.MODEL_LIMITS = {"llama3": 3}
+    pyllm_api.model_manager.query_model_stream = None
+    probe = ConcurrencyProbe()
+    
+    def query_model(prompt, model="llama3", max_tokens=1000, temperature=0.7):
+        with probe.running():
+            time.sleep(0.3 if prompt.startswith("slow") else 0.02)
+        return "```python\nx = 1\n```" if prompt == "fast" else "```python\ndef f(:\n```"
+    
+    pyllm_api.model_manager.query_model = query_model
+    
+    async def run():
+        result = await pyllm_api.race_fixes({1: "slow 1", 2: "fast", 3: "slow 3"}, (False, False))
+        timings = [{}, {}]
+        await asyncio.gather(*[pyllm_api.run_model_call("llama3", query_model, f"slow after {i}", timings=timings[i])
+                               for i in range(2)])
+        return result, sorted(t["queue_wait"] for t in timings)
+    
+    result, waits = asyncio.run(run())
+    assert result["attempt"] == 2
+    assert probe.peak == 3
+    assert waits[0] < 0.1
+    assert waits[1] >= 0.15
+    assert not pyllm_api.get_model_semaphore("llama3").locked()
@@ -0,0 +1,344 @@
+"""
+Tests for the code handling helpers of the PyLLM /fix-code endpoint
+(docker/pyllm_api_fix.py).
+"""
+
+import asyncio
+
+import pytest
+
+
+ANSWER = "Here is the fix:\n```python\ndef f(x):\n    return x + 1\n```\nThe function now adds one.\n```python\nignored()\n```"
+
+
+def test_fence_parser_split_at_every_position(pyllm_module):
+    """Test fences split across two chunks at any position."""
+    expected = pyllm_module.extract_python_code(ANSWER)
+    for split in range(len(ANSWER) + 1):
+        parser = pyllm_module.CodeFenceParser()
+        done = parser.feed(ANSWER[:split]) | parser.feed(ANSWER[split:])
+        assert done
+        assert parser.result() == expected
+
+
+def test_fence_parser_single_characters(pyllm_module):
+    """Test a completion streamed one character at a time."""
+    parser = pyllm_module.CodeFenceParser()
+    done_at = next(i for i, char in enumerate(ANSWER) if parser.feed(char))
+    
+    assert ANSWER[:done_at + 1].endswith("\n```")
+    assert parser.result() == "def f(x):\n    return x + 1"
+
+
+def test_fence_parser_bare_fence_and_unclosed_block(pyllm_module):
+    """Test fences without a language and output that ends inside a block."""
+    parser = pyllm_module.CodeFenceParser()
+    assert parser.feed("```\nx = 1\n") is False
+    assert parser.result() == pyllm_module.extract_python_code("```\nx = 1\n")
+    assert parser.feed("```") is True
+    assert parser.result() == "x = 1"
+
+
+def test_fence_parser_diff_fence(pyllm_module):
+    """Test a parser for diff blocks split inside the opening fence."""
+    parser = pyllm_module.CodeFenceParser(*pyllm_module.DIFF_FENCE)
+    assert parser.feed("Patch:\n``") is False
+    assert parser.feed("`di") is False
+    assert parser.feed("ff\n@@ -1 +1 @@\n-a\n+b\n`") is False
+    assert parser.feed("``\nmore text") is True
+    assert parser.code == "@@ -1 +1 @@\n-a\n+b"
+
+
+def test_until_code_block_stops_and_closes(pyllm_module):
+    """Test that the stream stops after the first block and closes its source."""
+    chunks = [ANSWER[i:i + 5] for i in range(0, len(ANSWER), 5)]
+    state = {"sent": 0, "closed": False}
+    
+    async def source():
+        try:
+            for chunk in chunks:
+                state["sent"] += 1
+                yield chunk
+        finally:
+            state["closed"] = True
+    
+    async def collect():
+        return [chunk async for chunk in pyllm_module.until_code_block(source())]
+    
+    received = asyncio.run(collect())
+    text = "".join(received)
+    
+    assert state["closed"]
+    assert state["sent"] == len(received) < len(chunks)
+    assert "The function now adds one" not in text
+    assert pyllm_module.extract_python_code(text) == "def f(x):\n    return x + 1"
+
+
+@pytest.mark.parametrize("code, expected, repairs", [
+    ("def f(x)\n    return x\n", "def f(x):\n    return x\n", ["missing_colon"]),
+    ("if x  # check x\n    pass\n", "if x:  # check x\n    pass\n", ["missing_colon"]),
+    ("print(max(1, 2)\n", "print(max(1, 2))\n", ["unclosed_bracket"]),
+    ("x = [1,\n     2\ny = 3\n", "x = [1,\n     2]\ny = 3\n", ["unclosed_bracket"]),
+    ("x = [1, (2, 3]\n", "x = [1, (2, 3)]\n", ["mismatched_bracket"]),
+    ("x = foo(1))\n", "x = foo(1)\n", ["unmatched_bracket"]),
+    ("s = ')'\ny = 2)\n", "s = ')'\ny = 2\n", ["unmatched_bracket"]),
+])
+def test_repair_locally_brackets_and_colons(pyllm_module, code, expected, repairs):
+    """Test the colon and bracket repairs."""
+    assert pyllm_module.repair_locally(code) == (expected, repairs)
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("def f():\nreturn 1\n", "def f():\n    return 1\n"),
+    ("def f():\n    # todo\n", "def f():\n    pass\n    # todo\n"),
+    ("x = 1\n    y = 2\n", "x = 1\ny = 2\n"),
+    ("if x:\n        a = 1\n      b = 2\n", "if x:\n        a = 1\n        b = 2\n"),
+])
+def test_repair_locally_indentation(pyllm_module, code, expected):
+    """Test missing, unexpected and inconsistent indentation."""
+    fixed_code, repairs = pyllm_module.repair_locally(code)
+    
+    assert fixed_code == expected
+    assert set(repairs) == {"indentation"}
+
+
+def test_repair_locally_tabs(pyllm_module):
+    """Test that mixed tabs and spaces are expanded like the tokenizer does."""
+    fixed_code, repairs = pyllm_module.repair_locally("if x:\n        a = 1\n\tb = 2\n")
+    
+    assert fixed_code == "if x:\n        a = 1\n        b = 2\n"
+    assert repairs == ["tabs"]
+
+
+def test_repair_locally_gives_up(pyllm_module):
+    """Test that errors without a deterministic repair are left to the model."""
+    assert pyllm_module.repair_locally("x = = 1\n") == (None, [])
+    assert pyllm_module.repair_locally("def f(:\n    pass\n")[0] is None
+
+
+def test_local_fix(pyllm_module):
+    """Test the /fix-code response of a local repair."""
+    result = pyllm_module.local_fix("def f(x)\n    return x\n", "SyntaxError: expected ':'")
+    
+    assert result == {"fixed_code": "def f(x):\n    return x\n", "full_response": "",
+                      "source": "local", "repairs": ["missing_colon"]}
+
+
+def test_local_fix_already_compiling(pyllm_module):
+    """Test code that compiles: fixed only when the reported error was a syntax error."""
+    code = "x = 1\n"
+    
+    assert pyllm_module.local_fix(code, 'File "a.py", line 1\nSyntaxError: invalid syntax')["fixed_code"] == code
+    assert pyllm_module.local_fix(code, "NameError: name 'y' is not defined") is None
+
+
+MODULE = '''import os
+from typing import (
+    List,
+    Optional,
+)
+import json
+
+
+class Store:
+    """A store."""
+
+    @staticmethod
+    @cache
+    def load(path) -> Optional[List]:
+        with open(path) as f:
+            return json.load(f)
+
+    def keys(self):
+        return []
+
+
+def main():
+    return Store.load("x")
+'''
+
+
+def test_slice_with_decorators_and_multiline_imports(pyllm_module):
+    """Test that the slice holds the decorated method and the imports it uses."""
+    code_slice = pyllm_module.slice_code(MODULE, 'File "store.py", line 15, in load')
+    
+    assert (code_slice.start, code_slice.end) == (11, 15)
+    assert code_slice.code() == (
+        "from typing import (\n    List,\n    Optional,\n)\nimport json\n\n\n"
+        "@staticmethod\n@cache\ndef load(path) -> Optional[List]:\n"
+        "    with open(path) as f:\n        return json.load(f)"
+    )
+
+
+def test_slice_error_renumbering(pyllm_module):
+    """Test that error lines inside the slice are renumbered to the code sent."""
+    code_slice = pyllm_module.slice_code(MODULE, "line 15")
+    sent = code_slice.code().split("\n")
+    
+    mapped = code_slice.map_error('File "store.py", line 15, in load\nFile "store.py", line 24, in main')
+    line = pyllm_module.error_line_number(mapped.split("\n")[0])
+    
+    assert line == 11
+    assert sent[line - 1] == "    with open(path) as f:"
+    assert mapped.endswith("line 24, in main")
+
+
+def test_slice_outside_blocks(pyllm_module):
+    """Test that errors outside any function or class are not sliced."""
+    assert pyllm_module.slice_code(MODULE, "line 7") is None
+    assert pyllm_module.slice_code(MODULE, "no line number") is None
+
+
+def test_slice_of_code_that_does_not_parse(pyllm_module):
+    """Test the indentation fallback on code with a syntax error."""
+    code = "import os\n\ndef f(x)\n    return os.path.join(x)\n\ny = 1\n"
+    code_slice = pyllm_module.slice_code(code, "line 3")
+    
+    assert (code_slice.start, code_slice.end) == (2, 3)
+    assert code_slice.code() == "import os\n\n\ndef f(x)\n    return os.path.join(x)"
+
+
+def test_splice_round_trip(pyllm_module):
+    """Test that splicing the unchanged slice gives back the original code."""
+    code_slice = pyllm_module.slice_code(MODULE, "line 15")
+    
+    assert code_slice.splice(code_slice.code()) == MODULE
+
+
+def test_splice_with_imports_added_by_the_model(pyllm_module):
+    """Test that new imports of the fix go after the file's last import."""
+    code_slice = pyllm_module.slice_code(MODULE, "line 15")
+    fix = (
+        "import sys\nfrom typing import (\n    List,\n    Optional,\n)\nfrom pathlib import (\n    Path,\n)\n"
+        "import json\n\n@staticmethod\n@cache\ndef load(path) -> Optional[List]:\n"
+        "    return json.loads(Path(path).read_text() or sys.stdin.read())"
+    )
+    lines = code_slice.splice(fix).split("\n")
+    
+    assert lines[:10] == ["import os", "from typing import (", "    List,", "    Optional,", ")", "import json",
+                          "import sys", "from pathlib import (", "    Path,", ")"]
+    assert "    @staticmethod" in lines
+    assert "        return json.loads(Path(path).read_text() or sys.stdin.read())" in lines
+    assert lines.count("import json") == 1
+    assert "    def keys(self):" in lines
+
+
+CODE = "import os\n\n\ndef f(x):\n    y = x + 1\n\n    return y * 2\n\n\ndef g(a):\n    return a - 1\n"
+
+
+def test_apply_unified_diff(pyllm_module):
+    """Test a diff with file headers and two hunks."""
+    diff = (
+        "--- a/code.py\n+++ b/code.py\n"
+        "@@ -4,3 +4,3 @@\n def f(x):\n-    y = x + 1\n+    y = x + 2\n \n"
+        "@@ -10,2 +10,2 @@\n def g(a):\n-    return a - 1\n+    return a + 1\n"
+    )
+    assert pyllm_module.apply_unified_diff(CODE, diff) == CODE.replace("x + 1", "x + 2").replace("a - 1", "a + 1")
+
+
+def test_apply_unified_diff_blank_context_without_space(pyllm_module):
+    """Test empty context lines that lost their leading space, and trailing whitespace."""
+    diff = "@@ -5,3 +5,3 @@\n     y = x + 1   \n\n-    return y * 2\n+    return y * 3\n\n"
+    
+    assert pyllm_module.apply_unified_diff(CODE, diff) == CODE.replace("y * 2", "y * 3")
+
+
+def test_apply_unified_diff_wrong_line_numbers(pyllm_module):
+    """Test that hunks are placed by their context, not their header."""
+    code = "a\nb\nc\nb\nc\n"
+    
+    assert pyllm_module.apply_unified_diff(code, "@@ -1,2 +1,2 @@\n b\n-c\n+C\n") == "a\nb\nC\nb\nc\n"
+    assert pyllm_module.apply_unified_diff(code, "@@ -4,2 +4,2 @@\n b\n-c\n+C\n") == "a\nb\nc\nb\nC\n"
+    assert pyllm_module.apply_unified_diff(code, "@@ -90,2 +90,2 @@\n b\n-c\n+C\n") == "a\nb\nc\nb\nC\n"
+
+
+@pytest.mark.parametrize("diff", [
+    "@@ -10,2 +10,2 @@\n def g(a):\n-    return a * 1\n+    return a + 1\n",
+    "--- a/code.py\n+++ b/code.py\n",
+    "@@ -10,2 +10,2 @@\n def g(a):\n-    return a - 1\n+    return a + 1\n"
+    "@@ -4,2 +4,2 @@\n def f(x):\n-    y = x + 1\n+    y = x + 2\n",
+])
+def test_apply_unified_diff_does_not_apply(pyllm_module, diff):
+    """Test unmatched context, missing hunks and hunks out of order."""
+    with pytest.raises(pyllm_module.PatchError):
+        pyllm_module.apply_unified_diff(CODE, diff)
+
+
+def test_apply_model_diff(pyllm_module):
+    """Test diffs in a fenced answer, and answers with code instead of a diff."""
+    answer = "Fix:\n```diff\n@@ -11 +11 @@\n-    return a - 1\n+    return a + 1\n```\nDone."
+    
+    assert pyllm_module.apply_model_diff(CODE, answer) == CODE.replace("a - 1", "a + 1")
+    assert pyllm_module.apply_model_diff(CODE, "```python\nx = 1\n```") == "x = 1"
+
+
+def test_make_patch(pyllm_module):
+    """Test that patches ignore a missing final newline and apply back."""
+    fixed_code = CODE.replace("a - 1", "a + 1").rstrip("\n")
+    patch = pyllm_module.make_patch(CODE, fixed_code)
+    
+    assert patch.startswith("--- a/code.py\n+++ b/code.py\n@@ -8,4 +8,4 @@\n")
+    assert "-    return a - 1\n+    return a + 1\n" in patch
+    assert pyllm_module.apply_unified_diff(CODE, patch) == CODE.replace("a - 1", "a + 1")
+    assert pyllm_module.make_patch(CODE, CODE.rstrip("\n")) == ""
+
+
+def test_fix_max_tokens(pyllm_module):
+    """Test the floor, the ceiling and the smaller budget of diff answers."""
+    assert pyllm_module.estimate_tokens("") == 0
+    assert pyllm_module.estimate_tokens("abcde") == 2
+    assert pyllm_module.fix_max_tokens("x = 1\n") == pyllm_module.MIN_FIX_TOKENS
+    assert pyllm_module.fix_max_tokens("x" * 4000) == 1000 * 5 // 4 + 64
+    assert pyllm_module.fix_max_tokens("x" * 4000, "diff") == (1000 * 5 // 4 + 64) // 2
+    assert pyllm_module.fix_max_tokens("x" * 100000) == pyllm_module.MAX_FIX_TOKENS
+    assert pyllm_module.fix_max_tokens("x" * 100000, "diff") == pyllm_module.MAX_FIX_TOKENS
+
+
+def make_traceback(frames):
+    lines = ["Traceback (most recent call last):"]
+    for i in range(frames):
+        lines += [f'  File "m.py", line {i + 1}, in f{i}', f"    f{i + 1}(x)"]
+    return "\n".join(lines + ["RecursionError: maximum recursion depth exceeded"])
+
+
+def test_trim_error_message_within_budget(pyllm_module):
+    """Test that messages up to the budget are kept unchanged."""
+    message = make_traceback(3)
+    budget = pyllm_module.estimate_tokens(message)
+    
+    assert pyllm_module.trim_error_message(message, budget) == message
+    assert pyllm_module.trim_error_message(message, budget - 1) != message
+
+
+def test_trim_error_message_traceback(pyllm_module):
+    """Test that long tracebacks keep their first line, innermost frames and exception."""
+    message = make_traceback(500)
+    trimmed = pyllm_module.trim_error_message(message, 100)
+    lines = trimmed.split("\n")
+    
+    assert len(trimmed) <= 100 * pyllm_module.CHARS_PER_TOKEN
+    assert lines[0] == "Traceback (most recent call last):"
+    assert lines[-1] == "RecursionError: maximum recursion depth exceeded"
+    assert lines[2].startswith('  File "m.py"')
+    assert lines[-3:-1] == ['  File "m.py", line 500, in f499', "    f500(x)"]
+    omitted = int(lines[1].split()[1])
+    assert omitted + len(lines) - 1 == len(message.split("\n"))
+
+
+def test_trim_error_message_without_lines(pyllm_module):
+    """Test that messages without a traceback keep their beginning and end."""
+    message = "a" * 1000 + "b" * 1000
+    trimmed = pyllm_module.trim_error_message(message, 100)
+    
+    assert trimmed.startswith("a" * 200) and trimmed.endswith("b" * 200)
+    assert "\n...\n" in trimmed
+    assert len(trimmed) <= 100 * pyllm_module.CHARS_PER_TOKEN + len("\n...\n")
+
+
+def test_build_fix_prompt_trims_error_message(pyllm_module):
+    """Test that prompts carry the trimmed error message and unindented code."""
+    prompt = pyllm_module.build_fix_prompt("x = 1\ny = 2", make_traceback(2000), "syntax")
+    
+    assert "```python\nx = 1\ny = 2\n```" in prompt
+    assert "lines omitted" in prompt
+    assert pyllm_module.estimate_tokens(prompt) < pyllm_module.ERROR_MESSAGE_TOKENS + 200
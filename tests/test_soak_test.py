@@ -0,0 +1,38 @@
+"""
+Tests for the resource sampling and leak analysis of soak_test.py.
+"""
+
+import os
+
+import soak_test
+
+LIMITS = {"max_rss_slope": 1024 * 1024, "max_fd_slope": 1, "max_latency_drift": 0.5}
+
+
+def test_process_samples_are_keyed_by_service(tmp_path):
+    """Test that the getllm PID file is sampled as the pyllm workload service."""
+    for pid_name in ("getllm", "shellama"):
+        (tmp_path / f"{pid_name}.pid").write_text(f"{os.getpid()}\n")
+
+    samples = soak_test.sample_resources(str(tmp_path))
+
+    assert sorted(samples) == ["pyllm", "shellama"]
+    assert samples["pyllm"]["rss"] > 0
+
+
+def test_analyze_joins_processes_and_latency():
+    """Test that process samples and request latency of a service share one report entry."""
+    timeline = [
+        {"elapsed": 60.0 * i,
+         "processes": {"pyllm": {"rss": 100 * 1024 * 1024, "fds": 20}},
+         "latency": {"pyllm": {"requests": 10, "errors": 0, "p50": 0.1, "p95": 0.2}}}
+        for i in range(10)
+    ]
+
+    report = soak_test.analyze(timeline, warmup=0, limits=LIMITS)
+
+    assert list(report) == ["pyllm"]
+    assert report["pyllm"]["rss_start"] == 100 * 1024 * 1024
+    assert report["pyllm"]["rss_slope"] == 0
+    assert report["pyllm"]["requests"] == 100
+    assert report["pyllm"]["violations"] == []